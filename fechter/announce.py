@@ -0,0 +1,230 @@
+# Copyright 2011 Johan Rydberg
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Announcements of addresses that have moved to this node."""
+
+import errno
+import socket
+import struct
+
+from twisted.python import log
+
+from .ping import _in_cksum
+
+
+ETH_BROADCAST = 'ff:ff:ff:ff:ff:ff'
+ETH_ALL_NODES = '33:33:00:00:00:01'
+ETH_TYPE_ARP = 0x0806
+ETH_TYPE_IPV6 = 0x86dd
+
+IPPROTO_ICMPV6 = 58
+ALL_NODES = 'ff02::1'
+ND_NEIGHBOR_ADVERT = 136
+ND_NA_FLAG_OVERRIDE = 0x20000000
+ND_OPT_TARGET_LINKADDR = 2
+
+
+def ether_aton(addr):
+    """Convert a ethernet address in form AA:BB:... to a sequence of
+    bytes.
+    """
+    return ''.join([struct.pack("B", int(nn, 16))
+                    for nn in addr.split(':')])
+
+
+def arp_frame(ether_addr, address):
+    """Build an ethernet frame holding a gratuitous ARP for
+    C{address}.
+
+    @param ether_addr: hardware address of the sending interface.
+    @type ether_addr: C{str} of 6 bytes
+    """
+    # From Wikipedia:
+    #
+    # ARP may also be used as a simple announcement protocol. This is
+    # useful for updating other hosts' mapping of a hardware address
+    # when the sender's IP address or MAC address has changed. Such an
+    # announcement, also called a gratuitous ARP message, is usually
+    # broadcast as an ARP request containing the sender's protocol
+    # address (SPA) in the target field (TPA=SPA), with the target
+    # hardware address (THA) set to zero. An alternative is to
+    # broadcast an ARP reply with the sender's hardware and protocol
+    # addresses (SHA and SPA) duplicated in the target fields
+    # (TPA=SPA, THA=SHA).
+    gratuitous_arp = [
+        # HTYPE
+        struct.pack("!h", 1),
+        # PTYPE (IPv4)
+        struct.pack("!h", 0x0800),
+        # HLEN
+        struct.pack("!B", 6),
+        # PLEN
+        struct.pack("!B", 4),
+        # OPER (reply)
+        struct.pack("!h", 2),
+        # SHA
+        ether_addr,
+        # SPA
+        socket.inet_aton(address),
+        # THA
+        ether_addr,
+        # TPA
+        socket.inet_aton(address)
+        ]
+    ether_frame = [
+        # Destination address:
+        ether_aton(ETH_BROADCAST),
+        # Source address:
+        ether_addr,
+        # Protocol
+        struct.pack("!h", ETH_TYPE_ARP),
+        # Data
+        ''.join(gratuitous_arp)
+        ]
+    return ''.join(ether_frame)
+
+
+def na_frame(ether_addr, address):
+    """Build an ethernet frame holding an unsolicited neighbor
+    advertisement for the IPv6 address C{address}.
+
+    @param ether_addr: hardware address of the sending interface.
+    @type ether_addr: C{str} of 6 bytes
+    """
+    # RFC 4861, section 7.2.6: a node that wants to inform its
+    # neighbors about a new link-layer address sends advertisements to
+    # the all-nodes multicast address, with the Solicited flag clear
+    # and the Override flag set.
+    target = socket.inet_pton(socket.AF_INET6, address)
+    destination = socket.inet_pton(socket.AF_INET6, ALL_NODES)
+    option = struct.pack("!BB", ND_OPT_TARGET_LINKADDR, 1) + ether_addr
+    icmp = (struct.pack("!BBHI", ND_NEIGHBOR_ADVERT, 0, 0,
+                        ND_NA_FLAG_OVERRIDE) + target + option)
+    pseudo_header = (target + destination
+                     + struct.pack("!I3xB", len(icmp), IPPROTO_ICMPV6))
+    checksum = _in_cksum(pseudo_header + icmp)
+    icmp = icmp[:2] + struct.pack("!H", checksum) + icmp[4:]
+    ip_header = struct.pack("!IHBB", 6 << 28, len(icmp), IPPROTO_ICMPV6,
+                            255) + target + destination
+    return (ether_aton(ETH_ALL_NODES) + ether_addr
+            + struct.pack("!H", ETH_TYPE_IPV6) + ip_header + icmp)
+
+
+def address_family(address):
+    """Return C{AF_INET6} for IPv6 addresses and C{AF_INET}
+    otherwise.
+    """
+    return socket.AF_INET6 if ':' in address else socket.AF_INET
+
+
+class Announcer(object):
+    """Send gratuitous ARPs for IPv4 addresses and unsolicited
+    neighbor advertisements for IPv6 addresses installed on this
+    node.
+
+    Addresses announced during the same reactor iteration form a
+    batch, and every batch is sent once for each delay in
+    C{schedule}, counted from the end of that iteration.  One packet
+    socket per interface is kept open and frames are built once per
+    address.
+
+    @ivar frames_sent: number of frames sent.
+    """
+
+    def __init__(self, clock, schedule=(0, 1, 2, 4)):
+        self.clock = clock
+        self.schedule = schedule
+        self.frames_sent = 0
+        self.errors = 0
+        self._sockets = {}
+        self._frames = {}
+        self._pending = set()
+        self._flush_call = None
+        self._bursts = {}
+        self._next_burst = 0
+
+    def _open_socket(self, ifname):
+        """Open a packet socket bound to C{ifname}."""
+        ether_socket = socket.socket(socket.AF_PACKET, socket.SOCK_RAW)
+        ether_socket.bind((ifname, ETH_TYPE_ARP))
+        return ether_socket
+
+    def _socket(self, ifname):
+        if ifname not in self._sockets:
+            self._sockets[ifname] = self._open_socket(ifname)
+        return self._sockets[ifname]
+
+    def _frame(self, ifname, address):
+        key = (ifname, address)
+        if key not in self._frames:
+            ether_addr = self._socket(ifname).getsockname()[4]
+            if address_family(address) == socket.AF_INET6:
+                self._frames[key] = na_frame(ether_addr, address)
+            else:
+                self._frames[key] = arp_frame(ether_addr, address)
+        return self._frames[key]
+
+    def announce(self, ifname, address):
+        """Announce that C{address} now lives on interface
+        C{ifname}.
+        """
+        self._pending.add((ifname, address))
+        if self._flush_call is None:
+            self._flush_call = self.clock.callLater(0, self._flush)
+
+    def _flush(self):
+        """Schedule the bursts of the addresses announced during the
+        last reactor iteration.
+        """
+        self._flush_call = None
+        batch, self._pending = self._pending, set()
+        for delay in self.schedule:
+            self._next_burst += 1
+            self._bursts[self._next_burst] = set(batch)
+            self.clock.callLater(delay, self._send_burst, self._next_burst)
+
+    def cancel(self, ifname, address):
+        """Stop announcing C{address}."""
+        key = (ifname, address)
+        self._pending.discard(key)
+        for burst in self._bursts.values():
+            burst.discard(key)
+        self._frames.pop(key, None)
+
+    def _send_burst(self, burst_id):
+        for ifname, address in sorted(self._bursts.pop(burst_id)):
+            try:
+                self._socket(ifname).send(self._frame(ifname, address))
+            except socket.error, (err, msg):
+                self.errors += 1
+                if err == errno.EPERM:
+                    log.msg('announcements can only be sent by root')
+                else:
+                    log.msg('cannot announce %s on %s: %s' % (
+                            address, ifname, msg))
+                # The interface may have gone away; start over with a
+                # new socket next time.
+                ether_socket = self._sockets.pop(ifname, None)
+                if ether_socket is not None:
+                    ether_socket.close()
+                self._frames.pop((ifname, address), None)
+            else:
+                self.frames_sent += 1
+
+    def stats(self):
+        """Return counters as a C{dict}."""
+        return {'frames_sent': self.frames_sent, 'errors': self.errors,
+                'scheduled': len(self._pending)
+                             + sum(len(burst)
+                                   for burst in self._bursts.values())}
@@ -13,6 +13,18 @@
 # limitations under the License.
 
 
+import hashlib
+import heapq
+import json
+import math
+import struct
+
+from twisted.python import log
+
+from .index import (ASSIGNMENT_MAP, pack_assignments, resource_cost,
+    resource_group, snapshot_stamp, unpack_assignments)
+
+
 def _calculate_assignment(assignments, peers):
     """Pick a peer that should receive the next assignment.
 
@@ -23,10 +35,373 @@ def _calculate_assignment(assignments, peers):
         resources
     @type peers: sequence of C{str}
     """
-    lengths = [len([pp for pp in assignments.values()
-                    if pp == peer]) for peer in peers]
-    suggestion = peers[lengths.index(min(lengths))]
-    return suggestion
+    return _PeerLoad(assignments, peers).take()
+
+
+def _peer_weight(weights, peer):
+    """Return the weight of C{peer}.
+
+    Weights are gossiped by the peers themselves, so a weight that is
+    not a positive number is ignored and the peer gets weight C{1}.
+    """
+    try:
+        weight = float(weights.get(peer, 1))
+    except (TypeError, ValueError):
+        return 1.0
+    if not weight > 0 or math.isinf(weight):
+        return 1.0
+    return weight
+
+
+def _normalized_weights(peers, weights):
+    """Return the weight of every peer, scaled so that the mean
+    weight is C{1}.
+    """
+    if not weights:
+        return dict((peer, 1.0) for peer in peers)
+    raw = [_peer_weight(weights, peer) for peer in peers]
+    scale = len(raw) / sum(raw)
+    return dict((peer, weight * scale) for (peer, weight) in zip(peers, raw))
+
+
+class _PeerLoad(object):
+    """Priority queue over peers ordered by their load per unit of
+    weight.
+
+    The load of a peer is the sum of the costs of the resources that
+    have been assigned to it.  Ties are broken by the position of the
+    peer in the sequence given to the constructor, so the first peer
+    in the sequence wins over later peers with the same load.
+    """
+
+    def __init__(self, assignments, peers, weights=None, costs=None):
+        self._weights = _normalized_weights(peers, weights)
+        self._load = dict((peer, 0) for peer in peers)
+        costs = costs or {}
+        for resource_id, peer in assignments.items():
+            if peer in self._load:
+                self._load[peer] += costs.get(resource_id, 1)
+        self._heap = [(self._load[peer] / self._weights[peer], index, peer)
+                      for index, peer in enumerate(peers)]
+        heapq.heapify(self._heap)
+
+    def take(self, cost=1, allowed=None):
+        """Return the least loaded peer and account a resource of
+        C{cost} to it.
+
+        @param allowed: if given, a callable that returns true for
+            the peers that may take the resource.  At least one peer
+            must be allowed.
+        """
+        skipped = []
+        if allowed is not None:
+            while not allowed(self._heap[0][2]):
+                skipped.append(heapq.heappop(self._heap))
+        utilization, index, peer = self._heap[0]
+        self._load[peer] += cost
+        heapq.heapreplace(self._heap,
+            (self._load[peer] / self._weights[peer], index, peer))
+        for entry in skipped:
+            heapq.heappush(self._heap, entry)
+        return peer
+
+
+class _Spread(object):
+    """Book-keeping of the spread constraints of resource groups.
+
+    Resources that share a group are spread over the peers: no peer
+    may hold more than C{ceil(n / len(peers))} of the C{n} resources
+    in a group.  When a group has no more resources than there are
+    peers this means that they all end up on different peers.
+    Resources without a group are not constrained.
+
+    @param groups: mapping of resource id to group, for the resources
+        that belong to a group.
+    """
+
+    def __init__(self, resources, peers, groups):
+        self.groups = groups
+        sizes = {}
+        for resource_id in resources:
+            group = groups.get(resource_id)
+            if group is not None:
+                sizes[group] = sizes.get(group, 0) + 1
+        self.limits = dict((group, -(-size // len(peers)))
+                           for (group, size) in sizes.items())
+        self._counts = {}
+
+    def allows(self, resource_id, peer):
+        """Return true if C{peer} may take C{resource_id}."""
+        group = self.groups.get(resource_id)
+        if group is None:
+            return True
+        return self._counts.get((group, peer), 0) < self.limits[group]
+
+    def add(self, resource_id, peer):
+        group = self.groups.get(resource_id)
+        if group is not None:
+            key = (group, peer)
+            self._counts[key] = self._counts.get(key, 0) + 1
+
+    def remove(self, resource_id, peer):
+        group = self.groups.get(resource_id)
+        if group is not None:
+            self._counts[(group, peer)] -= 1
+
+    def keep(self, resources, assignments):
+        """Account the resources in C{assignments} to their peers,
+        oldest first, and remove the ones that would break the
+        constraints from C{assignments}.
+
+        @return: the removed resources.
+        """
+        removed = []
+        for resource_id in resources:
+            peer = assignments.get(resource_id)
+            if peer is None:
+                continue
+            if self.allows(resource_id, peer):
+                self.add(resource_id, peer)
+            else:
+                del assignments[resource_id]
+                removed.append(resource_id)
+        return removed
+
+
+def _rebalance(resources, assignments, peers, max_imbalance, weights=None,
+        costs=None, spread=None):
+    """Move as few resources as possible so that the load per unit of
+    weight of the most and the least loaded peer differs by at most
+    C{max_imbalance}.
+
+    The most recently added resource of the most loaded peer that
+    makes the peers more even, and that the least loaded peer may
+    take, is the one that is moved.  With equal weights and costs the
+    load is simply the number of resources.
+
+    @param resources: resource ids, ordered by insertion time
+    @param assignments: a complete mapping of resources to peers,
+        which is updated in place
+    @param peers: sequence of alive peers that want to receive
+        resources
+    @param weights: mapping of peer to weight, or C{None}
+    @param costs: mapping of resource id to cost for resources that
+        do not cost C{1}, or C{None}
+    @param spread: a L{_Spread} that all resources in C{assignments}
+        have been added to, or C{None}
+    """
+    weights = _normalized_weights(peers, weights)
+    costs = costs or {}
+    owned = dict((peer, []) for peer in peers)
+    load = dict((peer, 0) for peer in peers)
+    for resource_id in resources:
+        peer = assignments[resource_id]
+        owned[peer].append(resource_id)
+        load[peer] += costs.get(resource_id, 1)
+    utilization = lambda peer: load[peer] / weights[peer]
+    while True:
+        most = max(peers, key=utilization)
+        least = min(peers, key=utilization)
+        if utilization(most) - utilization(least) <= max_imbalance:
+            break
+        for n in range(len(owned[most]) - 1, -1, -1):
+            cost = costs.get(owned[most][n], 1)
+            if ((load[least] + cost) / weights[least] < utilization(most)
+                    and (spread is None
+                         or spread.allows(owned[most][n], least))):
+                break
+        else:
+            break
+        resource_id = owned[most].pop(n)
+        owned[least].append(resource_id)
+        load[most] -= cost
+        load[least] += cost
+        assignments[resource_id] = least
+        if spread is not None:
+            spread.remove(resource_id, most)
+            spread.add(resource_id, least)
+    return assignments
+
+
+def utilization(assignments, peers, weights=None, costs=None):
+    """Return the load of every peer.
+
+    @return: a C{dict} that maps every peer to a C{(load,
+        utilization)} tuple, where C{load} is the sum of the costs of
+        its resources and C{utilization} is the load per unit of
+        weight.
+    """
+    weights = _normalized_weights(peers, weights)
+    costs = costs or {}
+    load = dict((peer, 0) for peer in peers)
+    for resource_id, peer in assignments.items():
+        if peer in load:
+            load[peer] += costs.get(resource_id, 1)
+    return dict((peer, (load[peer], load[peer] / weights[peer]))
+                for peer in peers)
+
+
+def _count_moves(before, after):
+    """Return the number of resources that are assigned differently
+    in C{after} compared to C{before}.
+    """
+    resource_ids = set(before) | set(after)
+    return len([resource_id for resource_id in resource_ids
+                if before.get(resource_id) != after.get(resource_id)])
+
+
+class AssignmentStrategy(object):
+    """Base class for placement strategies.
+
+    A strategy decides which peer each resource should be assigned
+    to.
+    """
+
+    def compute(self, resources, assignments, peers, weights=None,
+            costs=None, groups=None):
+        """Compute a complete assignment.
+
+        @param resources: resource ids, ordered by insertion time
+        @type resources: sequence of C{str}
+
+        @param assignments: assignments to start from.  Strategies
+            that can keep existing assignments should do so.
+        @type assignments: C{dict} where key is resource id and value
+            is the peer which the resource is assigned to
+
+        @param peers: sequence of alive peers that want to receive
+            resources
+        @type peers: sequence of C{str}
+
+        @param weights: relative weight of each peer.  Peers that are
+            not in the mapping have weight C{1}.  Strategies that do
+            not weigh peers ignore this.
+        @type weights: C{dict} or C{None}
+
+        @param costs: cost of each resource.  Resources that are not
+            in the mapping cost C{1}.  Strategies that do not balance
+            load ignore this.
+        @type costs: C{dict} or C{None}
+
+        @param groups: the group of each resource that belongs to
+            one.  No peer may be given more than C{ceil(n /
+            len(peers))} of the C{n} resources of a group, so that
+            resources of the same group end up on different peers.
+        @type groups: C{dict} or C{None}
+
+        @return: a new C{dict} that maps every resource to a peer.
+        """
+        raise NotImplementedError("compute")
+
+
+class LeastLoadedStrategy(AssignmentStrategy):
+    """Assign each unassigned resource, in insertion order, to the
+    peer with the lowest load per unit of weight.
+
+    The load of a peer is the sum of the costs of its resources.
+    Ties are broken by the order of C{peers}.  Given assignments are
+    kept as long as the difference in load per unit of weight between
+    the most and the least loaded peer is at most C{max_imbalance}.
+    Weights are scaled so that the mean weight is C{1}.
+
+    Given assignments that break the spread of a group are dropped,
+    newest first, and the resources are placed again.  Spread goes
+    before balance: a resource is never moved to a peer that already
+    holds its share of the group.
+    """
+
+    def __init__(self, max_imbalance=1):
+        if max_imbalance < 1:
+            raise ValueError("max_imbalance must be at least 1")
+        self.max_imbalance = max_imbalance
+
+    def compute(self, resources, assignments, peers, weights=None,
+            costs=None, groups=None):
+        costs = costs or {}
+        assignments = assignments.copy()
+        spread = None
+        if groups:
+            spread = _Spread(resources, peers, groups)
+            spread.keep(resources, assignments)
+        load = _PeerLoad(assignments, peers, weights, costs)
+        for resource_id in resources:
+            if resource_id in assignments:
+                continue
+            if spread is not None and resource_id in groups:
+                peer = load.take(costs.get(resource_id, 1),
+                    lambda peer: spread.allows(resource_id, peer))
+                spread.add(resource_id, peer)
+            else:
+                peer = load.take(costs.get(resource_id, 1))
+            assignments[resource_id] = peer
+        return _rebalance(resources, assignments, peers,
+            self.max_imbalance, weights, costs, spread)
+
+
+def _rendezvous_score(digest, weight):
+    """Return the weighted rendezvous score for a hash digest."""
+    value, = struct.unpack('!Q', digest[:8])
+    # Map the hash onto the open interval (0, 1).
+    uniform = (value + 1.0) / (2.0 ** 64 + 2.0)
+    return -weight / math.log(uniform)
+
+
+class RendezvousStrategy(AssignmentStrategy):
+    """Weighted rendezvous (highest random weight) hashing.
+
+    Every resource is assigned to the peer with the highest score for
+    that resource.  The result only depends on the resource ids and
+    the set of peers, so any peer can compute it locally, and when a
+    peer goes away only the resources of that peer move.  Existing
+    assignments are not considered.
+
+    A resource in a group goes to the peer with the highest score
+    that does not already hold its share of the group.  Resources are
+    placed in insertion order, so older resources of a group win.
+
+    @ivar weights: a mapping between peer and its weight, used when no
+        weights are given to L{compute}.  Peers that are not in the
+        mapping have weight C{1}.
+    """
+
+    def __init__(self, weights=None):
+        self.weights = weights if weights is not None else {}
+
+    def compute(self, resources, assignments, peers, weights=None,
+            costs=None, groups=None):
+        if weights is None:
+            weights = self.weights
+        weights = [_peer_weight(weights, peer) for peer in peers]
+        weighted = len(set(weights)) > 1
+        spread = _Spread(resources, peers, groups) if groups else None
+        assignments = {}
+        for resource_id in resources:
+            base = hashlib.md5(resource_id + '/')
+            grouped = spread is not None and resource_id in groups
+            scores = []
+            best = None
+            for peer, weight in zip(peers, weights):
+                digest = base.copy()
+                digest.update(peer)
+                if weighted:
+                    score = _rendezvous_score(digest.digest(), weight)
+                else:
+                    # With equal weights the highest hash wins.
+                    score = digest.digest()
+                if grouped:
+                    scores.append((score, peer))
+                if best is None or score > best:
+                    best = score
+                    assignments[resource_id] = peer
+            if grouped:
+                if not spread.allows(resource_id, assignments[resource_id]):
+                    scores.sort(reverse=True)
+                    for score, peer in scores:
+                        if spread.allows(resource_id, peer):
+                            assignments[resource_id] = peer
+                            break
+                spread.add(resource_id, assignments[resource_id])
+        return assignments
 
 
 class AssignmentComputer(object):
@@ -37,19 +412,68 @@ class AssignmentComputer(object):
         The keystore holds key-value pairs.  Resources has the
         C{resource:} prefix.  Assignments has the C{assign:} prefix.
 
-        Each resource has a unique random ID (a UUID normally) that
-        identfiies the resource.  The value of the resource is a tuple
+        Each resource has a unique random ID (a short random string
+        normally) that identfiies the resource.  The value of the resource is a tuple
         of C{timestamp}, C{state} and C{address}.  C{timestamp} points
         out when in time the resource was created.  This is for
         sorting resources when computing the assignments.  C{state}
         can either be C{'please-assign'} or C{'please-do-not-assign'}.
-        The C{address} field is an opaque string.
+        The C{address} field is an opaque string.  It may be followed
+        by a C{dict} of options: C{cost}, the load the resource puts
+        on its peer, and C{group}, the name of a group of resources
+        that should be spread over different peers.
+
+        With C{packed} set, all assignments are instead written as
+        the one C{assign-map} key, see L{pack_assignments}.  A packed
+        map costs one key per rebalance rather than one per moved
+        resource, but the whole map is gossiped every time.  Each
+        map is a snapshot stamped with an epoch, which L{start_epoch}
+        advances when a new leader takes over, and a version within
+        the epoch.  txgossip sends all changed keys to a peer in one
+        datagram, so a map larger than C{max_packed_size} bytes of
+        JSON is not published; those assignments are written as
+        C{assign:} keys instead.
+
+    Where resources are placed is decided by an L{AssignmentStrategy},
+    by default a L{LeastLoadedStrategy}.
+
+    In incremental mode the strategy is handed the assignments that
+    are already in the keystore, so that a change in the cluster only
+    moves resources from peers that went away, plus the ones the
+    strategy decides to move.  Otherwise every rebalance distributes
+    all resources from scratch.
+
+    If a L{ResourceIndex} is given, resources and assignments are
+    read from it instead of by scanning the keystore.
+
+    @ivar last_moves: number of resources that changed peer in the
+        last call to L{assign_resources}.
+    @ivar last_writes: number of assignment keys written by the last
+        call to L{update_assignments}.
+    @ivar writes: total number of assignment keys written.
     """
 
-    def __init__(self, keystore):
+    # Leaves room in a 64 KB datagram for the digest and other keys.
+    MAX_PACKED_SIZE = 32 * 1024
+
+    def __init__(self, keystore, strategy=None, incremental=False,
+            index=None, packed=False, max_packed_size=MAX_PACKED_SIZE):
         self.keystore = keystore
+        self.index = index
+        self.packed = packed
+        self.max_packed_size = max_packed_size
+        self._new_epoch = False
+        self._oversized = False
+        if strategy is None:
+            strategy = LeastLoadedStrategy()
+        self.strategy = strategy
+        self.incremental = incremental
+        self.last_moves = 0
+        self.last_writes = 0
+        self.writes = 0
 
-    def compute_assignments(self, resources, current_assignments, peers):
+    def compute_assignments(self, resources, current_assignments, peers,
+            weights=None, costs=None, groups=None):
         """Based on available resources, current assignments and
         available peers, compute assignments.
 
@@ -65,13 +489,18 @@ class AssignmentComputer(object):
         @param peers: sequence of alive peers that want to receive
             resources
         @type peers: sequence of C{str}
+
+        @param weights: relative weight of each peer.
+        @type weights: C{dict} or C{None}
+
+        @param costs: cost of each resource.
+        @type costs: C{dict} or C{None}
+
+        @param groups: group of each resource that belongs to one.
+        @type groups: C{dict} or C{None}
         """
-        assignments = current_assignments.copy()
-        for resource_id in resources:
-            if not resource_id in assignments:
-                assignments[resource_id] = _calculate_assignment(
-                    assignments, peers)
-        return assignments
+        return self.strategy.compute(resources, current_assignments, peers,
+            weights, costs, groups)
 
     def collect_resources(self):
         """Collect resources from our key-value store.
@@ -79,20 +508,124 @@ class AssignmentComputer(object):
         @return: a sequence of resource ids, ordered by the time they
             were inserted into the keystore
         """
+        return self._collect_resources()[0]
+
+    def _collect_resources(self):
+        """Collect resources with their costs and groups.
+
+        @return: a tuple of the ordered resource ids, a C{dict} with
+            the cost of every resource that does not cost C{1} and a
+            C{dict} with the group of every resource that has one.
+        """
+        costs = {}
+        groups = {}
+        if self.index is not None:
+            ordered_resources = self.index.resources()
+            for resource_id in ordered_resources:
+                resource = self.index.resource(resource_id)
+                if len(resource) > 3:
+                    cost = resource_cost(resource)
+                    if cost != 1:
+                        costs[resource_id] = cost
+                    group = resource_group(resource)
+                    if group is not None:
+                        groups[resource_id] = group
+            return ordered_resources, costs, groups
         resource_keys = self.keystore.keys('resource:*')
         resources = {}
         for resource_key in resource_keys:
             resource = self.keystore.get(resource_key)
             if resource is None:
                 continue
-            timestamp, state, address = resource
+            timestamp, state, address = resource[:3]
             if state != 'please-assign':
                 continue
             resources[resource_key[9:]] = (address, timestamp)
+            cost = resource_cost(resource)
+            if cost != 1:
+                costs[resource_key[9:]] = cost
+            group = resource_group(resource)
+            if group is not None:
+                groups[resource_key[9:]] = group
 
         ordered_resources = sorted(resources.keys(),
              key=lambda k: resources[k][1])
-        return ordered_resources
+        return ordered_resources, costs, groups
+
+    def _assign_items(self):
+        """Return C{(resource_id, assigned_to)} pairs for all
+        C{assign:} keys in the keystore.
+        """
+        if self.index is not None:
+            return list(self.index.assignments().items())
+        items = self._keyed_items()
+        if self.packed:
+            keyed = set(resource_id for (resource_id, assigned_to) in items
+                        if assigned_to is not None)
+            items.extend(item for item in self._packed_items().items()
+                         if item[0] not in keyed)
+        return items
+
+    def _keyed_items(self):
+        if self.index is not None:
+            return list(self.index.keyed_assignments().items())
+        return [(assign_key[7:], self.keystore.get(assign_key))
+                for assign_key in self.keystore.keys('assign:*')]
+
+    def _packed_items(self):
+        if self.index is not None:
+            return self.index.packed_assignments()
+        return unpack_assignments(self.keystore.get(ASSIGNMENT_MAP))
+
+    def _snapshot_stamp(self):
+        if self.index is not None:
+            return self.index.stamp()
+        return snapshot_stamp(self.keystore.get(ASSIGNMENT_MAP))
+
+    def _packs(self, assignments):
+        """Return true if C{assignments} should be written as one
+        C{assign-map} key.
+        """
+        if not self.packed:
+            return False
+        size = len(json.dumps(pack_assignments(assignments)))
+        oversized = size > self.max_packed_size
+        if oversized != self._oversized:
+            self._oversized = oversized
+            if oversized:
+                log.msg('assignment map of %d bytes is too large, using '
+                        'assign: keys' % (size,))
+            else:
+                log.msg('assignment map fits again, packing assignments')
+        return not oversized
+
+    def _pending(self, packed):
+        """Return true if the keystore has to be written even if the
+        assignments have not changed: when assignments are held by
+        keys of the kind that is not being written, or a new or
+        outdated snapshot has to be published.
+
+        @param packed: true if assignments are written as one
+            C{assign-map} key.
+        """
+        if packed and self._new_epoch:
+            return True
+        if self.index is None:
+            return False
+        if packed:
+            return (bool(self.index.keyed_assignments())
+                    or self.index.outdated())
+        return bool(self.index.packed_assignments())
+
+    def start_epoch(self):
+        """Stamp the next snapshot with a new epoch.
+
+        Called when this peer becomes the leader.  The snapshot is
+        published on the next call to L{publish}, also if the
+        assignments are unchanged, so that peers stop accepting
+        snapshots from the previous leader.
+        """
+        self._new_epoch = True
 
     def collect_assignments(self, resources, peers):
         """Go through the keystore and build up a mapping of
@@ -108,12 +641,12 @@ class AssignmentComputer(object):
         @return: a mapping between resource name and assigned to peer.
         @rtype: C{dict}
         """
+        resources = set(resources)
+        peers = set(peers)
         assignments = {}
-        for assign_key in self.keystore.keys('assign:*'):
-            resource_id = assign_key[7:]
+        for resource_id, assigned_to in self._assign_items():
             if resource_id not in resources:
                 continue
-            assigned_to = self.keystore.get(assign_key)
             if assigned_to in peers and assigned_to is not None:
                 assignments[resource_id] = assigned_to
         return assignments
@@ -122,29 +655,120 @@ class AssignmentComputer(object):
         """Update keystore with new assignments.
 
         This method will also kill any existing assignemnts in the
-        keystore that is not mentioned in C{assignments}.
+        keystore that is not mentioned in C{assignments}.  Only keys
+        whose value change are written.
+
+        @return: the number of keys written.
         """
-        for assign_key in self.keystore.keys('assign:*'):
-            resource_id = assign_key[7:]
-            if resource_id not in assignments:
-                self.keystore.set(assign_key, None)
+        return self._write(assignments, self._packs(assignments))
+
+    def _write(self, assignments, packed):
+        if packed:
+            written = self._update_packed(assignments)
+        else:
+            written = self._update_keyed(assignments)
+        self.last_writes = written
+        self.writes += written
+        return written
+
+    def _update_keyed(self, assignments):
+        existing = dict(self._keyed_items())
+        written = 0
+        for resource_id, assigned_to in existing.items():
+            if resource_id not in assignments and assigned_to is not None:
+                self.keystore.set('assign:%s' % (resource_id,), None)
+                written += 1
         for resource_id, assign_to in assignments.items():
-            assign_key = 'assign:%s' % (resource_id,)
-            self.keystore.set(assign_key, assign_to)
+            if existing.get(resource_id) != assign_to:
+                assign_key = 'assign:%s' % (resource_id,)
+                self.keystore.set(assign_key, assign_to)
+                written += 1
+        if self.index is not None and self.index.packed_assignments():
+            self.keystore.set(ASSIGNMENT_MAP, None)
+            written += 1
+        return written
 
-    def assign_resources(self, peers):
-        """Assign resources to the given peers.
+    def _update_packed(self, assignments):
+        written = 0
+        if (self._packed_items() != assignments or self._new_epoch
+                or (self.index is not None and self.index.outdated())):
+            epoch, version = self._snapshot_stamp() or (0, 0)
+            if self._new_epoch:
+                epoch, version = epoch + 1, 0
+            else:
+                version += 1
+            self.keystore.set(ASSIGNMENT_MAP, pack_assignments(assignments,
+                (epoch, version)))
+            self._new_epoch = False
+            written += 1
+        for resource_id, assigned_to in self._keyed_items():
+            if assigned_to is not None:
+                self.keystore.set('assign:%s' % (resource_id,), None)
+                written += 1
+        return written
+
+    def compute(self, peers, weights=None, claims=None):
+        """Compute assignments for the given peers without touching
+        the keystore.
 
         @param peers: alive peers that want to receive resources.
         @type peers: a sequence of C{str}
+        @param weights: relative weight of each peer.
+        @type weights: C{dict} or C{None}
+        @param claims: resources that peers have taken over from dead
+            peers.  Claims on resources that are not assigned to any
+            of C{peers} are handed to the strategy as existing
+            assignments, also when not in incremental mode.
+        @type claims: C{dict} where key is resource id and value is
+            the peer that claimed it, or C{None}
+
+        @return: a tuple of the current and the computed assignments.
         """
-        ordered_resources = self.collect_resources()
+        ordered_resources, costs, groups = self._collect_resources()
         current_assignments = self.collect_assignments(ordered_resources,
             peers)
         assignments = {}
         if peers:
+            start = current_assignments if self.incremental else {}
+            if claims:
+                start = start.copy()
+                accepting = set(peers)
+                for resource_id in ordered_resources:
+                    peer = claims.get(resource_id)
+                    if (peer in accepting
+                            and resource_id not in current_assignments):
+                        start[resource_id] = peer
             assignments = self.compute_assignments(ordered_resources,
-                assignments, peers)
-        if assignments != current_assignments or not assignments:
-            self.update_assignments(assignments)
+                start, peers, weights, costs, groups)
+        return current_assignments, assignments
+
+    def assign_resources(self, peers, weights=None, claims=None):
+        """Assign resources to the given peers.
+
+        @param peers: alive peers that want to receive resources.
+        @type peers: a sequence of C{str}
+        @param weights: relative weight of each peer.
+        @type weights: C{dict} or C{None}
+        @param claims: resources claimed by peers, see L{compute}.
+        @type claims: C{dict} or C{None}
 
+        @return: the number of resources that changed peer.
+        """
+        current_assignments, assignments = self.compute(peers, weights,
+            claims)
+        return self.publish(current_assignments, assignments)
+
+    def publish(self, current_assignments, assignments):
+        """Write assignments from L{compute} to the keystore.
+
+        @return: the number of resources that changed peer.
+        """
+        self.last_moves = _count_moves(current_assignments, assignments)
+        if self.last_moves:
+            log.msg('rebalance moved %d of %d resources' % (
+                    self.last_moves, len(assignments)))
+        packed = self._packs(assignments)
+        if (assignments != current_assignments or not assignments
+                or self._pending(packed)):
+            self._write(assignments, packed)
+        return self.last_moves
@@ -0,0 +1,318 @@
+# Copyright 2011 Johan Rydberg
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Micro-benchmarks for the performance sensitive parts of fechter.
+
+Run with C{python -m fechter.benchmark COMMAND [options]}.
+"""
+
+from optparse import OptionParser
+import os
+import shelve
+import shutil
+import sys
+import tempfile
+import time
+
+from twisted.internet import task
+
+from fechter.assign import LeastLoadedStrategy, RendezvousStrategy
+from fechter.ping import _EchoTemplate, _pack_icmp, _valid_cksum
+from fechter.simulator import SimulatedCluster
+from fechter.storage import LogStorage
+
+
+def _timeit(func, repeat):
+    """Call C{func} C{repeat} times and return the best wall time."""
+    best = None
+    for i in range(repeat):
+        start = time.time()
+        func()
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def _report(name, elapsed, count=None):
+    if count:
+        print "%-40s %10.3f ms %10.2f us/op" % (name, elapsed * 1000,
+            elapsed * 1e6 / count)
+    else:
+        print "%-40s %10.3f ms" % (name, elapsed * 1000)
+
+
+def _bench_assign(args):
+    """Time a full rebalance of R resources over P peers."""
+    parser = OptionParser(prog="fechter.benchmark",
+        usage='%prog assign [options]')
+    parser.add_option('-r', '--resources', dest="resources", type=int,
+                      default=10000, help="number of resources")
+    parser.add_option('-p', '--peers', dest="peers", type=int,
+                      default=100, help="number of peers")
+    parser.add_option('-g', '--group-size', dest="group_size", type=int,
+                      default=2, help="number of resources per group")
+    parser.add_option('-n', '--repeat', dest="repeat", type=int,
+                      default=3, help="number of runs, best is reported")
+    (options, args) = parser.parse_args(args=args)
+
+    resources = ['resource-%d' % (i,) for i in range(options.resources)]
+    peers = ['10.0.%d.%d:4573' % (i // 256, i % 256)
+             for i in range(options.peers)]
+    groups = dict((resource_id, 'group-%d' % (i // options.group_size,))
+                  for (i, resource_id) in enumerate(resources))
+    for name, strategy in [('least-loaded', LeastLoadedStrategy()),
+                           ('rendezvous', RendezvousStrategy())]:
+        elapsed = _timeit(lambda: strategy.compute(resources, {}, peers),
+            options.repeat)
+        _report('%s %d resources x %d peers' % (name,
+                options.resources, options.peers), elapsed,
+                options.resources)
+        assignments = {}
+        elapsed = _timeit(lambda: assignments.update(strategy.compute(
+                    resources, {}, peers, groups=groups)), options.repeat)
+        _report('%s, groups of %d' % (name, options.group_size),
+            elapsed, options.resources)
+        # Kill one peer and let the survivors take over, keeping the
+        # assignments that still are valid.
+        survivors = peers[1:]
+        current = dict((resource_id, peer)
+                       for (resource_id, peer) in assignments.items()
+                       if peer != peers[0])
+        elapsed = _timeit(lambda: strategy.compute(resources, current,
+                survivors, groups=groups), options.repeat)
+        _report('%s, groups of %d, one peer lost' % (name,
+                options.group_size), elapsed, options.resources)
+        violations = _spread_violations(strategy.compute(resources, current,
+                survivors, groups=groups), groups, len(survivors))
+        if violations:
+            print "%d groups are not spread" % (violations,)
+
+
+def _spread_violations(assignments, groups, npeers):
+    """Return the number of groups where one peer holds more than
+    its share of the group.
+    """
+    sizes = {}
+    counts = {}
+    for resource_id, group in groups.items():
+        sizes[group] = sizes.get(group, 0) + 1
+        key = (group, assignments[resource_id])
+        counts[key] = counts.get(key, 0) + 1
+    return len(set(group for ((group, peer), count) in counts.items()
+                   if count > -(-sizes[group] // npeers)))
+
+
+def _fill_storage(storage, keys, writes):
+    """Write like the keystore does: one sync per write."""
+    for i in range(writes):
+        storage['assign:%d' % (i % keys,)] = [float(i), '10.0.0.1:4573']
+        storage.sync()
+    storage.close()
+
+
+def _bench_storage(args):
+    """Time keystore writes against the storage backends."""
+    parser = OptionParser(prog="fechter.benchmark",
+        usage='%prog storage [options]')
+    parser.add_option('-k', '--keys', dest="keys", type=int,
+                      default=2000, help="number of distinct keys")
+    parser.add_option('-w', '--writes', dest="writes", type=int,
+                      default=4000, help="number of writes")
+    (options, args) = parser.parse_args(args=args)
+
+    directory = tempfile.mkdtemp()
+    try:
+        backends = [
+            ('shelve writeback=True', lambda path: shelve.open(path,
+                writeback=True)),
+            ('shelve', lambda path: shelve.open(path)),
+            ('log, fsync every write', lambda path: LogStorage(path)),
+            # The clock is never advanced, which is what the log does
+            # when all writes fall within one fsync interval.
+            ('log, batched fsync', lambda path: LogStorage(path,
+                clock=task.Clock())),
+            ]
+        for i, (name, factory) in enumerate(backends):
+            path = os.path.join(directory, 'data-%d' % (i,))
+            elapsed = _timeit(lambda: _fill_storage(factory(path),
+                    options.keys, options.writes), 1)
+            _report('%s %d writes' % (name, options.writes), elapsed,
+                options.writes)
+    finally:
+        shutil.rmtree(directory)
+
+
+def _bench_ping(args):
+    """Time packing and checking of ICMP ECHO packages."""
+    parser = OptionParser(prog="fechter.benchmark",
+        usage='%prog ping [options]')
+    parser.add_option('-c', '--count', dest="count", type=int,
+                      default=100000, help="number of packages")
+    parser.add_option('-n', '--repeat', dest="repeat", type=int,
+                      default=3, help="number of runs, best is reported")
+    (options, args) = parser.parse_args(args=args)
+
+    sequence_nos = [i & 0xffff for i in range(options.count)]
+    elapsed = _timeit(lambda: [_pack_icmp(1234, n, 55)
+                               for n in sequence_nos], options.repeat)
+    _report('pack, full checksum', elapsed, options.count)
+    template = _EchoTemplate(1234, 55)
+    elapsed = _timeit(lambda: [template.pack(n) for n in sequence_nos],
+        options.repeat)
+    _report('pack, incremental checksum', elapsed, options.count)
+    packets = [template.pack(n) for n in sequence_nos]
+    elapsed = _timeit(lambda: [_valid_cksum(packet) for packet in packets],
+        options.repeat)
+    _report('verify', elapsed, options.count)
+
+
+def _kill_leader(cluster):
+    cluster.kill(cluster.leader())
+    return [cluster.measure()]
+
+
+def _kill_follower(cluster):
+    leader = cluster.leader()
+    cluster.kill([protocol for protocol in cluster.protocols
+                  if protocol is not leader][0])
+    return [cluster.measure()]
+
+
+def _isolate_leader(cluster):
+    """Cut the leader off from the rest, and then let it back."""
+    leader = cluster.leader()
+    rest = [protocol for protocol in cluster.protocols
+            if protocol is not leader]
+    cluster.network.partition([leader.gossiper.name],
+        [protocol.gossiper.name for protocol in rest])
+    results = [cluster.measure(rest)]
+    cluster.network.heal()
+    results.append(cluster.measure())
+    return results
+
+
+_SCENARIOS = [
+    ('kill leader', _kill_leader),
+    ('kill follower', _kill_follower),
+    ('isolate leader', _isolate_leader),
+    ]
+
+
+def _bench_converge(args):
+    """Time how long a simulated cluster takes to converge after
+    failures.
+    """
+    parser = OptionParser(prog="fechter.benchmark",
+        usage='%prog converge [options]')
+    parser.add_option('-N', '--nodes', dest="nodes", type=int,
+                      default=3, help="number of nodes")
+    parser.add_option('-r', '--resources', dest="resources", type=int,
+                      default=30, help="number of resources")
+    parser.add_option('-l', '--loss', dest="loss", type=float,
+                      default=0.0, help="fraction of packets lost")
+    parser.add_option('-g', '--gossip-interval', dest="gossip_interval",
+                      type=float, default=0.25,
+                      help="seconds between gossip rounds")
+    parser.add_option('-v', '--vote-delay', dest="vote_delay", type=float,
+                      default=2, help="seconds before voting")
+    parser.add_option('-i', '--incremental', dest="incremental",
+                      action="store_true", default=False,
+                      help="keep existing assignments")
+    parser.add_option('-f', '--fast-takeover', dest="fast_takeover",
+                      action="store_true", default=False,
+                      help="let survivors claim resources")
+    parser.add_option('-p', '--packed', dest="packed",
+                      action="store_true", default=False,
+                      help="publish assignments as one snapshot")
+    parser.add_option('-n', '--runs', dest="runs", type=int,
+                      default=3, help="number of runs, with different seeds")
+    (options, args) = parser.parse_args(args=args)
+
+    print "%-30s %10s %10s %10s %10s %10s" % ('', 'available',
+        'converged', 'worst', 'moves', 'kbytes')
+    for name, scenario in _SCENARIOS:
+        runs = []
+        for seed in range(options.runs):
+            cluster = SimulatedCluster(options.nodes, options.resources,
+                seed=seed, loss=options.loss,
+                gossip_interval=options.gossip_interval,
+                vote_delay=options.vote_delay,
+                incremental=options.incremental,
+                fast_takeover=options.fast_takeover,
+                packed_assignments=options.packed)
+            cluster.start()
+            runs.append(scenario(cluster))
+        for step in range(len(runs[0])):
+            results = [run[step] for run in runs]
+            label = name if step == 0 else '  healed'
+            if None in [result['time'] for result in results]:
+                print "%-30s did not converge" % (label,)
+                continue
+            mean = lambda key: sum(result[key]
+                                   for result in results) / float(len(results))
+            print "%-30s %10.2f %10.2f %10.2f %10.1f %10.1f" % (label,
+                mean('available'), mean('time'),
+                max(result['time'] for result in results), mean('moves'),
+                mean('bytes') / 1024)
+
+
+def _bench_gossip(args):
+    """Count the gossip bytes a simulated cluster sends with one
+    C{assign:} key per resource and with a packed assignment map.
+    """
+    parser = OptionParser(prog="fechter.benchmark",
+        usage='%prog gossip [options]')
+    parser.add_option('-N', '--nodes', dest="nodes", type=int,
+                      default=3, help="number of nodes")
+    parser.add_option('-r', '--resources', dest="resources", type=int,
+                      default=100, help="number of resources")
+    parser.add_option('-i', '--incremental', dest="incremental",
+                      action="store_true", default=False,
+                      help="keep existing assignments")
+    (options, args) = parser.parse_args(args=args)
+
+    print "%-30s %10s %10s %10s" % ('', 'startup', 'kill', 'max packet')
+    for name, packed in (('per-key', False), ('packed', True)):
+        cluster = SimulatedCluster(options.nodes, options.resources,
+            incremental=options.incremental, packed_assignments=packed)
+        cluster.start()
+        startup = cluster.network.bytes_sent
+        result = _kill_leader(cluster)[0]
+        print "%-30s %9.1fk %9.1fk %9.1fk" % (name, startup / 1024.0,
+            result['bytes'] / 1024.0, cluster.network.max_packet / 1024.0)
+
+
+_COMMANDS = {
+    'assign': _bench_assign,
+    'converge': _bench_converge,
+    'gossip': _bench_gossip,
+    'ping': _bench_ping,
+    'storage': _bench_storage,
+    }
+
+
+def main(args):
+    parser = OptionParser(prog="fechter.benchmark",
+        usage='%%prog COMMAND [options]\n\ncommands: %s' % (
+            ', '.join(sorted(_COMMANDS)),))
+    parser.disable_interspersed_args()
+    (options, args) = parser.parse_args(args=args)
+    if not args or args[0] not in _COMMANDS:
+        parser.error("unknown command")
+    _COMMANDS[args[0]](args[1:])
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
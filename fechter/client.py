@@ -19,6 +19,8 @@ import json
 import sys
 import httplib
 
+from fechter.platform import canonical_resource
+
 
 class Agent:
     """Wrapper around httplib.
@@ -139,7 +141,15 @@ class FechterClient(object):
     def __init__(self, agent):
         self.agent = agent
 
-    def add_address(self, address):
+    def add_address(self, address, cost=None, group=None):
+        if cost is not None or group is not None:
+            data = {'resource': address}
+            if cost is not None:
+                data['cost'] = cost
+            if group is not None:
+                data['group'] = group
+            return self.agent.interact('/resource', data=data,
+                method='POST')
         return self.agent.interact('/resource', data=address,
             method='POST')
 
@@ -160,17 +170,23 @@ def _usage():
 
 
 def _add_address(client, args):
+    parser = OptionParser(version="%%prog %s" % VERSION, prog="fechter",
+        usage='fechter [options] add-address [options] IFNAME:ADDRESS')
+    parser.add_option('-c', '--cost', dest="cost", type=float,
+                      default=None,
+                      help="Load of the address relative to others")
+    parser.add_option('-g', '--group', dest="group", default=None,
+                      help="Spread addresses of GROUP over different nodes")
+    (options, args) = parser.parse_args(args=args)
     if len(args) != 1:
         sys.exit("usage: fechter add-address IFNAME:ADDRESS")
-    # Validate the format:
+    if options.cost is not None and options.cost <= 0:
+        sys.exit("error: cost must be positive")
     try:
-        ifname, address = args[0].split(':', 1)
-        socket.inet_aton(address)
-    except ValueError:
-        sys.exit("error: invalid resource format")
-    except socket.error:
-        sys.exit("error: not a valid IPv4 address")
-    client.add_address(args[0])
+        resource = canonical_resource(args[0])
+    except ValueError, err:
+        sys.exit("error: %s" % (err,))
+    client.add_address(resource, options.cost, options.group)
 
 
 def _up(client, args):
@@ -199,6 +215,10 @@ def _connectivity(client, args):
         print "can talk to gateway"
     else:
         print "cannot talk to gateway"
+    for address, data in sorted(info.get('gateways', {}).items()):
+        print "%s: %d%% loss%s" % (address, data['loss'] * 100,
+            "" if data['rtt'] is None
+                else (", rtt %.1f ms" % (data['rtt'] * 1000,)))
 
 
 def _info(client, args):
@@ -233,9 +253,11 @@ def _status(client, args):
     (options, args) = parser.parse_args(args=args)
     resources = client.resources()
     for resource_id, resource in resources.items():
+        name = resource['resource']
+        if 'group' in resource:
+            name = "%s (group %s)" % (name, resource['group'])
         if not 'assigned_to' in resource:
-            print "%s is not assigned" % (
-                resource['resource'])
+            print "%s is not assigned" % (name,)
         else:
             if options.no_resolve:
                 hostname = resource['assigned_to']
@@ -247,8 +269,18 @@ def _status(client, args):
                         host)[0]
                 except socket.error:
                     hostname = host
-            print "%s assigned to %s" % (
-                resource['resource'], hostname)
+            print "%s assigned to %s" % (name, hostname)
+    utilization = client.info().get('utilization', {})
+    for peer, data in sorted(utilization.items()):
+        hostname = peer
+        if not options.no_resolve:
+            host, port = _split_host_port(peer)
+            try:
+                hostname = socket.gethostbyaddr(host)[0]
+            except socket.error:
+                hostname = host
+        print "%s has load %g, weight %g, utilization %.2f" % (
+            hostname, data['load'], data['weight'], data['utilization'])
 
 
 def main(args):
@@ -0,0 +1,88 @@
+# Copyright 2011 Johan Rydberg
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Garbage collection of deleted keys."""
+
+import json
+
+from twisted.python import log
+
+
+class TombstoneCollector(object):
+    """Drop tombstones from the keystore.
+
+    Deleting a resource or an assignment sets its key to C{None}.
+    Such a tombstone is dropped when every live peer has replicated
+    it, or when it is older than C{max_age} seconds.
+
+    @ivar collected: number of tombstones dropped.
+    @ivar reclaimed: approximate number of bytes reclaimed.
+    """
+
+    PREFIXES = ('resource:', 'assign:', 'assign-map')
+
+    def __init__(self, clock, keystore, max_age=3600):
+        self.clock = clock
+        self.keystore = keystore
+        self.max_age = max_age
+        self.collected = 0
+        self.reclaimed = 0
+        self._tombstones = {}
+
+    def update(self, key, timestamped_value):
+        """Inform the collector about a change to our own keystore."""
+        if not key.startswith(self.PREFIXES):
+            return
+        timestamp, value = timestamped_value
+        if value is None:
+            self._tombstones[key] = timestamp
+        else:
+            self._tombstones.pop(key, None)
+
+    def _acknowledged(self, key, timestamp):
+        """Return C{True} if all live peers have replicated the
+        tombstone for C{key}.
+        """
+        for peer in self.keystore.live_peers():
+            value = peer.get(key)
+            if value is None or value[0] < timestamp or value[1] is not None:
+                return False
+        return True
+
+    def collect(self):
+        """Drop all tombstones that can be dropped.
+
+        @return: the number of dropped tombstones.
+        """
+        now = self.clock.seconds()
+        collected = 0
+        for key, timestamp in self._tombstones.items():
+            if (now - timestamp < self.max_age
+                    and not self._acknowledged(key, timestamp)):
+                continue
+            del self._tombstones[key]
+            self.reclaimed += len(json.dumps([key, [timestamp, None]]))
+            self.keystore.forget(key)
+            collected += 1
+        self.keystore.expire_forgotten(now - self.max_age)
+        if collected:
+            self.keystore.sync()
+            log.msg('dropped %d tombstones' % (collected,))
+        self.collected += collected
+        return collected
+
+    def stats(self):
+        """Return counters as a C{dict}."""
+        return {'collected': self.collected, 'reclaimed': self.reclaimed,
+                'pending': len(self._tombstones)}
@@ -0,0 +1,176 @@
+# Copyright 2011 Johan Rydberg
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Failure detection of peers."""
+
+import collections
+import math
+
+from txgossip.detector import FailureDetector
+from txgossip.gossip import Gossiper
+from txgossip.state import PeerState
+
+
+class NormalFailureDetector(object):
+    """Phi accrual failure detector that models heartbeat
+    inter-arrival times as normally distributed.
+
+    The detector that comes with txgossip assumes exponentially
+    distributed intervals, which makes phi grow slowly: with one
+    heartbeat a second a phi of 8 is reached after 18 seconds.  Here
+    the mean and the standard deviation of the last C{window}
+    intervals are used, so a peer with regular heartbeats is detected
+    shortly after it misses one, while a peer with jittery heartbeats
+    is given more time.
+
+    @param min_std: lower bound of the standard deviation, in
+        seconds, so that a few perfectly regular heartbeats do not
+        make the detector trigger on the slightest delay.
+    @param acceptable_pause: seconds added to the mean interval, to
+        allow for a heartbeat that is lost now and then.
+    """
+
+    def __init__(self, window=100, min_std=0.1, acceptable_pause=0):
+        self.last_time = None
+        self.intervals = collections.deque(maxlen=window)
+        self.min_std = min_std
+        self.acceptable_pause = acceptable_pause
+        self._sum = 0.0
+        self._squares = 0.0
+
+    def add(self, arrival_time):
+        last_time, self.last_time = self.last_time, arrival_time
+        if last_time is None:
+            interval = 0.75
+        else:
+            interval = arrival_time - last_time
+        if len(self.intervals) == self.intervals.maxlen:
+            oldest = self.intervals[0]
+            self._sum -= oldest
+            self._squares -= oldest * oldest
+        self.intervals.append(interval)
+        self._sum += interval
+        self._squares += interval * interval
+
+    def interval_mean(self):
+        return self._sum / len(self.intervals)
+
+    def interval_std(self):
+        mean = self.interval_mean()
+        variance = max(self._squares / len(self.intervals) - mean * mean,
+                       0.0)
+        return max(math.sqrt(variance), self.min_std)
+
+    def phi(self, current_time):
+        if self.last_time is None:
+            return 0
+        current_interval = current_time - self.last_time
+        mean = self.interval_mean() + self.acceptable_pause
+        x = (current_interval - mean) / (self.interval_std() * math.sqrt(2))
+        # Probability that the next heartbeat arrives even later.
+        p_later = max(0.5 * math.erfc(x), 1e-300)
+        return -math.log10(p_later)
+
+
+class DetectingPeerState(PeerState):
+    """Peer state that records how long it took to detect that the
+    peer had died.
+
+    @ivar detection_latency: time between the last heartbeat and the
+        peer being marked dead, the last time it died.
+    @ivar detections: number of times the peer has been marked dead.
+    """
+
+    def __init__(self, clock, participant, name=None, PHI=8,
+            detector=None):
+        PeerState.__init__(self, clock, participant, name=name, PHI=PHI)
+        if detector is not None:
+            self.detector = detector
+        self.detection_latency = None
+        self.detections = 0
+
+    def check_suspected(self):
+        # The txgossip version treats a phi of exactly zero as a dead
+        # peer, which only is right when nothing has been heard yet.
+        now = self.clock.seconds()
+        if (self.detector.last_time is None
+                or self.detector.phi(now) > self.PHI):
+            if self.alive:
+                self.detections += 1
+                if self.detector.last_time is not None:
+                    self.detection_latency = now - self.detector.last_time
+            self.mark_dead()
+            return True
+        self.mark_alive()
+        return False
+
+    def expected_detection(self):
+        """Return how long after the last heartbeat the peer would be
+        marked dead, or C{None} if nothing has been heard from it.
+        """
+        if self.detector.last_time is None:
+            return None
+        low, high = 0.0, 1.0
+        while (self.detector.phi(self.detector.last_time + high) <= self.PHI
+                and high < 3600):
+            low, high = high, high * 2
+        for i in range(30):
+            middle = (low + high) / 2
+            if self.detector.phi(self.detector.last_time + middle) > self.PHI:
+                high = middle
+            else:
+                low = middle
+        return high
+
+
+class DetectingGossiper(Gossiper):
+    """Gossiper that marks peers dead when their phi goes above
+    C{phi}.
+
+    Peers hear about each other's heartbeats through gossip, so
+    failures cannot be detected faster than a few C{interval}s.  The
+    adaptive detectors accept that one gossip round is missed.
+
+    @param adaptive: if true, use a L{NormalFailureDetector} for
+        every peer; otherwise use the txgossip detector.
+    @param interval: seconds between heartbeats and between gossip
+        rounds.
+    """
+
+    def __init__(self, clock, participant, address=None, phi=8,
+            adaptive=False, interval=1):
+        Gossiper.__init__(self, clock, participant, address)
+        self.phi = phi
+        self.adaptive = adaptive
+        self.interval = interval
+
+    def startProtocol(self):
+        """Start protocol."""
+        self.name = self._determine_endpoint()
+        self.state.set_name(self.name)
+        self._states[self.name] = self.state
+        self._heart_beat_timer.start(self.interval, now=True)
+        self._gossip_timer.start(self.interval, now=True)
+        self.participant.make_connection(self)
+
+    def _setup_state_for_peer(self, peer_name):
+        """Setup state for a new peer."""
+        if self.adaptive:
+            detector = NormalFailureDetector(
+                acceptable_pause=self.interval)
+        else:
+            detector = FailureDetector()
+        self._states[peer_name] = DetectingPeerState(self.clock,
+            self.participant, name=peer_name, PHI=self.phi,
+            detector=detector)
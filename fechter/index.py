@@ -0,0 +1,212 @@
+# Copyright 2011 Johan Rydberg
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import bisect
+
+
+ASSIGNMENT_MAP = 'assign-map'
+
+
+def pack_assignments(assignments, stamp=(0, 0)):
+    """Pack a mapping between resource id and peer into the value of
+    the C{assign-map} key.
+
+    Every peer is stored once, and resources refer to it by its
+    position in the list of peers.
+
+    @param stamp: the C{(epoch, version)} of the snapshot.  Every
+        leader starts a new epoch, and the version counts the
+        snapshots it has published in that epoch.
+    """
+    peers = sorted(set(assignments.values()))
+    numbers = dict((peer, n) for (n, peer) in enumerate(peers))
+    epoch, version = stamp
+    return {'epoch': epoch, 'version': version, 'peers': peers,
+            'map': dict((resource_id, numbers[peer])
+                        for (resource_id, peer) in assignments.items())}
+
+
+def unpack_assignments(value):
+    """Return the mapping between resource id and peer held by a
+    C{assign-map} value, which may be C{None}.
+    """
+    if not value:
+        return {}
+    peers = value['peers']
+    return dict((str(resource_id), peers[n])
+                for (resource_id, n) in value['map'].items())
+
+
+def snapshot_stamp(value):
+    """Return the C{(epoch, version)} of a C{assign-map} value, or
+    C{None} if there is no snapshot.
+    """
+    if not value:
+        return None
+    return (value.get('epoch', 0), value.get('version', 0))
+
+
+def resource_cost(resource):
+    """Return the cost of a resource.
+
+    @param resource: the value of a C{resource:} key: a
+        C{[timestamp, state, address]} list, optionally followed by a
+        C{dict} of options.  The C{cost} option defaults to C{1}.
+    """
+    if len(resource) > 3 and resource[3]:
+        return resource[3].get('cost', 1)
+    return 1
+
+
+def resource_group(resource):
+    """Return the group of a resource, or C{None} if it does not
+    belong to one.
+
+    Resources in the same group are spread over different peers.
+    """
+    if len(resource) > 3 and resource[3]:
+        return resource[3].get('group')
+    return None
+
+
+class ResourceIndex(object):
+    """In-memory index over the C{resource:} and C{assign:} keys, and
+    the C{assign-map} key, of the keystore.
+
+    The index is kept up to date by feeding it every change to the
+    keystore through L{update}, so that reading the resources or the
+    assignments does not require a scan over the keyspace.
+
+    Assignments can be held both by C{assign:} keys and by the
+    C{assign-map} key while the cluster switches between the two.  An
+    C{assign:} key goes before the map.
+
+    A snapshot in the C{assign-map} key is applied as a whole, and
+    only if its stamp is not older than that of the snapshot applied
+    before it, so a leader that has been replaced cannot undo the
+    assignments of its successor.
+    """
+
+    def __init__(self):
+        self._resources = {}
+        self._order = []
+        self._assignments = {}
+        self._keyed = {}
+        self._packed = {}
+        self._stamp = None
+        self._outdated = False
+
+    def update(self, key, value):
+        """Update the index with a changed key-value pair.
+
+        @param key: the changed key; keys that are not resources or
+            assignments are ignored.
+        @param value: the new value of the key.
+
+        @return: the ids of the resources whose assignment changed.
+        """
+        if key.startswith('resource:'):
+            self._update_resource(key[9:], value)
+        elif key.startswith('assign:'):
+            resource_id = key[7:]
+            if value is None:
+                self._keyed.pop(resource_id, None)
+            else:
+                self._keyed[resource_id] = value
+            return self._merge([resource_id])
+        elif key == ASSIGNMENT_MAP:
+            stamp = snapshot_stamp(value)
+            self._outdated = (stamp is not None and self._stamp is not None
+                              and stamp < self._stamp)
+            if self._outdated:
+                return []
+            if stamp is not None:
+                self._stamp = stamp
+            previous, self._packed = self._packed, unpack_assignments(value)
+            return self._merge(set(previous) | set(self._packed))
+        return []
+
+    def _merge(self, resource_ids):
+        changed = []
+        for resource_id in resource_ids:
+            peer = self._keyed.get(resource_id,
+                self._packed.get(resource_id))
+            if peer == self._assignments.get(resource_id):
+                continue
+            if peer is None:
+                del self._assignments[resource_id]
+            else:
+                self._assignments[resource_id] = peer
+            changed.append(resource_id)
+        return changed
+
+    def _update_resource(self, resource_id, resource):
+        previous = self._resources.get(resource_id)
+        if previous is not None and previous[1] == 'please-assign':
+            entry = (previous[0], resource_id)
+            del self._order[bisect.bisect_left(self._order, entry)]
+        if resource is None:
+            self._resources.pop(resource_id, None)
+            return
+        resource = tuple(resource)
+        self._resources[resource_id] = resource
+        if resource[1] == 'please-assign':
+            bisect.insort(self._order, (resource[0], resource_id))
+
+    def resources(self):
+        """Return the ids of all resources that should be assigned,
+        ordered by the time they were inserted into the keystore.
+        """
+        return [resource_id for (timestamp, resource_id) in self._order]
+
+    def resource(self, resource_id):
+        """Return the C{(timestamp, state, address)} tuple of a
+        resource, or C{None} if there is no such resource.  The tuple
+        has a fourth element if the resource has options.
+        """
+        return self._resources.get(resource_id)
+
+    def assigned_to(self, resource_id):
+        """Return the peer that a resource is assigned to, or C{None}
+        if it is not assigned.
+        """
+        return self._assignments.get(resource_id)
+
+    def assignments(self):
+        """Return a mapping between every assigned resource and the
+        peer it is assigned to.
+
+        The mapping is owned by the index and must not be modified.
+        """
+        return self._assignments
+
+    def keyed_assignments(self):
+        """Return the assignments held by C{assign:} keys."""
+        return self._keyed
+
+    def packed_assignments(self):
+        """Return the assignments held by the C{assign-map} key."""
+        return self._packed
+
+    def stamp(self):
+        """Return the C{(epoch, version)} of the last snapshot applied,
+        or C{None}.
+        """
+        return self._stamp
+
+    def outdated(self):
+        """Return true if the C{assign-map} key holds a snapshot that
+        is older than the one that was applied.
+        """
+        return self._outdated
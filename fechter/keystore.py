@@ -12,14 +12,19 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import base64
 import json
-import uuid
+import os
 
-from twisted.internet import defer, task, error
+from twisted.internet import task
 from twisted.python import log
 from txgossip.recipies import KeyStoreMixin, LeaderElectionMixin
 
-from .assign import AssignmentComputer
+from .assign import AssignmentComputer, RendezvousStrategy, utilization
+from .compaction import TombstoneCollector
+from .index import (ASSIGNMENT_MAP, ResourceIndex, resource_cost,
+    resource_group)
+from .scheduler import CoalescingScheduler
 
 
 class _LeaderElectionProtocol(LeaderElectionMixin):
@@ -27,8 +32,8 @@ class _LeaderElectionProtocol(LeaderElectionMixin):
     the application logic about election results.
     """
 
-    def __init__(self, clock, app):
-        LeaderElectionMixin.__init__(self, clock, vote_delay=2)
+    def __init__(self, clock, app, vote_delay=2):
+        LeaderElectionMixin.__init__(self, clock, vote_delay=vote_delay)
         self._app = app
 
     def leader_elected(self, is_leader, leader):
@@ -36,42 +41,132 @@ class _LeaderElectionProtocol(LeaderElectionMixin):
         self._app.leader_elected(is_leader)
 
 
+class _KeyStore(KeyStoreMixin):
+    """Key-value store that can forget keys.
+
+    txgossip has no way of removing a key, so a forgotten key would
+    be replicated back from any peer that still holds it.  Forgotten
+    keys are therefore remembered together with the timestamp of
+    their last value until they expire, and values that are not newer
+    than that are not replicated.
+    """
+
+    def __init__(self, clock, storage, ignore_keys=[]):
+        KeyStoreMixin.__init__(self, clock, storage, ignore_keys)
+        self._forgotten = {}
+
+    def live_peers(self):
+        """Return the peers that are known to be alive."""
+        return self._gossiper.live_peers
+
+    def forget(self, key):
+        """Remove C{key} from the keystore and the backing storage."""
+        timestamp, value = self._gossiper.get(key)
+        # There is no API for removing a key from our peer state.
+        self._gossiper.state.attrs.pop(key, None)
+        if key in self._storage:
+            del self._storage[key]
+        self._forgotten[key] = (timestamp, self.clock.seconds())
+
+    def expire_forgotten(self, before):
+        """Stop remembering keys that were forgotten before
+        C{before}.
+        """
+        for key, (timestamp, forgotten_at) in self._forgotten.items():
+            if forgotten_at < before:
+                del self._forgotten[key]
+
+    def sync(self):
+        """Flush the backing storage."""
+        if hasattr(self._storage, 'sync'):
+            self._storage.sync()
+
+    def replicate_key_value(self, peer, key, timestamped_value):
+        forgotten = self._forgotten.get(key)
+        if forgotten is not None and timestamped_value[0] <= forgotten[0]:
+            return
+        KeyStoreMixin.replicate_key_value(self, peer, key,
+            timestamped_value)
+
+
 class FechterProtocol:
-    """Implementation of our 'fechter protocol'."""
+    """Implementation of our 'fechter protocol'.
+
+    Peers that are not the leader keep a shadow of the assignments
+    that they would publish if they were, computed whenever
+    resources, assignments or peers change.  A newly elected leader
+    publishes its shadow right away.
+
+    With C{fast_takeover} the peers do not wait for the leader when
+    a peer dies.  Every survivor works out, with rendezvous hashing
+    over the surviving peers, which of the resources of the dead peer
+    it should take, installs them at once and announces them as
+    claims.  The leader starts from the claims when it rebalances,
+    and a claim is dropped as soon as the leader has assigned the
+    resource.
+
+    @param vote_delay: seconds to wait after a change in membership
+        before voting for a leader.
+    @param fast_takeover: claim resources of dead peers without
+        waiting for the leader.
+    @param packed_assignments: have the leader publish all
+        assignments as one C{assign-map} key instead of one
+        C{assign:} key per resource.
+    @ivar claimed: number of resources claimed from dead peers.
+    """
 
     STATUS = 'private:status'
-
-    def __init__(self, clock, storage, platform, pinger):
-        self.election = _LeaderElectionProtocol(clock, self)
-        self.keystore = KeyStoreMixin(clock, storage,
+    RANK = 'private:rank'
+    WEIGHT = 'private:weight'
+    CLAIMS = 'private:claims'
+
+    def __init__(self, clock, storage, platform, pinger,
+            strategy=None, incremental=False, rebalance_interval=0.2,
+            rebalance_max_delay=1.0, gc_interval=60, tombstone_max_age=3600,
+            reconcile_interval=60, probe_interval=0.2, rank=0, weight=1,
+            vote_delay=2, fast_takeover=False, packed_assignments=False):
+        self.election = _LeaderElectionProtocol(clock, self, vote_delay)
+        self.keystore = _KeyStore(clock, storage,
                 [self.election.LEADER_KEY, self.election.VOTE_KEY,
-                 self.election.PRIO_KEY, self.STATUS])
-        self.computer = AssignmentComputer(self.keystore)
+                 self.election.PRIO_KEY, self.STATUS, self.RANK,
+                 self.WEIGHT, self.CLAIMS])
+        self.index = ResourceIndex()
+        self.computer = AssignmentComputer(self.keystore,
+            strategy=strategy, incremental=incremental, index=self.index,
+            packed=packed_assignments)
+        self.collector = TombstoneCollector(clock, self.keystore,
+            tombstone_max_age)
+        self._gc_interval = gc_interval
+        self._collector_loop = task.LoopingCall(self.collector.collect)
+        self._collector_loop.clock = clock
+        self.rebalancer = CoalescingScheduler(clock, self._rebalance,
+            rebalance_interval, rebalance_max_delay)
         self.platform = platform
+        self._reconcile_interval = reconcile_interval
+        self._reconcile_loop = task.LoopingCall(self.reconcile)
+        self._reconcile_loop.clock = clock
         self.clock = clock
         self.pinger = pinger
+        self._probe_interval = probe_interval
         self._connectivity_checker = task.LoopingCall(
             self._check_connectivity)
+        self._connectivity_checker.clock = clock
         self._status = 'down'
         self._connectivity = 'down'
+        self._rank = rank
+        self._weight = weight
+        self._peers = None
+        self._shadow = None
+        self.fast_takeover = fast_takeover
+        self._claims = set()
+        self.claimed = 0
 
-    @defer.inlineCallbacks
     def _check_connectivity(self):
-        """Check connectivity with gateway."""
-        tries = 0
-        done = 0
-        while not done:
-            tries += 1
-            try:
-                yield self.pinger.check_connectivity(timeout=1)
-            except error.TimeoutError:
-                if tries == 3:
-                    self.set_connectivity('down')
-                    break
-            else:
-                done = 1
-        else:
-            self.set_connectivity('up')
+        """Probe the gateways and update our connectivity status with
+        the outcome of earlier probes.
+        """
+        self.pinger.probe()
+        self.set_connectivity('up' if self.pinger.reachable() else 'down')
 
     def _update_status(self):
         """Update status that will be communicated to other peers."""
@@ -109,38 +204,52 @@ class FechterProtocol:
             self._status = status
             self._update_status()
 
-    def add_resource(self, resource):
+    def add_resource(self, resource, cost=1, group=None):
         """Add a resource.
 
         @param resource: the resource that can be distributed over the
             cluster
         @type resource: a C{str}
 
+        @param cost: how much the resource loads the node it is
+            assigned to, relative to other resources.
+
+        @param group: name of a group of resources that should be
+            spread over different nodes, or C{None}.
+
         @return: the unique ID of the resource
         @rtype: C{str}
         """
-        resource_id = str(uuid.uuid4())
+        # 72 random bits, in 12 characters rather than the 36 of a
+        # UUID, since the id goes into every assignment.
+        resource_id = base64.urlsafe_b64encode(os.urandom(9))
         resource_key = 'resource:%s' % (resource_id,)
-        self.keystore[resource_key] = [self.clock.seconds(),
-            'please-assign', resource]
+        value = [self.clock.seconds(), 'please-assign', resource]
+        options = {}
+        if cost != 1:
+            options['cost'] = cost
+        if group is not None:
+            options['group'] = group
+        if options:
+            value.append(options)
+        self.keystore[resource_key] = value
         return resource_id
 
     def list_resources(self):
         """Return a mapping of all existing resources."""
         resources = {}
-        for key in self.keystore.keys('resource:*'):
-            if self.keystore[key] is None:
-                continue
-            resource_id = key[9:]
-            timestamp, state, resource = self.keystore[key]
-            if state != 'please-assign':
-                continue
-            resources[resource_id] = {'resource': resource}
-            assign_key = 'assign:%s' % (resource_id,)
-            if assign_key in self.keystore:
-                assigned_to = self.keystore[assign_key]
-                if assigned_to:
-                    resources[resource_id]['assigned_to'] = assigned_to
+        for resource_id in self.index.resources():
+            resource = self.index.resource(resource_id)
+            resources[resource_id] = {'resource': resource[2]}
+            cost = resource_cost(resource)
+            if cost != 1:
+                resources[resource_id]['cost'] = cost
+            group = resource_group(resource)
+            if group is not None:
+                resources[resource_id]['group'] = group
+            assigned_to = self.index.assigned_to(resource_id)
+            if assigned_to:
+                resources[resource_id]['assigned_to'] = assigned_to
         return resources
 
     def _check_consensus(self, key):
@@ -168,10 +277,34 @@ class FechterProtocol:
             # protocol.
             return
         self.keystore.value_changed(peer, key, value)
+        assigned = key.startswith('assign:') or key == ASSIGNMENT_MAP
+        changed = []
+        if (peer.name == self.gossiper.name and value is not None
+                and (assigned or key.startswith('resource:'))):
+            changed = self.index.update(key, value[1])
+            self.collector.update(key, value)
+            if assigned:
+                if key != ASSIGNMENT_MAP:
+                    changed = [key[7:]]
+                # Our own writes do not call for a new rebalance, but
+                # a snapshot from a replaced leader must be replaced.
+                self._assignments_changed(not self.election.is_leader
+                                          or self.index.outdated())
+                if self._claims.intersection(changed):
+                    # The leader has made up its mind.
+                    self._claims.difference_update(changed)
+                    self._publish_claims()
 
         if key == self.STATUS:
             self.status_change(peer, value == 'up')
             return
+        if key in (self.RANK, self.WEIGHT):
+            self._peers = None
+            self._assignments_changed()
+            return
+        if key == self.CLAIMS:
+            self._assignments_changed()
+            return
 
         if peer.name != self.gossiper.name:
             # We ignore anything that has not yet been replicated to
@@ -182,18 +315,25 @@ class FechterProtocol:
             # Ignore because we have not seen an election yet.
             return
 
-        if key.startswith('assign:'):
-             # First check if we want any resources at all, since this
-             # may be an old assignment.
-             status = self.gossiper.get(self.STATUS)
-             resource_id = key[7:]
-             resource_key = 'resource:%s' % (resource_id,)
-             self.platform.assign_resource(resource_id,
-                 self.keystore.get(key) == self.gossiper.name,
-                 self.keystore.get(resource_key)[2])
+        if assigned:
+             for resource_id in changed:
+                 self._apply_assignment(resource_id)
         elif key.startswith('resource:'):
-             if self.election.is_leader:
-                 self.assign_resources()
+             self._assignments_changed()
+
+    def _apply_assignment(self, resource_id):
+        """Install or release a resource on the platform according to
+        its assignment.
+        """
+        resource = self.index.resource(resource_id)
+        if resource is None:
+            # The resource has been deleted; release it if we hold it.
+            self.platform.assign_resource(resource_id, False,
+                None).addErrback(log.err)
+            return
+        self.platform.assign_resource(resource_id,
+            self.index.assigned_to(resource_id) == self.gossiper.name,
+            resource[2]).addErrback(log.err)
 
     def status_change(self, peer, up):
         """A peer changed its status flag.
@@ -203,8 +343,8 @@ class FechterProtocol:
         """
         log.msg('status changed for %s to %s' % (peer.name,
             "up" if up else "down"))
-        if self.election.is_leader:
-            self.assign_resources()
+        self._peers = None
+        self._assignments_changed()
 
     def leader_elected(self, is_leader):
         """The result of an election is in.
@@ -215,36 +355,223 @@ class FechterProtocol:
         """
         log.msg('leader elected and it %s us!' % (
                 "IS" if is_leader else "IS NOT"))
+        if not self._reconcile_loop.running:
+            # Assignments are ignored until the first election, so
+            # catch up with them now.
+            self._reconcile_loop.start(self._reconcile_interval)
         if is_leader:
-            self.assign_resources()
+            self._take_over()
+
+    def _take_over(self):
+        """Publish assignments as the new leader, from the shadow if
+        it is up to date.
+        """
+        shadow, self._shadow = self._shadow, None
+        self.computer.start_epoch()
+        if shadow is None:
+            # Through the rebalancer, so that a pending rebalance is
+            # not run again right after.
+            self.rebalancer.flush()
+        else:
+            current_assignments, assignments = shadow
+            self.computer.publish(current_assignments, assignments)
+
+    def reconcile(self):
+        """Make sure that the platform holds exactly the resources
+        that are assigned to us.
+
+        Nothing is done until an election has been seen, since
+        assignments are not acted upon before that.
+        """
+        if self.election.is_leader is None:
+            return
+        return self.platform.reconcile(self._desired_resources).addErrback(
+            log.err)
+
+    def _desired_resources(self):
+        """Return all resources, and the ids of those that we should
+        hold, for L{AbstractPlatform.reconcile}.
+        """
+        resources = {}
+        assigned = set()
+        for resource_id in self.index.resources():
+            resources[resource_id] = self.index.resource(resource_id)[2]
+            if (self.index.assigned_to(resource_id) == self.gossiper.name
+                    or resource_id in self._claims):
+                assigned.add(resource_id)
+        return resources, assigned
+
+    def _peer_order(self, peer):
+        """Return the key that peers are ordered by: their rank, and
+        then their name.
+        """
+        return (peer.get(self.RANK) or 0, peer.name)
 
     def collect_peers(self):
         """Gather up which peers that should be assigned resources.
 
         Skip a peer if it is dead or if it has its C{status} falg set
-        to something else than C{'up'}.
+        to something else than C{'up'}.  Peers are ordered by rank
+        and then by address, so every leader sees the same order.
+
+        The list is cached until a peer comes or goes, or changes its
+        status, rank or weight.
+        """
+        if self._peers is None:
+            peers = [peer for peer in self.gossiper.live_peers
+                     if peer.get(self.STATUS) == 'up']
+            if self.gossiper.get(self.STATUS) == 'up':
+                peers.append(self.gossiper.state)
+            peers.sort(key=self._peer_order)
+            self._peers = [peer.name for peer in peers]
+            self._weights = dict((peer.name, peer.get(self.WEIGHT, 1))
+                                 for peer in peers)
+        return self._peers
+
+    def peer_weights(self):
+        """Return a mapping between the peers from L{collect_peers}
+        and their weights.
         """
-        peers = [peer.name for peer in self.gossiper.live_peers
-                 if peer.get(self.STATUS) == 'up']
-        if self.gossiper.get(self.STATUS) == 'up':
-            peers.append(self.gossiper.name)
-        peers.sort(key=lambda peer: hash(peer))
-        return peers
+        self.collect_peers()
+        return self._weights
+
+    def utilization(self):
+        """Return the load of every peer that accepts resources.
+
+        @return: a C{dict} that maps peer to a C{dict} with its
+            C{weight}, its C{load} (the sum of the costs of its
+            resources) and its C{utilization} (load per unit of
+            weight, where the mean weight is C{1}).
+        """
+        peers = self.collect_peers()
+        weights = self.peer_weights()
+        costs = {}
+        for resource_id in self.index.resources():
+            cost = resource_cost(self.index.resource(resource_id))
+            if cost != 1:
+                costs[resource_id] = cost
+        info = {}
+        for peer, (load, used) in utilization(self.index.assignments(),
+                peers, weights, costs).items():
+            info[peer] = {'weight': weights[peer], 'load': load,
+                          'utilization': used}
+        return info
+
+    def collect_claims(self):
+        """Return a mapping between every resource that a live peer
+        has claimed and that peer.
+        """
+        claims = {}
+        for peer in self.gossiper.live_peers:
+            for resource_id in peer.get(self.CLAIMS) or ():
+                claims[resource_id] = peer.name
+        for resource_id in self._claims:
+            claims[resource_id] = self.gossiper.name
+        return claims
+
+    def _publish_claims(self):
+        self.gossiper.set(self.CLAIMS, sorted(self._claims))
+
+    def _claim_resources(self, dead_peer):
+        """Install our share of the resources of C{dead_peer} and
+        claim them.
+
+        All survivors split the resources the same way as long as
+        they agree on which peers are alive.
+        """
+        peers = self.collect_peers()
+        if self.gossiper.name not in peers:
+            return
+        orphans = [resource_id for resource_id in self.index.resources()
+                   if self.index.assigned_to(resource_id) == dead_peer]
+        if not orphans:
+            return
+        takeover = RendezvousStrategy().compute(orphans, {}, peers,
+            self.peer_weights())
+        claims = [resource_id for resource_id in orphans
+                  if takeover[resource_id] == self.gossiper.name]
+        for resource_id in claims:
+            self._claims.add(resource_id)
+            self.platform.assign_resource(resource_id, True,
+                self.index.resource(resource_id)[2]).addErrback(log.err)
+        if claims:
+            log.msg('claimed %d resources of %s' % (len(claims), dead_peer))
+            self.claimed += len(claims)
+            self._publish_claims()
+
+    def _drop_claims(self, peer):
+        """Release the resources claimed from C{peer}, which turned
+        out to be alive before the leader reassigned them.
+        """
+        dropped = [resource_id for resource_id in self._claims
+                   if self.index.assigned_to(resource_id) == peer]
+        for resource_id in dropped:
+            self._claims.discard(resource_id)
+            self.platform.assign_resource(resource_id, False,
+                self.index.resource(resource_id)[2]).addErrback(log.err)
+        if dropped:
+            self._publish_claims()
 
     def assign_resources(self):
         """Process and assign resources to peers in the cluster."""
-        self.computer.assign_resources(self.collect_peers())
+        self.computer.assign_resources(self.collect_peers(),
+            self.peer_weights(), self.collect_claims())
+
+    def _assignments_changed(self, rebalance=True):
+        """Something that assignments are computed from has changed.
+
+        The shadow is thrown away and, if C{rebalance} is true, a
+        rebalance is scheduled.
+        """
+        self._shadow = None
+        if rebalance:
+            self.rebalancer.trigger()
+
+    def _rebalance(self):
+        """Scheduled rebalance.
+
+        Leadership may have changed since the rebalance was requested,
+        so check who we are: the leader publishes its assignments and
+        the others compute their shadow.
+        """
+        if self.election.is_leader:
+            self.assign_resources()
+        else:
+            self._shadow = self.computer.compute(self.collect_peers(),
+                self.peer_weights(), self.collect_claims())
 
     def make_connection(self, gossiper):
         """Make connection to gossip instance."""
         self.gossiper = gossiper
+        self.gossiper.set(self.RANK, self._rank)
+        self.gossiper.set(self.WEIGHT, self._weight)
         self._update_status()
         self.election.make_connection(gossiper)
         self.keystore.make_connection(gossiper)
-        self._connectivity_checker.start(5)
+        self._connectivity_checker.start(self._probe_interval)
+        self._collector_loop.start(self._gc_interval, now=False)
+
+    def stop(self):
+        """Stop all periodic work."""
+        for loop in (self._connectivity_checker, self._collector_loop,
+                     self._reconcile_loop):
+            if loop.running:
+                loop.stop()
+        self.rebalancer.cancel()
 
     def peer_alive(self, peer):
+        self._peers = None
+        self._shadow = None
         self.election.peer_alive(peer)
+        if self._claims:
+            self._drop_claims(peer.name)
 
     def peer_dead(self, peer):
-        self.election.peer_alive(peer)
+        self._peers = None
+        self.election.peer_dead(peer)
+        if self.fast_takeover and self.election.is_leader is not None:
+            self._claim_resources(peer.name)
+        # The leader moves the resources of the dead peer right away
+        # instead of waiting for the election to complete, and the
+        # others prepare in case the dead peer was the leader.
+        self._assignments_changed()
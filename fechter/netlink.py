@@ -0,0 +1,266 @@
+# Copyright 2011 Johan Rydberg
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Minimal rtnetlink client for adding and removing addresses."""
+
+import errno
+import fcntl
+import os
+import socket
+import struct
+
+
+NETLINK_ROUTE = 0
+
+NLMSG_ERROR = 2
+NLMSG_DONE = 3
+
+NLM_F_REQUEST = 0x001
+NLM_F_ACK = 0x004
+NLM_F_DUMP = 0x300
+NLM_F_EXCL = 0x200
+NLM_F_CREATE = 0x400
+
+RTM_NEWADDR = 20
+RTM_DELADDR = 21
+RTM_GETADDR = 22
+
+IFA_ADDRESS = 1
+IFA_LOCAL = 2
+
+IFA_F_NODAD = 0x02
+
+RT_SCOPE_UNIVERSE = 0
+
+SIOCGIFNAME = 0x8910
+SIOCGIFINDEX = 0x8933
+
+_NLMSGHDR = struct.Struct('=LHHLL')
+_IFADDRMSG = struct.Struct('=BBBBI')
+_RTATTR = struct.Struct('=HH')
+_NLMSGERR = struct.Struct('=i')
+
+
+def _align(length):
+    return (length + 3) & ~3
+
+
+def _pack_attr(attr_type, data):
+    length = _RTATTR.size + len(data)
+    return (_RTATTR.pack(length, attr_type) + data
+            + '\0' * (_align(length) - length))
+
+
+def pack_address_message(msg_type, seq, family, prefixlen, index, address,
+        ifa_flags=0):
+    """Pack a C{RTM_NEWADDR} or C{RTM_DELADDR} request.
+
+    @param address: the address in network byte order.
+    @type address: C{str}
+    @param ifa_flags: C{IFA_F_*} flags of the address.
+    """
+    flags = NLM_F_REQUEST | NLM_F_ACK
+    if msg_type == RTM_NEWADDR:
+        flags |= NLM_F_CREATE | NLM_F_EXCL
+    payload = (_IFADDRMSG.pack(family, prefixlen, ifa_flags,
+                               RT_SCOPE_UNIVERSE, index)
+               + _pack_attr(IFA_LOCAL, address)
+               + _pack_attr(IFA_ADDRESS, address))
+    return _NLMSGHDR.pack(_NLMSGHDR.size + len(payload), msg_type, flags,
+        seq, 0) + payload
+
+
+def pack_dump_request(seq, family):
+    """Pack a C{RTM_GETADDR} request for all addresses of
+    C{family}.
+    """
+    payload = _IFADDRMSG.pack(family, 0, 0, 0, 0)
+    return _NLMSGHDR.pack(_NLMSGHDR.size + len(payload), RTM_GETADDR,
+        NLM_F_REQUEST | NLM_F_DUMP, seq, 0) + payload
+
+
+def parse_attrs(data):
+    """Split the attributes of a message.
+
+    @return: a C{dict} that maps attribute type to its data.
+    """
+    attrs = {}
+    offset = 0
+    while offset + _RTATTR.size <= len(data):
+        length, attr_type = _RTATTR.unpack_from(data, offset)
+        if length < _RTATTR.size:
+            break
+        attrs[attr_type] = data[offset + _RTATTR.size:offset + length]
+        offset += _align(length)
+    return attrs
+
+
+def parse_messages(data):
+    """Split a buffer read from a netlink socket into messages.
+
+    @return: a list of C{(type, flags, seq, payload)} tuples.
+    """
+    messages = []
+    offset = 0
+    while offset + _NLMSGHDR.size <= len(data):
+        length, msg_type, flags, seq, pid = _NLMSGHDR.unpack_from(data,
+            offset)
+        if length < _NLMSGHDR.size:
+            break
+        messages.append((msg_type, flags, seq,
+            data[offset + _NLMSGHDR.size:offset + length]))
+        offset += _align(length)
+    return messages
+
+
+def interface_index(ifname):
+    """Return the index of the interface named C{ifname}."""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        ifreq = fcntl.ioctl(sock.fileno(), SIOCGIFINDEX,
+            struct.pack('16si', ifname, 0))
+    finally:
+        sock.close()
+    return struct.unpack('16si', ifreq)[1]
+
+
+def interface_name(index):
+    """Return the name of the interface with index C{index}."""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        ifreq = fcntl.ioctl(sock.fileno(), SIOCGIFNAME,
+            struct.pack('16si', '', index))
+    finally:
+        sock.close()
+    return struct.unpack('16si', ifreq)[0].rstrip('\0')
+
+
+class NetlinkSocket(object):
+    """A C{NETLINK_ROUTE} socket that changes addresses in batches.
+
+    The socket is used from the reactor thread, so waiting for the
+    kernel gives up after C{timeout} seconds with a C{socket.timeout}
+    rather than hanging the daemon.
+
+    @raise socket.error: if the socket cannot be created.
+    """
+
+    def __init__(self, timeout=5):
+        self._socket = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW,
+            NETLINK_ROUTE)
+        self._socket.bind((0, 0))
+        self._socket.settimeout(timeout)
+        self._seq = 0
+        self._indexes = {}
+
+    def _index(self, ifname):
+        if ifname not in self._indexes:
+            self._indexes[ifname] = interface_index(ifname)
+        return self._indexes[ifname]
+
+    def change_addresses(self, changes):
+        """Add or delete a batch of addresses.
+
+        All requests are sent in one datagram and the kernel
+        acknowledges each one of them.
+
+        @param changes: a sequence of C{(add, ifname, family,
+            address, prefixlen)} tuples, where C{add} is true for
+            additions and false for deletions and C{address} is in
+            presentation format.
+
+        @return: a list with one errno value for each change, where
+            C{0} means success.  A malformed address gives
+            C{EINVAL}.
+        """
+        results = [None] * len(changes)
+        requests = []
+        pending = {}
+        for n, (add, ifname, family, address, prefixlen) in enumerate(
+                changes):
+            try:
+                index = self._index(ifname)
+            except IOError, (err, msg):
+                results[n] = err
+                continue
+            try:
+                packed_address = socket.inet_pton(family, address)
+            except socket.error:
+                results[n] = errno.EINVAL
+                continue
+            self._seq = (self._seq + 1) & 0xffffffff
+            pending[self._seq] = n
+            # Skip duplicate address detection for IPv6, or the
+            # address is unusable for a while after a takeover.
+            ifa_flags = IFA_F_NODAD if family == socket.AF_INET6 else 0
+            requests.append(pack_address_message(
+                RTM_NEWADDR if add else RTM_DELADDR, self._seq, family,
+                prefixlen, index, packed_address, ifa_flags))
+        if requests:
+            self._socket.sendto(''.join(requests), (0, 0))
+        while pending:
+            for msg_type, flags, seq, payload in parse_messages(
+                    self._socket.recv(65536)):
+                if msg_type != NLMSG_ERROR or seq not in pending:
+                    continue
+                error, = _NLMSGERR.unpack_from(payload)
+                results[pending.pop(seq)] = -error
+        return results
+
+    def dump_addresses(self, family):
+        """Return all addresses of C{family} that are configured on
+        any interface.
+
+        @return: a list of C{(ifname, address, prefixlen)} tuples,
+            where C{address} is in presentation format.
+        """
+        self._seq = (self._seq + 1) & 0xffffffff
+        seq = self._seq
+        self._socket.sendto(pack_dump_request(seq, family), (0, 0))
+        names = {}
+        addresses = []
+        while True:
+            for msg_type, flags, msg_seq, payload in parse_messages(
+                    self._socket.recv(65536)):
+                if msg_seq != seq:
+                    continue
+                if msg_type == NLMSG_DONE:
+                    return addresses
+                if msg_type == NLMSG_ERROR:
+                    error, = _NLMSGERR.unpack_from(payload)
+                    raise socket.error(-error, os.strerror(-error))
+                if msg_type != RTM_NEWADDR:
+                    continue
+                (addr_family, prefixlen, flags, scope,
+                 index) = _IFADDRMSG.unpack_from(payload)
+                attrs = parse_attrs(payload[_IFADDRMSG.size:])
+                address = attrs.get(IFA_LOCAL, attrs.get(IFA_ADDRESS))
+                if address is None:
+                    continue
+                if index not in names:
+                    try:
+                        names[index] = interface_name(index)
+                    except IOError:
+                        continue
+                addresses.append((names[index],
+                    socket.inet_ntop(addr_family, address), prefixlen))
+
+
+def ignorable_error(add, err):
+    """Return C{True} if C{err} means that the address already was in
+    the requested state.
+    """
+    if add:
+        return err == errno.EEXIST
+    return err == errno.EADDRNOTAVAIL
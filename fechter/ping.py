@@ -13,12 +13,15 @@
 # limitations under the License.
 
 import array
+import bisect
+import collections
+import errno
 import os
 import struct
 import sys
 import socket
 
-from twisted.internet import abstract, defer, error
+from twisted.internet import abstract
 
 
 ECHO = 8
@@ -29,28 +32,66 @@ def _in_cksum(packet):
     """Generates a checksum of a packet."""
     if len(packet) & 1:
         packet = packet + '\0'
-    words = array.array('h', packet)
-    csum = 0
-    for word in words:
-        csum += (word & 0xffff)
-    hi = csum >> 16
-    lo = csum & 0xffff
-    csum = hi + lo
+    csum = sum(array.array('H', packet))
+    csum = (csum >> 16) + (csum & 0xffff)
     csum = csum + (csum >> 16)
     return socket.htons((~csum) & 0xffff)
 
 
+def _valid_cksum(packet):
+    """Return C{True} if the checksum of C{packet} is correct."""
+    if len(packet) & 1:
+        packet = packet + '\0'
+    csum = sum(array.array('H', packet))
+    csum = (csum >> 16) + (csum & 0xffff)
+    csum = csum + (csum >> 16)
+    return (csum & 0xffff) == 0xffff
+
+
+def _update_cksum(checksum, old, new):
+    """Update C{checksum} for a 16-bit field that changed from
+    C{old} to C{new}, as in RFC 1624, equation 3.
+    """
+    csum = (~checksum & 0xffff) + (~old & 0xffff) + new
+    csum = (csum >> 16) + (csum & 0xffff)
+    csum = csum + (csum >> 16)
+    return ~csum & 0xffff
+
+
+def _payload(num_data_bytes):
+    """Return the data of an ICMP ECHO package."""
+    start_val = 0x42
+    return ''.join([chr(i & 0xff)
+                    for i in range(start_val, start_val + num_data_bytes)])
+
+
+class _EchoTemplate(object):
+    """Pre-packed ICMP ECHO package.
+
+    Only the sequence number differs between the packages sent by a
+    L{Pinger}, so the package is packed and summed once and the
+    checksum is then updated for each sequence number.
+    """
+
+    def __init__(self, packet_id, num_data_bytes):
+        self.packet_id = packet_id
+        self.data = _payload(num_data_bytes)
+        header = struct.pack("!BBHHH", ECHO, 0, 0, packet_id, 0)
+        self.checksum = _in_cksum(header + self.data)
+
+    def pack(self, sequence_no):
+        """Return the package with sequence number C{sequence_no}."""
+        checksum = _update_cksum(self.checksum, 0, sequence_no)
+        return struct.pack("!BBHHH", ECHO, 0, checksum, self.packet_id,
+            sequence_no) + self.data
+
+
 def _pack_icmp(packet_id, sequence_no, num_data_bytes):
     """Pack a ICMP ECHO package and return it."""
     checksum = 0
     header = struct.pack("!BBHHH", ECHO, 0, checksum, packet_id,
         sequence_no)
-
-    data_bytes = []
-    start_val = 0x42
-    for i in range(start_val, start_val + num_data_bytes):
-        data_bytes += [(i & 0xff)]
-    data = bytes(data_bytes)
+    data = _payload(num_data_bytes)
 
     checksum = _in_cksum(header + data)
     header = struct.pack("!BBHHH", ECHO, 0, checksum, packet_id,
@@ -69,60 +110,171 @@ def _unpack_icmp(packet):
     return type, packet_id, seq_number
 
 
+# Upper bounds, in seconds, of the buckets of the round-trip time
+# histogram.  A last bucket holds everything slower.
+RTT_BUCKETS = (0.0005, 0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2,
+               0.5)
+
+
+class _Target(object):
+    """Sliding window of probe outcomes for one address.
+
+    Besides the window, totals and a histogram of round-trip times
+    are kept since the start.
+    """
+
+    def __init__(self, address, window):
+        self.address = address
+        self.outcomes = collections.deque(maxlen=window)
+        self.rtts = collections.deque(maxlen=window)
+        self.sent = 0
+        self.received = 0
+        self.lost = 0
+        self.histogram = [0] * (len(RTT_BUCKETS) + 1)
+
+    def record(self, rtt):
+        """Record the outcome of a probe; C{rtt} is C{None} if the
+        probe was lost.
+        """
+        self.outcomes.append(rtt is not None)
+        if rtt is None:
+            self.lost += 1
+        else:
+            self.received += 1
+            self.rtts.append(rtt)
+            self.histogram[bisect.bisect_left(RTT_BUCKETS, rtt)] += 1
+
+    def loss(self):
+        """Return the fraction of probes in the window that were
+        lost, or C{1.0} if nothing is known yet.
+        """
+        if not self.outcomes:
+            return 1.0
+        return self.outcomes.count(False) / float(len(self.outcomes))
+
+    def rtt(self):
+        """Return the mean round-trip time of the replies in the
+        window, or C{None} if there are none.
+        """
+        if not self.rtts:
+            return None
+        return sum(self.rtts) / len(self.rtts)
+
+    def stats(self):
+        """Return counters as a C{dict}.
+
+        The histogram is a list of C{[bound, count]} pairs, where
+        C{bound} is the upper bound of the bucket in seconds, or
+        C{None} for the last bucket.
+        """
+        return {'sent': self.sent, 'received': self.received,
+                'lost': self.lost, 'loss': self.loss(), 'rtt': self.rtt(),
+                'histogram': [[bound, count] for (bound, count) in zip(
+                        RTT_BUCKETS + (None,), self.histogram)]}
+
+
 class Pinger(abstract.FileDescriptor):
-    """Functionality for checking connectivity with a remote host.
+    """Functionality for checking connectivity with remote hosts.
+
+    The connectivity check is done by sending ICMP ECHOs (aka pings)
+    to a set of targets and expecting replies.  Every call to L{probe}
+    sends one ECHO to each target over the same socket, without
+    waiting for earlier probes to be answered.  A probe that is not
+    answered within C{timeout} seconds counts as lost.
 
-    The connectivity check is done by sending a ICMP ECHO (aka a ping)
-    and expecting a reply.
+    For each target the outcome of the last C{window} probes is kept.
+    A target is reachable if at most C{max_loss} of those probes were
+    lost, and we have connectivity if at least C{quorum} targets are
+    reachable (by default a majority of them).
     """
-    seqno = 0
 
-    def __init__(self, reactor, socket, address):
+    MAX_READS = 64
+
+    def __init__(self, reactor, socket, addresses, timeout=1.0, window=10,
+            max_loss=0.5, quorum=None):
         abstract.FileDescriptor.__init__(self, reactor)
         self._socket = socket
+        self._socket.setblocking(False)
         self._reading = 0
         self._waiting = {}
-        self._address = address
-
-    def _timeout(self, seq_no):
-        if seq_no in self._waiting:
-            d = self._waiting.pop(seq_no)
-            d.errback(error.TimeoutError())
-
-    def check_connectivity(self, timeout=2):
-        """Check connectivity with remote address.
+        if isinstance(addresses, basestring):
+            addresses = [addresses]
+        self.targets = [_Target(address, window) for address in addresses]
+        self._targets = dict((target.address, target)
+                             for target in self.targets)
+        self.timeout = timeout
+        self.max_loss = max_loss
+        if quorum is None:
+            quorum = len(self.targets) // 2 + 1
+        self.quorum = quorum
+        self.seqno = 0
+        self._template = _EchoTemplate(os.getpid() & 0xffff, 55)
 
-        Will send a ICMP ECHO packet to the remote address and expects
-        a reply.
+    def _expire(self, now):
+        """Count probes that have not been answered in time as lost."""
+        for seq_no, (target, sent_at) in self._waiting.items():
+            if now - sent_at >= self.timeout:
+                del self._waiting[seq_no]
+                target.record(None)
 
-        @return: a deferred that will be called with C{None} on
-            success or with C{TimeoutError} if the address did not
-            respond.
-        """
-        self.seqno += 1
-        d = defer.Deferred()
-        self._waiting[self.seqno] = d
-
-        # Construct a ICMP ECHO package and send it to the address.
-        packet_id = os.getpid() & 0xffff
-        self._socket.sendto(_pack_icmp(packet_id, self.seqno, 55), (
-                self._address, 1))
+    def probe(self):
+        """Send an ICMP ECHO to every target."""
+        now = self.reactor.seconds()
+        self._expire(now)
+        for target in self.targets:
+            self.seqno = (self.seqno + 1) & 0xffff
+            self._waiting[self.seqno] = (target, now)
+            target.sent += 1
+            try:
+                self._socket.sendto(self._template.pack(self.seqno),
+                    (target.address, 1))
+            except socket.error:
+                # Most likely no route to the target; the probe will
+                # time out and be counted as lost.
+                pass
         if not self._reading:
             self._reading = 1
             self.startReading()
 
-        self.reactor.callLater(timeout, self._timeout, self.seqno)
-        return d
+    def reachable(self):
+        """Return C{True} if enough targets are reachable."""
+        return len([target for target in self.targets
+                    if target.loss() <= self.max_loss]) >= self.quorum
 
     def doRead(self):
-        """Read from file descriptor."""
-        data, address = self._socket.recvfrom(2048)
-        packet_type, packet_id, seq_no = _unpack_icmp(data)
-        if packet_type != ECHOREPLY:
-            return
-        if seq_no in self._waiting:
-            d = self._waiting.pop(seq_no)
-            d.callback(None)
+        """Read from file descriptor.
+
+        All replies that have arrived are handled in one go.
+        """
+        now = self.reactor.seconds()
+        for i in range(self.MAX_READS):
+            try:
+                data, address = self._socket.recvfrom(2048)
+            except socket.error, (err, msg):
+                if err in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    break
+                raise
+            packet_type, packet_id, seq_no = _unpack_icmp(data)
+            if (packet_type != ECHOREPLY
+                    or packet_id != self._template.packet_id
+                    or seq_no not in self._waiting):
+                # Not a reply to one of our probes; all ICMP traffic
+                # to the host is seen on a raw socket.
+                continue
+            if not _valid_cksum(data[20:]):
+                continue
+            target, sent_at = self._waiting[seq_no]
+            if target.address != address[0]:
+                continue
+            del self._waiting[seq_no]
+            target.record(now - sent_at)
+
+    def stats(self):
+        """Return counters of every target as a C{dict} keyed by
+        address.
+        """
+        return dict((target.address, target.stats())
+                    for target in self.targets)
 
     def fileno(self):
         """File Descriptor number for select()."""
@@ -14,33 +14,208 @@
 
 """System specific functionality for installing resources."""
 
-import struct
+import os
 import socket
 
-from twisted.python import log
+from twisted.python import log, failure
 from twisted.internet import utils, defer
 
+from . import netlink
+from .announce import Announcer, address_family
 
-ETH_BROADCAST = 'ff:ff:ff:ff:ff:ff'
-ETH_TYPE_ARP = 0x0806
+
+def host_prefixlen(family):
+    """Return the prefix length of a single address of C{family}."""
+    return 128 if family == socket.AF_INET6 else 32
+
+
+def canonical_resource(resource):
+    """Return C{resource}, an C{ifname:address} string, with the
+    address in the form the system lists it in.
+
+    IPv6 addresses can be written in many ways, and a resource that
+    is not in the listed form would never match an installed address.
+
+    @raise ValueError: if C{resource} is not an interface name and an
+        IPv4 or IPv6 address.
+    """
+    if ':' not in resource:
+        raise ValueError('not of the form IFNAME:ADDRESS: %s' % (resource,))
+    ifname, address = resource.split(':', 1)
+    try:
+        if address_family(address) == socket.AF_INET6:
+            address = socket.inet_ntop(socket.AF_INET6,
+                socket.inet_pton(socket.AF_INET6, address))
+        else:
+            socket.inet_aton(address)
+    except socket.error:
+        raise ValueError('not a valid IPv4 or IPv6 address: %s' % (
+                address,))
+    return '%s:%s' % (ifname, address)
+
+
+def parse_addresses(output):
+    """Parse the output of C{ip -o addr show}.
+
+    @return: a list of C{(ifname, address, prefixlen)} tuples.
+    """
+    addresses = []
+    for line in output.splitlines():
+        fields = line.split()
+        if len(fields) < 4 or fields[2] not in ('inet', 'inet6'):
+            continue
+        address, prefixlen = fields[3].split('/')
+        addresses.append((fields[1], address, int(prefixlen)))
+    return addresses
 
 
 class AbstractPlatform(object):
-    """Base class for platform implementations."""
+    """Base class for platform implementations.
+
+    Installs and releases are queued.  Actions on the same resource
+    run one at a time in the order they were requested, and at most
+    C{concurrency} actions run at the same time.
+
+    @ivar depth: number of queued or running actions.
+    """
 
-    def __init__(self):
+    def __init__(self, clock, concurrency=64):
+        self.clock = clock
         self._assigned_resources = {}
+        self._semaphore = defer.DeferredSemaphore(concurrency)
+        self._queues = {}
+        self.depth = 0
+        self.completed = 0
+        self.failed = 0
+        self.last_latency = 0
+        self.max_latency = 0
+        self._total_latency = 0
+        self.reconciliations = 0
+        self.corrections = 0
 
     def assign_resource(self, resource_id, assign_to_me, resource):
-        """Possible assign a resource to this platform."""
+        """Possible assign a resource to this platform.
+
+        @return: a deferred that fires when the resource has been
+            installed or released, or when earlier actions on the
+            resource are done if nothing had to be done.
+        """
         if assign_to_me:
             if resource_id not in self._assigned_resources:
                 self._assigned_resources[resource_id] = resource
-                self._install_resource(resource)
+                return self._enqueue(resource_id, self._install_resource,
+                    resource)
         else:
             if resource_id in self._assigned_resources:
-                del self._assigned_resources[resource_id]
-                self._release_resource(resource)
+                resource = self._assigned_resources.pop(resource_id)
+                return self._enqueue(resource_id, self._release_resource,
+                    resource)
+        return self._enqueue(resource_id, None, resource)
+
+    def _enqueue(self, resource_id, action, resource):
+        d = defer.Deferred()
+        queue = self._queues.setdefault(resource_id, [])
+        queue.append((action, resource, d, self.clock.seconds()))
+        if action is not None:
+            self.depth += 1
+        if len(queue) == 1:
+            self._start(resource_id)
+        return d
+
+    def _start(self, resource_id):
+        action, resource, d, queued_at = self._queues[resource_id][0]
+        if action is None:
+            self._finished(None, resource_id)
+        else:
+            self._semaphore.run(action, resource).addBoth(self._finished,
+                resource_id)
+
+    def _finished(self, result, resource_id):
+        queue = self._queues[resource_id]
+        action, resource, d, queued_at = queue.pop(0)
+        if action is not None:
+            self.depth -= 1
+            latency = self.clock.seconds() - queued_at
+            self.last_latency = latency
+            self.max_latency = max(self.max_latency, latency)
+            self._total_latency += latency
+            if isinstance(result, failure.Failure):
+                self.failed += 1
+            else:
+                self.completed += 1
+        if queue:
+            self._start(resource_id)
+        else:
+            del self._queues[resource_id]
+        if isinstance(result, failure.Failure):
+            d.errback(result)
+        else:
+            d.callback(result)
+
+    @defer.inlineCallbacks
+    def reconcile(self, desired):
+        """Bring the resources installed on the system in line with
+        the resources assigned to this platform.
+
+        The installed resources are listed in one go and only the
+        differences are installed or released.  Installed resources
+        that are not in C{resources} are not ours and are left alone.
+        Resources that have actions queued are skipped, since those
+        actions will change them anyway.
+
+        @param desired: a callable that returns a tuple of
+            C{resources}, a mapping between the id of every resource
+            in the cluster and the resource, and C{assigned}, the ids
+            of the resources that are assigned to this platform.  It
+            is called when the listing is done, since assignments may
+            change while the resources are being listed.
+
+        @return: a deferred that fires with the number of resources
+            that were installed or released when those actions are
+            done.
+        """
+        installed = yield self._installed_resources()
+        resources, assigned = desired()
+        actions = []
+        for resource_id, resource in resources.iteritems():
+            if resource_id in self._queues:
+                continue
+            if resource_id in assigned:
+                self._assigned_resources[resource_id] = resource
+                if resource not in installed:
+                    actions.append(self._enqueue(resource_id,
+                        self._install_resource, resource))
+            else:
+                self._assigned_resources.pop(resource_id, None)
+                if resource in installed:
+                    actions.append(self._enqueue(resource_id,
+                        self._release_resource, resource))
+        for d in actions:
+            d.addErrback(log.err)
+        self.reconciliations += 1
+        self.corrections += len(actions)
+        if actions:
+            log.msg('reconciliation corrected %d resources' % (
+                    len(actions),))
+        yield defer.DeferredList(actions)
+        defer.returnValue(len(actions))
+
+    def stats(self):
+        """Return queue depth and latency counters as a C{dict}."""
+        done = self.completed + self.failed
+        return {'depth': self.depth, 'completed': self.completed,
+                'failed': self.failed, 'last_latency': self.last_latency,
+                'max_latency': self.max_latency,
+                'mean_latency': self._total_latency / done if done else 0,
+                'reconciliations': self.reconciliations,
+                'corrections': self.corrections}
+
+    def _installed_resources(self):
+        """List installed resources.
+
+        @return: a deferred that fires with a C{set} of resources.
+        """
+        raise NotImplementedError("installed_resources")
 
     def _install_resource(self, resource):
         """Install resource."""
@@ -51,90 +226,150 @@ class AbstractPlatform(object):
         raise NotImplementedError("release_resource")
 
 
-def ether_aton(addr):
-    """Convert a ethernet address in form AA:BB:... to a sequence of
-    bytes.
-    """
-    return ''.join([struct.pack("B", int(nn, 16))
-                    for nn in addr.split(':')])
+class LinuxPlatform(AbstractPlatform):
+    """GNU/Linux platform."""
+
+    def __init__(self, clock, sbin_ip='/sbin/ip', concurrency=64,
+            announcer=None):
+        AbstractPlatform.__init__(self, clock, concurrency)
+        self.sbin_ip = sbin_ip
+        if announcer is None:
+            announcer = Announcer(clock)
+        self.announcer = announcer
 
+    def _add_address(self, ifname, address):
+        """Add C{address} to interface C{ifname}.
 
-def _send_arp(ifname, address):
-    """Send out a gratuitous on interface C{ifname}."""
-    # Try to get hold of a socket:
-    try:
-        ether_socket = socket.socket(socket.AF_PACKET, socket.SOCK_RAW)
-        ether_socket.bind((ifname, ETH_TYPE_ARP))
-        ether_addr = ether_socket.getsockname()[4]
-    except socket.error, (errno, msg):
-        if errno == 1:
-            log.msg('ARP messages can only be sent by root')
-            return
-        raise
-    # From Wikipedia:
-    #
-    # ARP may also be used as a simple announcement protocol. This is
-    # useful for updating other hosts' mapping of a hardware address
-    # when the sender's IP address or MAC address has changed. Such an
-    # announcement, also called a gratuitous ARP message, is usually
-    # broadcast as an ARP request containing the sender's protocol
-    # address (SPA) in the target field (TPA=SPA), with the target
-    # hardware address (THA) set to zero. An alternative is to
-    # broadcast an ARP reply with the sender's hardware and protocol
-    # addresses (SHA and SPA) duplicated in the target fields
-    # (TPA=SPA, THA=SHA).
-    gratuitous_arp = [
-        # HTYPE
-        struct.pack("!h", 1),
-        # PTYPE (IPv4)
-        struct.pack("!h", 0x0800),
-        # HLEN
-        struct.pack("!B", 6),
-        # PLEN
-        struct.pack("!B", 4),
-        # OPER (reply)
-        struct.pack("!h", 2),
-        # SHA
-        ether_addr,
-        # SPA
-        socket.inet_aton(address),
-        # THA
-        ether_addr,
-        # TPA
-        socket.inet_aton(address)
-        ]
-    ether_frame = [
-        # Destination address:
-        ether_aton(ETH_BROADCAST),
-        # Source address:
-        ether_addr,
-        # Protocol
-        struct.pack("!h", ETH_TYPE_ARP),
-        # Data
-        ''.join(gratuitous_arp)
-        ]
-    ether_socket.send(''.join(ether_frame))
-    ether_socket.close()
+        @return: a deferred that fires when the address has been added.
+        """
+        family = address_family(address)
+        args = ['addr', 'add', str('%s/%d' % (address,
+                host_prefixlen(family))), 'dev', str(ifname)]
+        if family == socket.AF_INET6:
+            # Duplicate address detection would keep the address
+            # unusable for a second or so after a takeover.
+            args.append('nodad')
+        return utils.getProcessOutput(self.sbin_ip, args)
 
+    def _del_address(self, ifname, address):
+        """Remove C{address} from interface C{ifname}.
 
-class LinuxPlatform(AbstractPlatform):
-    """GNU/Linux platform."""
+        @return: a deferred that fires when the address has been
+            removed.
+        """
+        return utils.getProcessOutput(self.sbin_ip, ['addr', 'del',
+                str('%s/%d' % (address, host_prefixlen(address_family(
+                                address)))), 'dev', str(ifname)])
 
-    def __init__(self, sbin_ip='/sbin/ip'):
-        AbstractPlatform.__init__(self)
-        self.sbin_ip = sbin_ip
+    def _list_addresses(self):
+        """List the addresses of all interfaces.
+
+        @return: a deferred that fires with a list of C{(ifname,
+            address, prefixlen)} tuples.
+        """
+        d = utils.getProcessOutput(self.sbin_ip, ['-o', 'addr', 'show'])
+        return d.addCallback(parse_addresses)
+
+    def _installed_resources(self):
+        d = self._list_addresses()
+        return d.addCallback(lambda addresses: set(
+                '%s:%s' % (ifname, address)
+                for (ifname, address, prefixlen) in addresses
+                if prefixlen == host_prefixlen(address_family(address))))
 
     @defer.inlineCallbacks
     def _install_resource(self, resource):
         """Install resource."""
         ifname, address = resource.split(':', 1)
-        yield utils.getProcessOutput(self.sbin_ip, ['addr', 'add',
-                str('%s/32' % (address)), 'dev', str(ifname)])
-        _send_arp(ifname, address)
+        yield self._add_address(ifname, address)
+        self.announcer.announce(ifname, address)
 
     def _release_resource(self, resource):
         """Release resource."""
         ifname, address = resource.split(':', 1)
-        utils.getProcessOutput(self.sbin_ip, ['addr', 'del',
-                str('%s/32' % (address)),
-                'dev', str(ifname)]).addErrback(log.err)
+        self.announcer.cancel(ifname, address)
+        return self._del_address(ifname, address)
+
+    def stats(self):
+        info = AbstractPlatform.stats(self)
+        info['announcements'] = self.announcer.stats()
+        return info
+
+
+class NetlinkPlatform(LinuxPlatform):
+    """GNU/Linux platform that changes addresses over rtnetlink.
+
+    Address changes requested during one reactor iteration are sent
+    to the kernel in a single batch.  If no netlink socket can be
+    opened, C{/sbin/ip} is used instead.
+    """
+
+    def __init__(self, clock, sbin_ip='/sbin/ip', concurrency=64,
+            announcer=None, netlink_socket=None):
+        LinuxPlatform.__init__(self, clock, sbin_ip, concurrency, announcer)
+        if netlink_socket is None:
+            try:
+                netlink_socket = netlink.NetlinkSocket()
+            except socket.error, err:
+                log.msg('cannot open netlink socket, using %s: %s' % (
+                        sbin_ip, err))
+        self._netlink = netlink_socket
+        self._batch = []
+        self._flush_call = None
+        self.batches = 0
+
+    def _change(self, add, ifname, address):
+        """Queue an address change.
+
+        @return: a deferred that fires when the kernel has
+            acknowledged the change.
+        """
+        d = defer.Deferred()
+        self._batch.append((add, ifname, address, d))
+        if self._flush_call is None:
+            self._flush_call = self.clock.callLater(0, self._flush)
+        return d
+
+    def _flush(self):
+        """Send all queued address changes to the kernel."""
+        self._flush_call = None
+        batch, self._batch = self._batch, []
+        self.batches += 1
+        try:
+            changes = []
+            for add, ifname, address, d in batch:
+                family = address_family(address)
+                changes.append((add, str(ifname), family, address,
+                    host_prefixlen(family)))
+            results = self._netlink.change_addresses(changes)
+        except socket.error, err:
+            for add, ifname, address, d in batch:
+                d.errback(err)
+            return
+        for (add, ifname, address, d), err in zip(batch, results):
+            if not err or netlink.ignorable_error(add, err):
+                d.callback(None)
+            else:
+                d.errback(OSError(err, '%s %s on %s: %s' % (
+                            'adding' if add else 'deleting', address,
+                            ifname, os.strerror(err))))
+
+    def _list_addresses(self):
+        if self._netlink is None:
+            return LinuxPlatform._list_addresses(self)
+        try:
+            return defer.succeed(
+                self._netlink.dump_addresses(socket.AF_INET)
+                + self._netlink.dump_addresses(socket.AF_INET6))
+        except socket.error:
+            return defer.fail()
+
+    def _add_address(self, ifname, address):
+        if self._netlink is None:
+            return LinuxPlatform._add_address(self, ifname, address)
+        return self._change(True, ifname, address)
+
+    def _del_address(self, ifname, address):
+        if self._netlink is None:
+            return LinuxPlatform._del_address(self, ifname, address)
+        return self._change(False, ifname, address)
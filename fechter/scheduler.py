@@ -0,0 +1,92 @@
+# Copyright 2011 Johan Rydberg
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from twisted.python import log
+
+
+class CoalescingScheduler(object):
+    """Collapse a burst of triggers into a single call.
+
+    When triggered, the function is called once the triggers have
+    been quiet for C{min_interval} seconds, but never later than
+    C{max_delay} seconds after the first trigger of the burst.  Since
+    every trigger waits for at least C{min_interval}, two calls are
+    at least C{min_interval} seconds apart, unless L{flush} is used.
+
+    @ivar triggers: number of times the scheduler has been triggered.
+    @ivar runs: number of times the function has been called.
+    @ivar absorbed: number of triggers that were collapsed into an
+        already pending call.
+    """
+
+    def __init__(self, clock, func, min_interval=0.2, max_delay=1.0):
+        if max_delay < min_interval:
+            raise ValueError("max_delay must not be less than min_interval")
+        self.clock = clock
+        self.func = func
+        self.min_interval = min_interval
+        self.max_delay = max_delay
+        self.triggers = 0
+        self.runs = 0
+        self.absorbed = 0
+        self._call = None
+        self._first = None
+
+    def trigger(self):
+        """Request that the function is called."""
+        self.triggers += 1
+        now = self.clock.seconds()
+        if self._call is None:
+            self._first = now
+        else:
+            self.absorbed += 1
+        delay = min(self.min_interval, self._first + self.max_delay - now)
+        if self._call is None:
+            self._call = self.clock.callLater(delay, self._run)
+        else:
+            self._call.reset(delay)
+
+    def flush(self):
+        """Trigger and call the function right away.
+
+        A pending call is absorbed into this one.
+        """
+        self.triggers += 1
+        if self._call is not None:
+            self.absorbed += 1
+            self.cancel()
+        self._run()
+
+    def pending(self):
+        """Return C{True} if a call is scheduled."""
+        return self._call is not None
+
+    def cancel(self):
+        """Cancel a pending call, if any."""
+        if self._call is not None:
+            self._call.cancel()
+            self._call = None
+
+    def _run(self):
+        self._call = None
+        self.runs += 1
+        try:
+            self.func()
+        except Exception:
+            log.err(None, 'scheduled call failed')
+
+    def stats(self):
+        """Return counters as a C{dict}."""
+        return {'triggers': self.triggers, 'runs': self.runs,
+                'absorbed': self.absorbed}
@@ -17,8 +17,8 @@ import socket
 
 from twisted.application import service
 from twisted.web import server, http
-from txgossip.gossip import Gossiper
-from . import keystore, rest, platform, assign, ping
+from . import keystore, rest, platform, assign, ping, announce
+from .detector import DetectingGossiper
 
 
 class StatusController:
@@ -72,9 +72,25 @@ class InfoController:
                 'phi': peer.detector.phi(
                     self.clock.seconds()),
                 'status': peer.get('private:status'),
+                'detection_latency': peer.detection_latency,
+                'expected_detection': peer.expected_detection(),
+                'detections': peer.detections,
                 }
         return {'neighborhood': neighborhood,
-            'connectivity': self.protocol.connectivity()}
+            'connectivity': self.protocol.connectivity(),
+            'gateways': self.protocol.pinger.stats(),
+            'utilization': self.protocol.utilization(),
+            'rebalance': self._rebalance_info(),
+            'gc': self.protocol.collector.stats(),
+            'platform': self.protocol.platform.stats()}
+
+    def _rebalance_info(self):
+        info = self.protocol.rebalancer.stats()
+        info['moves'] = self.protocol.computer.last_moves
+        info['keys_written'] = self.protocol.computer.last_writes
+        info['total_keys_written'] = self.protocol.computer.writes
+        info['claimed'] = self.protocol.claimed
+        return info
 
 
 class ResourceCollectionController:
@@ -89,18 +105,45 @@ class ResourceCollectionController:
         return self.protocol.list_resources()
 
     def post(self, router, request, url, data):
-        """Create a new resource."""
-        if type(data) != str:
+        """Create a new resource.
+
+        The resource is either given as a string, or as an object
+        with a C{resource} string, an optional numeric C{cost} and an
+        optional C{group} string.
+        """
+        cost = 1
+        group = None
+        if type(data) == dict:
+            cost = data.get('cost', 1)
+            group = data.get('group')
+            data = data.get('resource')
+            if type(cost) not in (int, float) or cost <= 0:
+                return http.BAD_REQUEST
+            if group is not None:
+                if type(group) not in (str, unicode) or not group:
+                    return http.BAD_REQUEST
+                group = str(group)
+        if type(data) not in (str, unicode):
             return http.BAD_REQUEST
-        self.protocol.add_resource(data)
+        try:
+            resource = platform.canonical_resource(str(data))
+        except ValueError:
+            return http.BAD_REQUEST
+        self.protocol.add_resource(resource, cost, group)
         return http.CREATED
 
 
 class Fechter(service.Service):
     """High-availability service."""
 
-    def __init__(self, reactor, listen_addr, listen_port, gateway,
-            storage, phi=8):
+    def __init__(self, reactor, listen_addr, listen_port, gateways,
+            storage, phi=8, strategy=None, incremental=False,
+            rebalance_interval=0.2, rebalance_max_delay=1.0, gc_interval=60,
+            tombstone_max_age=3600, use_netlink=True, concurrency=64,
+            arp_schedule=(0, 1, 2, 4), reconcile_interval=60,
+            probe_interval=0.2, max_loss=0.5, quorum=None,
+            adaptive_detection=False, gossip_interval=1, rank=0, weight=1,
+            vote_delay=2, fast_takeover=False, packed_assignments=False):
         self.reactor = reactor
         self._listen_addr = listen_addr
         self._listen_port = listen_port
@@ -112,11 +155,27 @@ class Fechter(service.Service):
             if errno == 1:
                 raise Exception("ICMP messages can only be sent by root")
             raise
-        self.pinger = ping.Pinger(reactor, icmp_socket, gateway)
-        self.platform = platform.LinuxPlatform()
+        self.pinger = ping.Pinger(reactor, icmp_socket, gateways,
+            max_loss=max_loss, quorum=quorum)
+        announcer = announce.Announcer(reactor, arp_schedule)
+        if use_netlink:
+            self.platform = platform.NetlinkPlatform(reactor,
+                concurrency=concurrency, announcer=announcer)
+        else:
+            self.platform = platform.LinuxPlatform(reactor,
+                concurrency=concurrency, announcer=announcer)
         self.protocol = keystore.FechterProtocol(reactor, storage,
-            self.platform, self.pinger)
-        self.gossiper = Gossiper(reactor, self.protocol, listen_addr)
+            self.platform, self.pinger, strategy=strategy,
+            incremental=incremental, rebalance_interval=rebalance_interval,
+            rebalance_max_delay=rebalance_max_delay, gc_interval=gc_interval,
+            tombstone_max_age=tombstone_max_age,
+            reconcile_interval=reconcile_interval,
+            probe_interval=probe_interval, rank=rank, weight=weight,
+            vote_delay=vote_delay, fast_takeover=fast_takeover,
+            packed_assignments=packed_assignments)
+        self.gossiper = DetectingGossiper(reactor, self.protocol,
+            listen_addr, phi=phi, adaptive=adaptive_detection,
+            interval=gossip_interval)
 
         self.router = rest.Router()
         self.router.addController('info', InfoController(
@@ -136,3 +195,8 @@ class Fechter(service.Service):
         # This is so ugly:
         self.gossiper.set(self.protocol.election.PRIO_KEY, 0)
         self.protocol.keystore.load_from(self.storage)
+
+    def stopService(self):
+        """Stop the service."""
+        if hasattr(self.storage, 'close'):
+            self.storage.close()
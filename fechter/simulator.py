@@ -0,0 +1,301 @@
+# Copyright 2011 Johan Rydberg
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""In-process simulation of a fechter cluster.
+
+A L{SimulatedCluster} runs a number of L{FechterProtocol}s on one
+L{task.Clock}.  Their gossipers talk over a L{SimulatedNetwork} that
+can lose packets, be partitioned and have nodes taken off it, and
+addresses are installed on a L{SimulatedPlatform} that only records
+what it holds.  Runs with the same seed take the same course.
+"""
+
+import random
+
+from twisted.internet import defer, task
+
+from .detector import DetectingGossiper
+from .keystore import FechterProtocol
+from .platform import AbstractPlatform
+
+
+class _Address(object):
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+
+
+class _Transport(object):
+
+    def __init__(self, network, name):
+        self.network = network
+        self.name = name
+
+    def write(self, data, address):
+        self.network.send(self.name, data, address)
+
+    def getHost(self):
+        host, port = self.name.split(':')
+        return _Address(host, int(port))
+
+
+class SimulatedNetwork(object):
+    """Delivers datagrams between gossipers after C{latency} seconds.
+
+    Datagrams to and from nodes that are down, and between nodes on
+    different sides of a partition, are dropped.  Of the others a
+    fraction C{loss} is dropped at random.
+
+    @ivar bytes_sent: number of bytes written by all nodes.
+    @ivar packets_sent: number of datagrams written by all nodes.
+    @ivar packets_dropped: number of datagrams that were not
+        delivered.
+    @ivar max_packet: size of the largest datagram written.
+    """
+
+    def __init__(self, clock, latency=0.001, loss=0.0, seed=0):
+        self.clock = clock
+        self.latency = latency
+        self.loss = loss
+        self.random = random.Random(seed)
+        self.nodes = {}
+        self.down = set()
+        self._sides = None
+        self.bytes_sent = 0
+        self.packets_sent = 0
+        self.packets_dropped = 0
+        self.max_packet = 0
+
+    def connect(self, name, gossiper):
+        """Put C{gossiper} on the network under C{name}."""
+        gossiper.transport = _Transport(self, name)
+        self.nodes[name] = gossiper
+
+    def partition(self, *sides):
+        """Split the network into C{sides}, each a sequence of node
+        names.  Nodes that are not on any side can not reach anyone.
+        """
+        self._sides = {}
+        for n, side in enumerate(sides):
+            for name in side:
+                self._sides[name] = n
+
+    def heal(self):
+        """Remove the partition."""
+        self._sides = None
+
+    def reachable(self, source, destination):
+        """Return true if C{source} can reach C{destination}."""
+        if source in self.down or destination in self.down:
+            return False
+        if destination not in self.nodes:
+            return False
+        if self._sides is not None:
+            side = self._sides.get(source)
+            return side is not None and side == self._sides.get(destination)
+        return True
+
+    def send(self, source, data, address):
+        self.bytes_sent += len(data)
+        self.packets_sent += 1
+        self.max_packet = max(self.max_packet, len(data))
+        destination = '%s:%d' % address
+        if (not self.reachable(source, destination)
+                or (self.loss and self.random.random() < self.loss)):
+            self.packets_dropped += 1
+            return
+        host, port = source.split(':')
+        self.clock.callLater(self.latency,
+            self.nodes[destination].datagramReceived, data,
+            (host, int(port)))
+
+
+class SimulatedPlatform(AbstractPlatform):
+    """Platform that keeps track of the resources it holds.
+
+    @ivar installed: the resources that are installed.
+    @ivar installs: number of resources installed.
+    @ivar releases: number of resources released.
+    """
+
+    def __init__(self, clock):
+        AbstractPlatform.__init__(self, clock)
+        self.installed = set()
+        self.installs = 0
+        self.releases = 0
+
+    def _installed_resources(self):
+        return defer.succeed(set(self.installed))
+
+    def _install_resource(self, resource):
+        self.installed.add(resource)
+        self.installs += 1
+
+    def _release_resource(self, resource):
+        self.installed.discard(resource)
+        self.releases += 1
+
+
+class _Pinger(object):
+    """Pinger for a network where the gateway always answers."""
+
+    def probe(self):
+        pass
+
+    def reachable(self):
+        return True
+
+
+class SimulatedCluster(object):
+    """A cluster of C{size} nodes on a simulated clock and network.
+
+    The gossipers choose whom to gossip with using the L{random}
+    module, which is seeded with C{seed} when the cluster starts.
+
+    @param resources: number of addresses to add to the cluster.
+    @param options: passed on to every L{FechterProtocol}.
+    """
+
+    def __init__(self, size=3, resources=30, seed=0, latency=0.001,
+            loss=0.0, gossip_interval=0.25, adaptive=True, step=0.05,
+            **options):
+        self.size = size
+        self.seed = seed
+        self.step = step
+        self.clock = task.Clock()
+        self.network = SimulatedNetwork(self.clock, latency, loss, seed)
+        self.resources = set('eth0:10.1.%d.%d' % (n // 256, n % 256)
+                             for n in range(resources))
+        self.protocols = []
+        self._gossip_interval = gossip_interval
+        self._adaptive = adaptive
+        self._options = options
+
+    def start(self, settle=20):
+        """Start all nodes, add the resources and let the cluster
+        settle for C{settle} seconds.
+        """
+        random.seed(self.seed)
+        for n in range(self.size):
+            name = '10.0.%d.%d:4573' % ((n + 1) // 256, (n + 1) % 256)
+            protocol = FechterProtocol(self.clock, {},
+                SimulatedPlatform(self.clock), _Pinger(), **self._options)
+            gossiper = DetectingGossiper(self.clock, protocol,
+                name.split(':')[0], adaptive=self._adaptive,
+                interval=self._gossip_interval)
+            self.network.connect(name, gossiper)
+            gossiper.startProtocol()
+            gossiper.set(protocol.election.PRIO_KEY, 0)
+            self.protocols.append(protocol)
+        for gossiper in self.network.nodes.values():
+            gossiper.seed(list(self.network.nodes))
+        for protocol in self.protocols:
+            protocol.set_status('up')
+        self.advance(settle)
+        for resource in sorted(self.resources):
+            self.protocols[0].add_resource(resource)
+        self.advance(settle)
+
+    def advance(self, seconds):
+        """Let C{seconds} of simulated time pass."""
+        for i in range(int(round(seconds / self.step))):
+            self.clock.advance(self.step)
+
+    def alive(self):
+        """Return the protocols of the nodes that are not down."""
+        return [protocol for protocol in self.protocols
+                if protocol.gossiper.name not in self.network.down]
+
+    def leader(self, protocols=None):
+        """Return the leader among C{protocols}, or C{None} if there is
+        not exactly one.
+        """
+        if protocols is None:
+            protocols = self.alive()
+        leaders = [protocol for protocol in protocols
+                   if protocol.election.is_leader]
+        return leaders[0] if len(leaders) == 1 else None
+
+    def kill(self, protocol):
+        """Stop the node of C{protocol} and take it off the network.
+
+        Addresses it held stay in its platform, but it is left out of
+        L{converged} and L{stats}.
+        """
+        self.network.down.add(protocol.gossiper.name)
+        protocol.gossiper.stopProtocol()
+        protocol.stop()
+
+    def converged(self, protocols=None, elected=True):
+        """Return true if every resource is installed on exactly one
+        of C{protocols} and, if C{elected} is true, one of them is the
+        leader.
+
+        @param protocols: the nodes to look at; by default all nodes
+            that are not down.
+        """
+        if protocols is None:
+            protocols = self.alive()
+        if elected and self.leader(protocols) is None:
+            return False
+        installed = []
+        for protocol in protocols:
+            installed.extend(protocol.platform.installed)
+        return (len(installed) == len(self.resources)
+                and set(installed) == self.resources)
+
+    def stats(self):
+        """Return the totals of the counters that L{measure}
+        reports, over the nodes that are not down.
+        """
+        protocols = self.alive()
+        return {'moves': sum(protocol.platform.installs
+                             for protocol in protocols),
+                'releases': sum(protocol.platform.releases
+                                for protocol in protocols),
+                'bytes': self.network.bytes_sent,
+                'packets': self.network.packets_sent}
+
+    def measure(self, protocols=None, elected=True, limit=60):
+        """Run until the cluster has converged.
+
+        @param protocols: see L{converged}.
+        @return: a C{dict} with the simulated seconds it took
+            (C{time}) and the seconds until every resource was
+            installed on exactly one node (C{available}), either being
+            C{None} if it did not happen within C{limit} seconds.  It
+            also holds the number of resources installed (C{moves})
+            and released, and the gossip bytes and packets sent
+            meanwhile.
+        """
+        before = self.stats()
+        start = self.clock.seconds()
+        elapsed = 0
+        available = None
+        while True:
+            if available is None and self.converged(protocols, False):
+                available = elapsed
+            if self.converged(protocols, elected):
+                break
+            if elapsed >= limit:
+                elapsed = None
+                break
+            self.clock.advance(self.step)
+            elapsed = self.clock.seconds() - start
+        result = dict((key, value - before[key])
+                      for (key, value) in self.stats().items())
+        result['time'] = elapsed
+        result['available'] = available
+        return result
@@ -0,0 +1,179 @@
+# Copyright 2011 Johan Rydberg
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Persistent storage for the keystore.
+
+A storage is a C{dict}-like object with C{sync} and C{close}
+methods.  It is what L{KeyStoreMixin} persists our own key-value
+pairs to, and what the keystore is loaded from at startup.
+"""
+
+import json
+import os
+import shelve
+
+from twisted.python import log
+
+
+class LogStorage(object):
+    """Storage backed by an append-only log.
+
+    The whole mapping is kept in memory.  Every change appends one
+    JSON encoded record to the log, so a write costs the same
+    regardless of the size of the store.  Records are written to the
+    file on L{sync}, but C{fsync} is issued at most once every
+    C{fsync_interval} seconds.  When the log holds more than
+    C{compact_ratio} times as many records as there are live keys it
+    is rewritten.
+
+    @param clock: used to schedule delayed C{fsync}s.  If C{None},
+        every L{sync} is followed by an C{fsync}.
+    """
+
+    def __init__(self, path, clock=None, fsync_interval=1.0,
+            compact_ratio=4, compact_min=1000):
+        self.path = path
+        self.clock = clock
+        self.fsync_interval = fsync_interval
+        self.compact_ratio = compact_ratio
+        self.compact_min = compact_min
+        self.fsyncs = 0
+        self.compactions = 0
+        self._data = {}
+        self._records = 0
+        self._pending = []
+        self._fsync_call = None
+        self._load()
+        self._file = open(self.path, 'ab')
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        offset = 0
+        with open(self.path, 'r+b') as fp:
+            while True:
+                line = fp.readline()
+                if not line:
+                    break
+                try:
+                    if not line.endswith('\n'):
+                        raise ValueError("incomplete record")
+                    record = json.loads(line)
+                except ValueError:
+                    # A partially written record at the end of the
+                    # log.  Cut it off so that new records are not
+                    # appended after it.
+                    log.msg('%s: dropping broken record' % (self.path,))
+                    fp.truncate(offset)
+                    break
+                offset += len(line)
+                key = str(record[0])
+                if len(record) == 2:
+                    self._data[key] = record[1]
+                else:
+                    self._data.pop(key, None)
+                self._records += 1
+
+    def __getitem__(self, key):
+        return self._data[key]
+
+    def __setitem__(self, key, value):
+        self._data[key] = value
+        self._append([key, value])
+
+    def __delitem__(self, key):
+        del self._data[key]
+        self._append([key])
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __iter__(self):
+        return iter(self._data.keys())
+
+    def __len__(self):
+        return len(self._data)
+
+    def keys(self):
+        return self._data.keys()
+
+    def get(self, key, default=None):
+        return self._data.get(key, default)
+
+    def _append(self, record):
+        self._pending.append(json.dumps(record) + '\n')
+        self._records += 1
+
+    def sync(self):
+        """Write pending records to the log."""
+        if self._pending:
+            self._file.write(''.join(self._pending))
+            self._pending = []
+            self._file.flush()
+            if self.clock is None:
+                self._fsync()
+            elif self._fsync_call is None:
+                self._fsync_call = self.clock.callLater(
+                    self.fsync_interval, self._fsync)
+        if (self._records > self.compact_min
+                and self._records > self.compact_ratio * len(self._data)):
+            self.compact()
+
+    def _fsync(self):
+        self._fsync_call = None
+        os.fsync(self._file.fileno())
+        self.fsyncs += 1
+
+    def compact(self):
+        """Rewrite the log so that it only holds live keys."""
+        self._file.write(''.join(self._pending))
+        self._pending = []
+        self._file.close()
+        if self._fsync_call is not None:
+            self._fsync_call.cancel()
+            self._fsync_call = None
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'wb') as fp:
+            for key, value in self._data.items():
+                fp.write(json.dumps([key, value]) + '\n')
+            fp.flush()
+            os.fsync(fp.fileno())
+        os.rename(tmp_path, self.path)
+        self._records = len(self._data)
+        self._file = open(self.path, 'ab')
+        self.compactions += 1
+
+    def close(self):
+        """Write pending records and close the log."""
+        self.sync()
+        if self._fsync_call is not None:
+            self._fsync_call.cancel()
+        self._fsync()
+        self._file.close()
+
+
+def open_storage(kind, path, clock=None):
+    """Open a storage.
+
+    @param kind: C{'log'} for a L{LogStorage}, or C{'shelve'} for a
+        L{shelve} database.
+    @param path: the file to store data in.
+    """
+    if kind == 'log':
+        return LogStorage(path, clock=clock)
+    elif kind == 'shelve':
+        # The keystore always assigns whole values, so there is no
+        # need for the writeback cache.
+        return shelve.open(path)
+    raise ValueError("%s: unknown storage" % (kind,))
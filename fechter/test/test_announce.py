@@ -0,0 +1,117 @@
+# Copyright 2011 Johan Rydberg
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import socket
+import struct
+
+from twisted.internet import task
+from twisted.trial import unittest
+
+from fechter.announce import Announcer, arp_frame, na_frame, ETH_TYPE_ARP
+
+
+class _FakeSocket(object):
+
+    def __init__(self, ifname):
+        self.ifname = ifname
+        self.sent = []
+
+    def getsockname(self):
+        return (self.ifname, ETH_TYPE_ARP, 0, 1, '\x02\0\0\0\0\x01')
+
+    def send(self, frame):
+        self.sent.append(frame)
+
+
+class _TestAnnouncer(Announcer):
+
+    def __init__(self, clock, schedule):
+        Announcer.__init__(self, clock, schedule)
+        self.opened = {}
+
+    def _open_socket(self, ifname):
+        self.opened[ifname] = _FakeSocket(ifname)
+        return self.opened[ifname]
+
+
+class AnnouncerTestCase(unittest.TestCase):
+    """Test cases for C{Announcer}."""
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.announcer = _TestAnnouncer(self.clock, (0, 1, 2, 4))
+
+    def test_arp_frame(self):
+        frame = arp_frame('\x02\0\0\0\0\x01', '10.0.0.1')
+        self.assertEquals(len(frame), 14 + 28)
+        self.assertEquals(frame[:6], '\xff' * 6)
+        self.assertEquals(frame[28:32], socket.inet_aton('10.0.0.1'))
+
+    def test_na_frame(self):
+        frame = na_frame('\x02\0\0\0\0\x01', '2001:db8::10')
+        self.assertEquals(frame[:6], '\x33\x33\0\0\0\x01')
+        ip_header, icmp = frame[14:54], frame[54:]
+        self.assertEquals(ord(icmp[0]), 136)
+        self.assertEquals(icmp[8:24],
+            socket.inet_pton(socket.AF_INET6, '2001:db8::10'))
+        # The checksum over the pseudo header and the message adds up
+        # to all ones.
+        data = (ip_header[8:40] + struct.pack('!I3xB', len(icmp), 58)
+                + icmp)
+        total = sum(struct.unpack('!%dH' % (len(data) / 2,), data))
+        while total >> 16:
+            total = (total & 0xffff) + (total >> 16)
+        self.assertEquals(total, 0xffff)
+
+    def test_ipv4_and_ipv6_addresses_share_bursts(self):
+        self.announcer.announce('eth0', '10.0.0.1')
+        self.announcer.announce('eth0', '2001:db8::10')
+        self.assertEquals(len(self.clock.getDelayedCalls()), 1)
+        self.clock.advance(0)
+        sent = self.announcer.opened['eth0'].sent
+        self.assertEquals(sorted(len(frame) for frame in sent), [42, 86])
+        self.assertEquals(len(self.clock.getDelayedCalls()), 3)
+
+    def test_addresses_are_sent_in_bursts_on_schedule(self):
+        for i in range(100):
+            self.announcer.announce('eth0', '10.0.0.%d' % (i,))
+        self.assertEquals(len(self.clock.getDelayedCalls()), 1)
+        self.clock.advance(0)
+        self.assertEquals(self.announcer.frames_sent, 100)
+        self.clock.advance(4)
+        self.assertEquals(self.announcer.frames_sent, 400)
+        self.assertEquals(self.announcer.opened.keys(), ['eth0'])
+
+    def test_staggered_addresses_get_their_own_schedule(self):
+        sent = []
+        def record(frame):
+            sent.append((self.clock.seconds(), len(frame)))
+        self.announcer.announce('eth0', '10.0.0.1')
+        self.clock.advance(0)
+        self.announcer.opened['eth0'].send = record
+        for i in range(15):
+            self.clock.advance(0.25)
+        self.announcer.announce('eth0', '2001:db8::10')
+        self.clock.advance(0)
+        for i in range(20):
+            self.clock.advance(0.25)
+        self.assertEquals(sent, [(1, 42), (2, 42), (3.75, 86), (4, 42),
+            (4.75, 86), (5.75, 86), (7.75, 86)])
+
+    def test_cancelled_addresses_are_not_repeated(self):
+        self.announcer.announce('eth0', '10.0.0.1')
+        self.clock.advance(0)
+        self.announcer.cancel('eth0', '10.0.0.1')
+        self.clock.advance(4)
+        self.assertEquals(self.announcer.frames_sent, 1)
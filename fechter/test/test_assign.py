@@ -12,11 +12,15 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from mockito import mock, when, verify, verifyNoMoreInteractions
+import json
+
+from mockito import mock, when, verify, verifyNoMoreInteractions, any
 
 from twisted.trial import unittest
 
-from fechter.assign import AssignmentComputer, _calculate_assignment
+from fechter.assign import (AssignmentComputer, LeastLoadedStrategy,
+    RendezvousStrategy, _calculate_assignment, utilization)
+from fechter.index import ResourceIndex, pack_assignments
 
 
 class CalculateAssignmentTestCase(unittest.TestCase):
@@ -103,9 +107,27 @@ class AssignmentComputerTestCase(unittest.TestCase):
 
     def test_update_assignments_deletes_old_assignemnts(self):
         when(self.keystore).keys('assign:*').thenReturn(['assign:A'])
+        when(self.keystore).get('assign:A').thenReturn('a')
         self.computer.update_assignments({'B': 'b'})
         verify(self.keystore).set('assign:A', None)
 
+    def test_update_assignments_does_not_delete_deleted_assignments(self):
+        when(self.keystore).keys('assign:*').thenReturn(['assign:A'])
+        when(self.keystore).get('assign:A').thenReturn(None)
+        self.assertEquals(self.computer.update_assignments({'B': 'b'}), 1)
+        verify(self.keystore, times=0).set('assign:A', any())
+
+    def test_update_assignments_only_writes_changed_assignments(self):
+        when(self.keystore).keys('assign:*').thenReturn(['assign:A',
+                                                         'assign:B'])
+        when(self.keystore).get('assign:A').thenReturn('a')
+        when(self.keystore).get('assign:B').thenReturn('a')
+        self.assertEquals(self.computer.update_assignments(
+                {'A': 'a', 'B': 'b'}), 1)
+        verify(self.keystore, times=0).set('assign:A', any())
+        verify(self.keystore).set('assign:B', 'b')
+        self.assertEquals(self.computer.writes, 1)
+
     def test_update_assignments_creates_new_assigment(self):
         when(self.keystore).keys('assign:*').thenReturn([])
         self.computer.update_assignments({'B': 'b'})
@@ -132,3 +154,332 @@ class AssignmentComputerTestCase(unittest.TestCase):
             (0, 'please-assign', 'address'))
         self.computer.assign_resources(['b'])
         verify(self.keystore).set('assign:A', 'b')
+
+    def test_compute_assignments_spreads_evenly(self):
+        peers = ['a', 'b', 'c']
+        assignments = self.computer.compute_assignments(
+            [str(i) for i in range(10)], {'X': 'a'}, peers)
+        counts = [len([p for p in assignments.values() if p == peer])
+                  for peer in peers]
+        self.assertEquals(counts, [4, 4, 3])
+
+    def test_compute_assignments_breaks_ties_in_peer_order(self):
+        assignments = self.computer.compute_assignments(
+            ['A', 'B', 'C', 'D'], {}, ['c', 'a', 'b'])
+        self.assertEquals(assignments, {'A': 'c', 'B': 'a', 'C': 'b',
+                                        'D': 'c'})
+
+
+class IncrementalAssignmentTestCase(unittest.TestCase):
+    """Test cases for incremental mode of C{AssignmentComputer}."""
+
+    def setUp(self):
+        self.keystore = mock()
+        self.computer = AssignmentComputer(self.keystore, incremental=True)
+        self.resources = ['A', 'B', 'C', 'D']
+        when(self.keystore).keys('resource:*').thenReturn(
+            ['resource:%s' % (r,) for r in self.resources])
+        for i, r in enumerate(self.resources):
+            when(self.keystore).get('resource:%s' % (r,)).thenReturn(
+                (i, 'please-assign', 'address'))
+        when(self.keystore).keys('assign:*').thenReturn(
+            ['assign:%s' % (r,) for r in self.resources])
+
+    def _assign(self, assignments):
+        for resource_id, peer in assignments.items():
+            when(self.keystore).get('assign:%s' % (
+                    resource_id,)).thenReturn(peer)
+
+    def test_keeps_assignments_when_peers_are_balanced(self):
+        self._assign({'A': 'a', 'B': 'a', 'C': 'b', 'D': 'b'})
+        self.assertEquals(self.computer.assign_resources(['a', 'b']), 0)
+        verify(self.keystore, times=0).set(any(), any())
+
+    def test_only_moves_resources_of_dead_peers(self):
+        self._assign({'A': 'a', 'B': 'b', 'C': 'c', 'D': 'a'})
+        self.assertEquals(self.computer.assign_resources(['a', 'c']), 1)
+        verify(self.keystore).set('assign:B', 'c')
+        self.assertEquals(self.computer.last_writes, 1)
+
+    def test_moves_fewest_resources_to_a_new_peer(self):
+        self._assign({'A': 'a', 'B': 'b', 'C': 'a', 'D': 'b'})
+        self.assertEquals(self.computer.assign_resources(
+                ['a', 'b', 'c']), 1)
+        verify(self.keystore).set('assign:C', 'c')
+
+    def test_respects_max_imbalance(self):
+        self.computer.strategy.max_imbalance = 2
+        self._assign({'A': 'a', 'B': 'a', 'C': 'b', 'D': 'b'})
+        self.assertEquals(self.computer.assign_resources(
+                ['a', 'b', 'c']), 0)
+
+    def test_claims_on_resources_of_dead_peers_are_kept(self):
+        self._assign({'A': 'a', 'B': 'b', 'C': 'c', 'D': 'a'})
+        self.computer.assign_resources(['a', 'c'], claims={'B': 'a'})
+        verify(self.keystore).set('assign:B', 'a')
+
+    def test_claims_on_assigned_resources_are_ignored(self):
+        self._assign({'A': 'a', 'B': 'b', 'C': 'a', 'D': 'b'})
+        self.assertEquals(self.computer.assign_resources(['a', 'b'],
+                claims={'C': 'b'}), 0)
+
+
+class _IndexedKeyStore(object):
+    """Keystore that feeds every write into an index."""
+
+    def __init__(self, index):
+        self.index = index
+        self.writes = {}
+
+    def set(self, key, value):
+        self.writes[key] = value
+        self.index.update(key, value)
+
+
+class PackedAssignmentTestCase(unittest.TestCase):
+    """Test cases for C{AssignmentComputer} with a packed assignment
+    map.
+    """
+
+    def setUp(self):
+        self.keystore = mock()
+        self.index = ResourceIndex()
+        for i, r in enumerate(['A', 'B', 'C', 'D']):
+            self.index.update('resource:%s' % (r,),
+                [i, 'please-assign', 'address'])
+        self.assignments = {'A': 'a', 'B': 'b', 'C': 'a', 'D': 'b'}
+
+    def test_writes_one_key(self):
+        computer = AssignmentComputer(self.keystore, index=self.index,
+            packed=True)
+        computer.assign_resources(['a', 'b'])
+        verify(self.keystore).set('assign-map',
+            pack_assignments(self.assignments, (0, 1)))
+        verifyNoMoreInteractions(self.keystore)
+        self.assertEquals(computer.last_writes, 1)
+
+    def test_new_epoch_is_published(self):
+        self.index.update('assign-map', pack_assignments(self.assignments,
+                (3, 7)))
+        computer = AssignmentComputer(self.keystore, index=self.index,
+            packed=True)
+        computer.start_epoch()
+        self.assertEquals(computer.assign_resources(['a', 'b']), 0)
+        verify(self.keystore).set('assign-map',
+            pack_assignments(self.assignments, (4, 0)))
+
+    def test_outdated_snapshot_is_replaced(self):
+        self.index.update('assign-map', pack_assignments(self.assignments,
+                (3, 7)))
+        self.index.update('assign-map', pack_assignments({'A': 'b'},
+                (2, 9)))
+        computer = AssignmentComputer(self.keystore, index=self.index,
+            packed=True)
+        self.assertEquals(computer.assign_resources(['a', 'b']), 0)
+        verify(self.keystore).set('assign-map',
+            pack_assignments(self.assignments, (3, 8)))
+
+    def test_map_at_the_size_limit_is_packed(self):
+        size = len(json.dumps(pack_assignments(self.assignments)))
+        computer = AssignmentComputer(self.keystore, index=self.index,
+            packed=True, max_packed_size=size)
+        computer.assign_resources(['a', 'b'])
+        verify(self.keystore).set('assign-map',
+            pack_assignments(self.assignments, (0, 1)))
+
+    def test_map_over_the_size_limit_is_not_packed(self):
+        size = len(json.dumps(pack_assignments(self.assignments)))
+        keystore = _IndexedKeyStore(self.index)
+        computer = AssignmentComputer(keystore, index=self.index,
+            packed=True, max_packed_size=size - 1)
+        computer.start_epoch()
+        computer.assign_resources(['a', 'b'])
+        self.assertEquals(keystore.writes, dict(
+                ('assign:%s' % (resource_id,), peer)
+                for (resource_id, peer) in self.assignments.items()))
+        # Nothing is pending once the keys are written.
+        keystore.writes.clear()
+        computer.assign_resources(['a', 'b'])
+        self.assertEquals(keystore.writes, {})
+
+    def _add_resources(self, index, count):
+        for i in range(count):
+            index.update('resource:%012d' % (i,),
+                [i, 'please-assign', 'address'])
+
+    def test_thousands_of_resources_use_assign_keys(self):
+        index = ResourceIndex()
+        keystore = _IndexedKeyStore(index)
+        computer = AssignmentComputer(keystore, index=index, packed=True)
+        self._add_resources(index, 1000)
+        computer.assign_resources(['10.0.0.1:4573', '10.0.0.2:4573',
+                                   '10.0.0.3:4573'])
+        self.assertEquals(keystore.writes.keys(), ['assign-map'])
+        self.assertTrue(len(json.dumps(keystore.writes['assign-map']))
+                        <= AssignmentComputer.MAX_PACKED_SIZE)
+        # The map would no longer fit in a datagram.
+        self._add_resources(index, 5000)
+        computer.assign_resources(['10.0.0.1:4573', '10.0.0.2:4573',
+                                   '10.0.0.3:4573'])
+        self.assertEquals(keystore.writes['assign-map'], None)
+        self.assertEquals(len(index.keyed_assignments()), 5000)
+        self.assertEquals(len(index.assignments()), 5000)
+
+    def test_clears_assign_keys(self):
+        for resource_id, peer in self.assignments.items():
+            self.index.update('assign:%s' % (resource_id,), peer)
+        computer = AssignmentComputer(self.keystore, index=self.index,
+            packed=True)
+        self.assertEquals(computer.assign_resources(['a', 'b']), 0)
+        verify(self.keystore).set('assign-map',
+            pack_assignments(self.assignments, (0, 1)))
+        for resource_id in self.assignments:
+            verify(self.keystore).set('assign:%s' % (resource_id,), None)
+
+    def test_per_key_mode_clears_the_map(self):
+        self.index.update('assign-map', pack_assignments(self.assignments))
+        computer = AssignmentComputer(self.keystore, index=self.index)
+        self.assertEquals(computer.assign_resources(['a', 'b']), 0)
+        for resource_id, peer in self.assignments.items():
+            verify(self.keystore).set('assign:%s' % (resource_id,), peer)
+        verify(self.keystore).set('assign-map', None)
+
+
+class WeightedLeastLoadedTestCase(unittest.TestCase):
+    """Test cases for weights and costs in C{LeastLoadedStrategy}."""
+
+    def setUp(self):
+        self.strategy = LeastLoadedStrategy()
+        self.resources = [str(i) for i in range(90)]
+
+    def _counts(self, assignments, peers):
+        return [len([p for p in assignments.values() if p == peer])
+                for peer in peers]
+
+    def test_load_follows_weights(self):
+        assignments = self.strategy.compute(self.resources, {}, ['a', 'b'],
+            {'a': 1, 'b': 8})
+        self.assertEquals(self._counts(assignments, ['a', 'b']), [10, 80])
+
+    def test_costs_count_towards_load(self):
+        costs = dict((resource_id, 4) for resource_id in self.resources[:10])
+        assignments = self.strategy.compute(self.resources[:20], {},
+            ['a', 'b'], None, costs)
+        load = utilization(assignments, ['a', 'b'], None, costs)
+        self.assertEquals(sorted(l for (l, u) in load.values()), [25, 25])
+
+    def test_rebalance_moves_to_larger_peer(self):
+        current = dict((resource_id, 'a') for resource_id in self.resources)
+        assignments = self.strategy.compute(self.resources, current,
+            ['a', 'b'], {'a': 1, 'b': 2})
+        self.assertEquals(self._counts(assignments, ['a', 'b']), [30, 60])
+        # The oldest resources stay where they are.
+        self.assertEquals(assignments['0'], 'a')
+
+    def test_weights_that_are_not_positive_numbers_are_ignored(self):
+        peers = ['a', 'b', 'c', 'd']
+        weights = {'a': 0, 'b': -2, 'c': 'heavy', 'd': None}
+        assignments = self.strategy.compute(self.resources, {}, peers,
+            weights)
+        self.assertEquals(self._counts(assignments, peers),
+            [23, 23, 22, 22])
+        load = utilization(assignments, peers, weights)
+        self.assertEquals(load['a'], (23, 23.0))
+
+
+class SpreadTestCase(unittest.TestCase):
+    """Test cases for resource groups."""
+
+    def setUp(self):
+        self.peers = ['a', 'b', 'c']
+        self.resources = [str(i) for i in range(12)]
+
+    def _per_peer(self, assignments, groups, group):
+        counts = dict((peer, 0) for peer in self.peers)
+        for resource_id, g in groups.items():
+            if g == group:
+                counts[assignments[resource_id]] += 1
+        return counts
+
+    def test_least_loaded_separates_small_groups(self):
+        # Without the group, '0' and '3' would both go to 'a'.
+        groups = {'0': 'web', '3': 'web', '6': 'web'}
+        assignments = LeastLoadedStrategy().compute(self.resources, {},
+            self.peers, groups=groups)
+        self.assertEquals(self._per_peer(assignments, groups, 'web'),
+            {'a': 1, 'b': 1, 'c': 1})
+        counts = self._per_peer(assignments,
+            dict((r, 'all') for r in self.resources), 'all')
+        self.assertEquals(sorted(counts.values()), [4, 4, 4])
+
+    def test_least_loaded_spreads_large_groups(self):
+        groups = dict((resource_id, 'web')
+                      for resource_id in self.resources[:7])
+        assignments = LeastLoadedStrategy().compute(self.resources, {},
+            self.peers, {'a': 10}, groups=groups)
+        counts = self._per_peer(assignments, groups, 'web')
+        self.assertTrue(max(counts.values()) <= 3)
+
+    def test_incremental_fixes_broken_spread(self):
+        groups = {'0': 'web', '1': 'web'}
+        current = {'0': 'a', '1': 'a', '2': 'b', '3': 'c'}
+        assignments = LeastLoadedStrategy().compute(self.resources[:4],
+            current, self.peers, groups=groups)
+        self.assertEquals(assignments['0'], 'a')
+        self.assertNotEquals(assignments['1'], 'a')
+
+    def test_rebalance_keeps_spread(self):
+        groups = {'0': 'web', '1': 'web'}
+        current = {'0': 'a', '1': 'b', '2': 'b', '3': 'b'}
+        assignments = LeastLoadedStrategy().compute(self.resources[:4],
+            current, ['a', 'b'], groups=groups)
+        self.assertNotEquals(assignments['0'], assignments['1'])
+        self.assertEquals(sorted(assignments.values()), ['a', 'a', 'b', 'b'])
+
+    def test_rendezvous_separates_groups(self):
+        resources = [str(i) for i in range(200)]
+        groups = dict((resource_id, 'g%d' % (int(resource_id) // 3,))
+                      for resource_id in resources)
+        assignments = RendezvousStrategy().compute(resources, {},
+            self.peers, groups=groups)
+        for group in set(groups.values()):
+            members = [assignments[r] for r in resources if groups[r] == group]
+            self.assertEquals(len(set(members)), len(members))
+
+
+class RendezvousStrategyTestCase(unittest.TestCase):
+    """Test cases for C{RendezvousStrategy}."""
+
+    def setUp(self):
+        self.strategy = RendezvousStrategy()
+        self.resources = [str(i) for i in range(200)]
+
+    def test_weights_that_are_not_positive_numbers_are_ignored(self):
+        self.assertEquals(
+            self.strategy.compute(self.resources, {}, ['a', 'b', 'c'],
+                {'a': 0, 'b': 'heavy'}),
+            self.strategy.compute(self.resources, {}, ['a', 'b', 'c']))
+
+    def test_assignment_does_not_depend_on_peer_order(self):
+        self.assertEquals(
+            self.strategy.compute(self.resources, {}, ['a', 'b', 'c']),
+            self.strategy.compute(self.resources, {}, ['c', 'a', 'b']))
+
+    def test_only_resources_of_removed_peer_moves(self):
+        before = self.strategy.compute(self.resources, {}, ['a', 'b', 'c'])
+        after = self.strategy.compute(self.resources, {}, ['a', 'c'])
+        for resource_id in self.resources:
+            if before[resource_id] != 'b':
+                self.assertEquals(before[resource_id], after[resource_id])
+
+    def test_weight_attracts_resources(self):
+        self.strategy.weights['a'] = 3
+        assignments = self.strategy.compute(self.resources, {}, ['a', 'b'])
+        count = len([p for p in assignments.values() if p == 'a'])
+        self.assertTrue(count > 120)
+
+    def test_given_weights_are_used(self):
+        assignments = self.strategy.compute(self.resources, {}, ['a', 'b'],
+            {'a': 3})
+        count = len([p for p in assignments.values() if p == 'a'])
+        self.assertTrue(count > 120)
@@ -0,0 +1,60 @@
+# Copyright 2011 Johan Rydberg
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from mockito import mock, when, verify, any
+
+from twisted.internet import task
+from twisted.trial import unittest
+
+from fechter.compaction import TombstoneCollector
+
+
+class TombstoneCollectorTestCase(unittest.TestCase):
+    """Test cases for C{TombstoneCollector}."""
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.clock.advance(100)
+        self.keystore = mock()
+        self.peer = {}
+        when(self.keystore).live_peers().thenReturn([self.peer])
+        self.collector = TombstoneCollector(self.clock, self.keystore,
+            max_age=60)
+
+    def test_collects_tombstones_acknowledged_by_all_peers(self):
+        self.collector.update('resource:A', [100, None])
+        self.peer['resource:A'] = [100, None]
+        self.assertEquals(self.collector.collect(), 1)
+        verify(self.keystore).forget('resource:A')
+        verify(self.keystore).sync()
+        self.assertEquals(self.collector.stats()['pending'], 0)
+        self.assertTrue(self.collector.stats()['reclaimed'] > 0)
+
+    def test_keeps_tombstones_not_acknowledged_by_all_peers(self):
+        self.collector.update('resource:A', [100, None])
+        self.peer['resource:A'] = [90, [90, 'please-assign', 'eth0:a']]
+        self.assertEquals(self.collector.collect(), 0)
+        verify(self.keystore, times=0).forget(any())
+
+    def test_collects_old_tombstones(self):
+        self.collector.update('resource:A', [100, None])
+        self.clock.advance(60)
+        self.assertEquals(self.collector.collect(), 1)
+        verify(self.keystore).forget('resource:A')
+
+    def test_ignores_live_values(self):
+        self.collector.update('assign:A', [100, None])
+        self.collector.update('assign:A', [101, 'a'])
+        self.clock.advance(60)
+        self.assertEquals(self.collector.collect(), 0)
@@ -0,0 +1,89 @@
+# Copyright 2011 Johan Rydberg
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import random
+
+from twisted.internet import task
+from twisted.trial import unittest
+from mockito import mock
+
+from txgossip.detector import FailureDetector
+
+from fechter.detector import DetectingPeerState, NormalFailureDetector
+
+
+class NormalFailureDetectorTestCase(unittest.TestCase):
+    """Test cases for C{NormalFailureDetector}."""
+
+    def test_phi_grows_with_silence(self):
+        detector = NormalFailureDetector()
+        for i in range(10):
+            detector.add(float(i))
+        self.assertTrue(detector.phi(9.5) < 1)
+        self.assertTrue(detector.phi(10.75) > 8)
+
+    def test_jitter_delays_detection(self):
+        rng = random.Random(1)
+        quiet, busy = NormalFailureDetector(), NormalFailureDetector()
+        now = 0.0
+        for i in range(100):
+            quiet.add(float(i))
+            now += rng.uniform(0.2, 1.8)
+            busy.add(now)
+        self.assertTrue(busy.phi(now + 1.5) < quiet.phi(99 + 1.5))
+
+    def test_acceptable_pause_delays_detection(self):
+        detector = NormalFailureDetector(acceptable_pause=1)
+        for i in range(10):
+            detector.add(float(i))
+        self.assertTrue(detector.phi(10.75) < 1)
+
+    def test_window_is_bounded(self):
+        detector = NormalFailureDetector(window=10)
+        for i in range(100):
+            detector.add(i * 2.0)
+        for i in range(11):
+            detector.add(200.0 + i)
+        self.assertAlmostEqual(detector.interval_mean(), 1.0)
+
+
+class DetectingPeerStateTestCase(unittest.TestCase):
+    """Test cases for C{DetectingPeerState}."""
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.participant = mock()
+
+    def _peer(self, detector):
+        peer = DetectingPeerState(self.clock, self.participant,
+            name='10.0.0.2:4573', detector=detector)
+        for i in range(10):
+            peer.detector.add(self.clock.seconds())
+            peer.check_suspected()
+            self.clock.advance(1)
+        return peer
+
+    def test_failover_under_two_seconds(self):
+        peer = self._peer(NormalFailureDetector())
+        self.assertTrue(peer.alive)
+        self.assertTrue(peer.expected_detection() < 2)
+        while not peer.check_suspected():
+            self.clock.advance(0.25)
+        self.assertEquals(peer.detections, 1)
+        self.assertTrue(peer.detection_latency < 2)
+
+    def test_expected_detection_of_txgossip_detector(self):
+        peer = self._peer(FailureDetector())
+        # phi = t / (mean * ln 10) for exponential intervals.
+        self.assertTrue(17 < peer.expected_detection() < 19)
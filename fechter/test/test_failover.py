@@ -0,0 +1,69 @@
+# Copyright 2011 Johan Rydberg
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import random
+
+from twisted.trial import unittest
+
+from fechter.simulator import SimulatedCluster
+
+
+class LeaderFailoverTestCase(unittest.TestCase):
+    """Measure how long it takes for the cluster to recover from the
+    loss of its leader.
+    """
+
+    def setUp(self):
+        # The cluster seeds the random module.
+        self.addCleanup(random.setstate, random.getstate())
+
+    def _start_cluster(self, **options):
+        self.cluster = SimulatedCluster(**options)
+        self.cluster.start()
+
+    def _kill_leader(self, elected=True):
+        """Take the leader off the network and return the number of
+        seconds until the rest of the cluster has converged.
+        """
+        self.assertTrue(self.cluster.converged())
+        self.cluster.kill(self.cluster.leader())
+        result = self.cluster.measure(elected=elected)
+        self.assertNotEquals(result['time'], None)
+        return result['time']
+
+    def test_converges_after_leader_loss(self):
+        self._start_cluster(vote_delay=0.5)
+        # About 1.3 seconds to detect the failure, the vote delay and
+        # a few gossip rounds to agree on a leader and to spread the
+        # assignments.
+        self.assertTrue(self._kill_leader() < 3)
+
+    def test_vote_delay_adds_to_convergence(self):
+        self._start_cluster(vote_delay=0.5)
+        fast = self._kill_leader()
+        self._start_cluster(vote_delay=2)
+        slow = self._kill_leader()
+        self.assertTrue(slow - fast >= 1)
+
+    def test_fast_takeover_does_not_wait_for_election(self):
+        self._start_cluster(vote_delay=2, fast_takeover=True)
+        # Only detection stands between the failure and the takeover.
+        self.assertTrue(self._kill_leader(elected=False) < 2)
+        survivors = self.cluster.alive()
+        self.assertTrue(sum(protocol.claimed for protocol in survivors) > 0)
+        self.cluster.advance(10)
+        # The new leader has settled the claims.
+        self.assertTrue(self.cluster.converged())
+        for protocol in survivors:
+            self.assertEquals(protocol.collect_claims(), {})
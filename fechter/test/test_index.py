@@ -0,0 +1,126 @@
+# Copyright 2011 Johan Rydberg
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from twisted.trial import unittest
+
+from fechter.index import (ResourceIndex, pack_assignments, resource_cost,
+    resource_group, unpack_assignments)
+
+
+class ResourceIndexTestCase(unittest.TestCase):
+    """Test cases for C{ResourceIndex}."""
+
+    def setUp(self):
+        self.index = ResourceIndex()
+
+    def test_resources_are_ordered_by_timestamp(self):
+        self.index.update('resource:A', [2, 'please-assign', 'a'])
+        self.index.update('resource:B', [1, 'please-assign', 'b'])
+        self.index.update('resource:C', [3, 'please-assign', 'c'])
+        self.assertEquals(self.index.resources(), ['B', 'A', 'C'])
+
+    def test_deleted_resources_are_dropped(self):
+        self.index.update('resource:A', [2, 'please-assign', 'a'])
+        self.index.update('resource:B', [1, 'please-assign', 'b'])
+        self.index.update('resource:A', None)
+        self.assertEquals(self.index.resources(), ['B'])
+        self.assertEquals(self.index.resource('A'), None)
+
+    def test_resources_not_to_assign_are_not_listed(self):
+        self.index.update('resource:A', [1, 'please-assign', 'a'])
+        self.index.update('resource:A', [1, 'please-do-not-assign', 'a'])
+        self.assertEquals(self.index.resources(), [])
+        self.assertEquals(self.index.resource('A'),
+            (1, 'please-do-not-assign', 'a'))
+
+    def test_tracks_assignments(self):
+        self.index.update('assign:A', 'a')
+        self.index.update('assign:B', 'b')
+        self.index.update('assign:B', None)
+        self.assertEquals(self.index.assigned_to('A'), 'a')
+        self.assertEquals(self.index.assigned_to('B'), None)
+        self.assertEquals(self.index.assignments(), {'A': 'a'})
+
+    def test_returns_changed_assignments(self):
+        self.assertEquals(self.index.update('assign:A', 'a'), ['A'])
+        self.assertEquals(self.index.update('assign:A', 'a'), [])
+        self.assertEquals(self.index.update('resource:A',
+                [1, 'please-assign', 'a']), [])
+
+    def test_tracks_packed_assignments(self):
+        self.index.update('assign-map', pack_assignments(
+                {'A': 'a', 'B': 'b'}))
+        changed = self.index.update('assign-map', pack_assignments(
+                {'A': 'a', 'C': 'b'}))
+        self.assertEquals(sorted(changed), ['B', 'C'])
+        self.assertEquals(self.index.assignments(), {'A': 'a', 'C': 'b'})
+        self.index.update('assign-map', None)
+        self.assertEquals(self.index.assignments(), {})
+
+    def test_older_snapshots_are_ignored(self):
+        self.index.update('assign-map', pack_assignments({'A': 'a'},
+                (2, 0)))
+        self.assertEquals(self.index.update('assign-map',
+                pack_assignments({'A': 'b'}, (1, 5))), [])
+        self.assertTrue(self.index.outdated())
+        self.assertEquals(self.index.assigned_to('A'), 'a')
+        self.assertEquals(self.index.stamp(), (2, 0))
+        self.assertEquals(self.index.update('assign-map',
+                pack_assignments({'A': 'b'}, (2, 1))), ['A'])
+        self.assertFalse(self.index.outdated())
+
+    def test_assign_keys_go_before_the_map(self):
+        self.index.update('assign-map', pack_assignments({'A': 'a'}))
+        self.assertEquals(self.index.update('assign:A', 'b'), ['A'])
+        self.assertEquals(self.index.assigned_to('A'), 'b')
+        self.assertEquals(self.index.update('assign:A', None), ['A'])
+        self.assertEquals(self.index.assigned_to('A'), 'a')
+
+
+class PackAssignmentsTestCase(unittest.TestCase):
+    """Test cases for C{pack_assignments}."""
+
+    def test_peers_are_stored_once(self):
+        self.assertEquals(pack_assignments({'A': 'b', 'B': 'a', 'C': 'b'}),
+            {'epoch': 0, 'version': 0, 'peers': ['a', 'b'],
+             'map': {'A': 1, 'B': 0, 'C': 1}})
+
+    def test_round_trip(self):
+        assignments = {'A': '10.0.0.1:4573', 'B': '10.0.0.2:4573'}
+        self.assertEquals(unpack_assignments(pack_assignments(assignments)),
+            assignments)
+        self.assertEquals(unpack_assignments(None), {})
+
+
+class ResourceCostTestCase(unittest.TestCase):
+    """Test cases for C{resource_cost}."""
+
+    def test_resources_without_options_cost_one(self):
+        self.assertEquals(resource_cost([0, 'please-assign', 'eth0:a']), 1)
+
+    def test_cost_option(self):
+        self.assertEquals(resource_cost(
+                [0, 'please-assign', 'eth0:a', {'cost': 4}]), 4)
+
+
+class ResourceGroupTestCase(unittest.TestCase):
+    """Test cases for C{resource_group}."""
+
+    def test_resources_without_options_have_no_group(self):
+        self.assertEquals(resource_group([0, 'please-assign', 'eth0:a']),
+            None)
+
+    def test_group_option(self):
+        self.assertEquals(resource_group(
+                [0, 'please-assign', 'eth0:a', {'group': 'web'}]), 'web')
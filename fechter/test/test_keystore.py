@@ -0,0 +1,130 @@
+# Copyright 2011 Johan Rydberg
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from twisted.internet import defer, task
+from twisted.trial import unittest
+from mockito import mock, when, verify, any
+
+from txgossip.state import PeerState
+
+from fechter.keystore import FechterProtocol
+
+
+class _FakeGossiper(object):
+
+    def __init__(self, clock, name, peers):
+        self.name = name
+        self.state = PeerState(clock, None, name=name)
+        self.live_peers = peers
+
+    def get(self, key, default=None):
+        return self.state.get(key, default)
+
+
+class CollectPeersTestCase(unittest.TestCase):
+    """Test cases for C{FechterProtocol.collect_peers}."""
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.protocol = FechterProtocol(self.clock, {}, mock(), mock())
+        self.peers = []
+        for name in ['10.0.0.3:4573', '10.0.0.1:4573']:
+            self.peers.append(self._peer(name))
+        self.protocol.gossiper = _FakeGossiper(self.clock, '10.0.0.2:4573',
+            self.peers)
+        self._set(self.protocol.gossiper.state, FechterProtocol.STATUS, 'up')
+
+    def _peer(self, name, status='up'):
+        peer = PeerState(self.clock, None, name=name)
+        self._set(peer, FechterProtocol.STATUS, status)
+        return peer
+
+    def _set(self, peer, key, value):
+        peer.attrs[key] = (value, 1)
+
+    def test_peers_are_ordered_by_address(self):
+        self.assertEquals(self.protocol.collect_peers(),
+            ['10.0.0.1:4573', '10.0.0.2:4573', '10.0.0.3:4573'])
+
+    def test_rank_comes_before_address(self):
+        self._set(self.peers[0], FechterProtocol.RANK, -1)
+        self.assertEquals(self.protocol.collect_peers(),
+            ['10.0.0.3:4573', '10.0.0.1:4573', '10.0.0.2:4573'])
+
+    def test_peers_without_status_up_are_skipped(self):
+        self._set(self.peers[1], FechterProtocol.STATUS, 'down')
+        self.assertEquals(self.protocol.collect_peers(),
+            ['10.0.0.2:4573', '10.0.0.3:4573'])
+
+    def test_list_is_cached_until_membership_changes(self):
+        peers = self.protocol.collect_peers()
+        self.peers.append(self._peer('10.0.0.4:4573'))
+        self.assertTrue(self.protocol.collect_peers() is peers)
+        self.protocol.peer_alive(self.peers[-1])
+        self.assertEquals(self.protocol.collect_peers()[-1],
+            '10.0.0.4:4573')
+
+    def test_weights(self):
+        self._set(self.peers[0], FechterProtocol.WEIGHT, 2)
+        self.assertEquals(self.protocol.peer_weights(), {
+                '10.0.0.1:4573': 1, '10.0.0.2:4573': 1,
+                '10.0.0.3:4573': 2})
+
+
+class ShadowAssignmentTestCase(unittest.TestCase):
+    """Test cases for the shadow assignments of peers that are not
+    the leader.
+    """
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.platform = mock()
+        when(self.platform).reconcile(any()).thenReturn(
+            defer.succeed(None))
+        self.protocol = FechterProtocol(self.clock, {}, self.platform,
+            mock())
+        self.protocol.gossiper = _FakeGossiper(self.clock, '10.0.0.2:4573',
+            [])
+        self.protocol.computer = mock()
+        self.shadow = ({}, {'A': '10.0.0.2:4573'})
+        when(self.protocol.computer).compute(any(), any(), any()).thenReturn(
+            self.shadow)
+        self.protocol.election.is_leader = False
+        self.addCleanup(self.protocol._reconcile_loop.stop)
+
+    def test_new_leader_publishes_shadow(self):
+        self.protocol._rebalance()
+        self.protocol.election.is_leader = True
+        self.protocol.leader_elected(True)
+        verify(self.protocol.computer).publish(*self.shadow)
+        verify(self.protocol.computer, times=0).assign_resources(any(),
+            any(), any())
+
+    def test_shadow_is_dropped_when_peers_change(self):
+        self.protocol._rebalance()
+        self.protocol.peer_dead(PeerState(self.clock, None,
+            name='10.0.0.1:4573'))
+        self.protocol.election.is_leader = True
+        self.protocol.leader_elected(True)
+        verify(self.protocol.computer, times=0).publish(any(), any())
+        verify(self.protocol.computer).assign_resources(any(), any(), any())
+
+    def test_takeover_absorbs_pending_rebalance(self):
+        self.protocol._assignments_changed()
+        self.protocol.election.is_leader = True
+        self.protocol.leader_elected(True)
+        self.clock.advance(1)
+        verify(self.protocol.computer, times=1).assign_resources(any(),
+            any(), any())
+        self.assertEquals(self.protocol.rebalancer.stats()['runs'], 1)
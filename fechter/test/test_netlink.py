@@ -0,0 +1,150 @@
+# Copyright 2011 Johan Rydberg
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import errno
+import socket
+import struct
+
+from twisted.internet import task
+from twisted.trial import unittest
+
+from fechter import netlink
+from fechter.platform import NetlinkPlatform
+
+
+class _FakeNetlinkSocket(object):
+
+    def __init__(self):
+        self.batches = []
+        self.results = {}
+        self.addresses = []
+
+    def dump_addresses(self, family):
+        return self.addresses
+
+    def change_addresses(self, changes):
+        self.batches.append(changes)
+        return [self.results.get(change[3], 0) for change in changes]
+
+
+class _FakeKernelSocket(object):
+    """Acknowledges every request it is sent."""
+
+    def __init__(self):
+        self.acks = []
+
+    def sendto(self, data, address):
+        for msg_type, flags, seq, payload in netlink.parse_messages(data):
+            self.acks.append(struct.pack('=LHHLL', 20, netlink.NLMSG_ERROR,
+                0, seq, 0) + struct.pack('=i', 0))
+
+    def recv(self, size):
+        acks, self.acks = self.acks, []
+        return ''.join(acks)
+
+
+class _TestNetlinkSocket(netlink.NetlinkSocket):
+
+    def __init__(self):
+        self._socket = _FakeKernelSocket()
+        self._seq = 0
+        self._indexes = {'eth0': 2}
+
+
+class NetlinkMessageTestCase(unittest.TestCase):
+    """Test cases for packing and parsing of netlink messages."""
+
+    def test_pack_address_message(self):
+        message = netlink.pack_address_message(netlink.RTM_NEWADDR, 7,
+            socket.AF_INET, 32, 2, socket.inet_aton('10.0.0.1'))
+        self.assertEquals(len(message), 16 + 8 + 8 + 8)
+        length, msg_type, flags, seq, pid = struct.unpack('=LHHLL',
+            message[:16])
+        self.assertEquals(length, len(message))
+        self.assertEquals((msg_type, seq), (netlink.RTM_NEWADDR, 7))
+        self.assertTrue(flags & netlink.NLM_F_ACK)
+        self.assertTrue(flags & netlink.NLM_F_CREATE)
+
+    def test_parse_messages(self):
+        ack = struct.pack('=LHHLL', 20, netlink.NLMSG_ERROR, 0, 3, 0) \
+            + struct.pack('=i', -errno.EEXIST)
+        messages = netlink.parse_messages(ack + ack)
+        self.assertEquals(len(messages), 2)
+        self.assertEquals(messages[0][:3], (netlink.NLMSG_ERROR, 0, 3))
+
+    def test_parse_attrs(self):
+        message = netlink.pack_address_message(netlink.RTM_NEWADDR, 7,
+            socket.AF_INET, 32, 2, socket.inet_aton('10.0.0.1'))
+        attrs = netlink.parse_attrs(message[16 + 8:])
+        self.assertEquals(attrs, {
+                netlink.IFA_LOCAL: socket.inet_aton('10.0.0.1'),
+                netlink.IFA_ADDRESS: socket.inet_aton('10.0.0.1')})
+
+
+class NetlinkSocketTestCase(unittest.TestCase):
+    """Test cases for C{NetlinkSocket}."""
+
+    def test_malformed_address_only_fails_its_change(self):
+        results = _TestNetlinkSocket().change_addresses([
+                (True, 'eth0', socket.AF_INET, '10.0.0.1', 32),
+                (True, 'eth0', socket.AF_INET, '10.0.0.300', 32),
+                (True, 'eth0', socket.AF_INET6, '2001:db8::10', 128)])
+        self.assertEquals(results, [0, errno.EINVAL, 0])
+
+
+class NetlinkPlatformTestCase(unittest.TestCase):
+    """Test cases for C{NetlinkPlatform}."""
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.netlink = _FakeNetlinkSocket()
+        self.platform = NetlinkPlatform(self.clock,
+            netlink_socket=self.netlink)
+
+    def test_changes_are_sent_in_one_batch(self):
+        results = []
+        for i in range(3):
+            self.platform._add_address('eth0', '10.0.0.%d' % (i,)
+                ).addCallback(results.append)
+        self.platform._del_address('eth0', '10.0.1.1')
+        self.assertEquals(self.netlink.batches, [])
+        self.clock.advance(0)
+        self.assertEquals(len(self.netlink.batches), 1)
+        self.assertEquals(len(self.netlink.batches[0]), 4)
+        self.assertEquals(results, [None, None, None])
+
+    def test_errors_are_reported_per_address(self):
+        self.netlink.results['10.0.0.2'] = errno.ENODEV
+        self.netlink.results['10.0.0.3'] = errno.EEXIST
+        d1 = self.platform._add_address('eth0', '10.0.0.1')
+        d2 = self.platform._add_address('eth0', '10.0.0.2')
+        d3 = self.platform._add_address('eth0', '10.0.0.3')
+        self.clock.advance(0)
+        self.successResultOf(d1)
+        self.failureResultOf(d2, OSError)
+        self.successResultOf(d3)
+
+    def test_ipv6_addresses_are_host_addresses(self):
+        self.platform._add_address('eth0', '2001:db8::10')
+        self.clock.advance(0)
+        self.assertEquals(self.netlink.batches, [[
+                    (True, 'eth0', socket.AF_INET6, '2001:db8::10', 128)]])
+
+    def test_installed_resources_are_host_addresses(self):
+        self.netlink.addresses = [('eth0', '10.0.0.5', 24),
+                                  ('eth0', '10.0.0.6', 32),
+                                  ('eth0', '2001:db8::10', 128)]
+        self.assertEquals(
+            self.successResultOf(self.platform._installed_resources()),
+            set(['eth0:10.0.0.6', 'eth0:2001:db8::10']))
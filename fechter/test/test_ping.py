@@ -0,0 +1,180 @@
+# Copyright 2011 Johan Rydberg
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import errno
+import socket
+import struct
+
+from twisted.internet import task
+from twisted.trial import unittest
+
+from fechter.ping import Pinger, ECHOREPLY, _EchoTemplate, _pack_icmp
+from fechter.ping import _in_cksum, _valid_cksum
+
+
+class _Reactor(task.Clock):
+
+    def addReader(self, reader):
+        pass
+
+    def removeReader(self, reader):
+        pass
+
+
+class _FakeICMPSocket(object):
+
+    def __init__(self):
+        self.sent = []
+        self.replies = []
+
+    def setblocking(self, flag):
+        pass
+
+    def fileno(self):
+        return -1
+
+    def sendto(self, packet, address):
+        self.sent.append((packet, address))
+
+    def recvfrom(self, size):
+        if not self.replies:
+            raise socket.error(errno.EAGAIN, 'would block')
+        return self.replies.pop(0)
+
+    def answer(self, *addresses):
+        """Reply to every sent ECHO to one of C{addresses}."""
+        for packet, (address, port) in self.sent:
+            if address in addresses:
+                type, code, checksum, packet_id, seq_no = struct.unpack(
+                    '!BBHHH', packet[:8])
+                data = packet[8:]
+                checksum = _in_cksum(struct.pack('!BBHHH', ECHOREPLY, 0, 0,
+                    packet_id, seq_no) + data)
+                reply = '\0' * 20 + struct.pack('!BBHHH', ECHOREPLY, 0,
+                    checksum, packet_id, seq_no) + data
+                self.replies.append((reply, (address, 0)))
+        self.sent = []
+
+
+class ChecksumTestCase(unittest.TestCase):
+    """Test cases for packing and checking ICMP packages."""
+
+    def test_template_matches_full_checksum(self):
+        template = _EchoTemplate(0x1234, 55)
+        for sequence_no in (0, 1, 0x00ff, 0x8000, 0xfffe, 0xffff):
+            self.assertEquals(template.pack(sequence_no),
+                _pack_icmp(0x1234, sequence_no, 55))
+
+    def test_valid_cksum(self):
+        packet = _EchoTemplate(1, 55).pack(7)
+        self.assertTrue(_valid_cksum(packet))
+        self.assertFalse(_valid_cksum(packet[:-1] + '\0'))
+
+
+class PingerTestCase(unittest.TestCase):
+    """Test cases for C{Pinger}."""
+
+    def setUp(self):
+        self.reactor = _Reactor()
+        self.socket = _FakeICMPSocket()
+        self.pinger = Pinger(self.reactor, self.socket,
+            ['10.0.0.1', '10.0.0.2', '10.0.0.3'], timeout=1.0, window=10)
+
+    def _round(self, *answering):
+        self.pinger.probe()
+        self.socket.answer(*answering)
+        self.reactor.advance(0.1)
+        self.pinger.doRead()
+        self.reactor.advance(0.1)
+
+    def test_probes_are_sent_to_every_target(self):
+        self.pinger.probe()
+        self.assertEquals(sorted(address for (packet, (address, port))
+                                 in self.socket.sent),
+            ['10.0.0.1', '10.0.0.2', '10.0.0.3'])
+
+    def test_not_reachable_before_any_reply(self):
+        self.assertFalse(self.pinger.reachable())
+
+    def test_replies_are_handled_in_one_read(self):
+        self._round('10.0.0.1', '10.0.0.2', '10.0.0.3')
+        self.assertEquals(self.socket.replies, [])
+        self.assertTrue(self.pinger.reachable())
+        self.assertAlmostEqual(self.pinger.targets[0].rtt(), 0.1)
+
+    def test_quorum_of_targets_is_enough(self):
+        for i in range(10):
+            self._round('10.0.0.1', '10.0.0.2')
+        self.assertEquals(self.pinger.targets[2].loss(), 1.0)
+        self.assertTrue(self.pinger.reachable())
+
+    def test_single_lost_probe_is_tolerated(self):
+        for i in range(5):
+            self._round('10.0.0.1', '10.0.0.2', '10.0.0.3')
+        self._round()
+        self._round('10.0.0.1', '10.0.0.2', '10.0.0.3')
+        self.assertTrue(self.pinger.reachable())
+
+    def test_uplink_loss_is_detected(self):
+        for i in range(10):
+            self._round('10.0.0.1', '10.0.0.2', '10.0.0.3')
+        rounds = 0
+        while self.pinger.reachable():
+            self._round()
+            rounds += 1
+        # Six of the ten probes in the window must be lost, and the
+        # last one is only counted after the timeout.
+        self.assertTrue(rounds * 0.2 < 3, rounds)
+
+    def test_replies_from_other_addresses_are_ignored(self):
+        self.pinger.probe()
+        packet, address = self.socket.sent[0]
+        self.socket.answer(address[0])
+        reply, source = self.socket.replies[0]
+        self.socket.replies[0] = (reply, ('10.9.9.9', 0))
+        self.pinger.doRead()
+        self.assertEquals(len(self.pinger.targets[0].outcomes), 0)
+
+    def test_replies_with_bad_checksum_are_ignored(self):
+        self.pinger.probe()
+        self.socket.answer('10.0.0.1')
+        reply, source = self.socket.replies[0]
+        self.socket.replies[0] = (reply[:-1] + '\0', source)
+        self.pinger.doRead()
+        self.assertEquals(len(self.pinger.targets[0].outcomes), 0)
+
+    def test_replies_to_other_processes_are_ignored(self):
+        self.pinger.probe()
+        self.socket.answer('10.0.0.1')
+        reply, source = self.socket.replies[0]
+        other = Pinger(self.reactor, _FakeICMPSocket(), ['10.0.0.1'])
+        other._template = _EchoTemplate(
+            (self.pinger._template.packet_id + 1) & 0xffff, 55)
+        other.probe()
+        other._socket.answer('10.0.0.1')
+        self.socket.replies = other._socket.replies
+        self.pinger.doRead()
+        self.assertEquals(len(self.pinger.targets[0].outcomes), 0)
+
+    def test_stats(self):
+        self._round('10.0.0.1')
+        self.reactor.advance(1)
+        self.pinger.probe()
+        stats = self.pinger.stats()['10.0.0.2']
+        self.assertEquals((stats['sent'], stats['received'], stats['lost']),
+            (2, 0, 1))
+        stats = self.pinger.stats()['10.0.0.1']
+        self.assertEquals(stats['received'], 1)
+        self.assertEquals([count for (bound, count) in stats['histogram']
+                           if bound == 0.1], [1])
@@ -0,0 +1,161 @@
+# Copyright 2011 Johan Rydberg
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from twisted.internet import defer, task
+from twisted.trial import unittest
+
+from fechter.platform import (AbstractPlatform, canonical_resource,
+    parse_addresses)
+
+
+class _ManualPlatform(AbstractPlatform):
+    """Platform where each action completes when the test says so."""
+
+    def __init__(self, clock, concurrency):
+        AbstractPlatform.__init__(self, clock, concurrency)
+        self.running = []
+        self.installed = set()
+        self.listing = None
+
+    def _installed_resources(self):
+        if self.listing is not None:
+            return self.listing
+        return defer.succeed(set(self.installed))
+
+    def _install_resource(self, resource):
+        d = defer.Deferred()
+        self.running.append(('add', resource, d))
+        return d
+
+    def _release_resource(self, resource):
+        d = defer.Deferred()
+        self.running.append(('del', resource, d))
+        return d
+
+    def complete(self, n=0):
+        action, resource, d = self.running.pop(n)
+        d.callback(None)
+        return action, resource
+
+
+class AbstractPlatformTestCase(unittest.TestCase):
+    """Test cases for the action queue of C{AbstractPlatform}."""
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.platform = _ManualPlatform(self.clock, 2)
+
+    def test_actions_on_a_resource_are_serialized(self):
+        self.platform.assign_resource('A', True, 'eth0:a')
+        d = self.platform.assign_resource('A', False, 'eth0:a')
+        self.assertEquals([r[:2] for r in self.platform.running],
+            [('add', 'eth0:a')])
+        self.platform.complete()
+        self.assertEquals([r[:2] for r in self.platform.running],
+            [('del', 'eth0:a')])
+        self.assertNoResult(d)
+        self.platform.complete()
+        self.successResultOf(d)
+
+    def test_concurrency_is_limited(self):
+        for resource_id in 'ABC':
+            self.platform.assign_resource(resource_id, True, resource_id)
+        self.assertEquals(len(self.platform.running), 2)
+        self.assertEquals(self.platform.depth, 3)
+        self.platform.complete()
+        self.assertEquals([r[1] for r in self.platform.running], ['B', 'C'])
+
+    def test_latency_is_recorded(self):
+        self.platform.assign_resource('A', True, 'eth0:a')
+        self.clock.advance(2)
+        self.platform.complete()
+        stats = self.platform.stats()
+        self.assertEquals(stats['depth'], 0)
+        self.assertEquals(stats['completed'], 1)
+        self.assertEquals(stats['last_latency'], 2)
+
+    def test_failures_are_reported(self):
+        d = self.platform.assign_resource('A', True, 'eth0:a')
+        self.platform.running.pop()[2].errback(RuntimeError())
+        self.failureResultOf(d, RuntimeError)
+        self.assertEquals(self.platform.stats()['failed'], 1)
+
+
+class ReconcileTestCase(unittest.TestCase):
+    """Test cases for C{AbstractPlatform.reconcile}."""
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.platform = _ManualPlatform(self.clock, 10)
+        self.resources = {'A': 'eth0:a', 'B': 'eth0:b', 'C': 'eth0:c'}
+
+    def test_only_differences_are_applied(self):
+        self.platform.installed = set(['eth0:a', 'eth0:c', 'eth0:other'])
+        d = self.platform.reconcile(
+            lambda: (self.resources, set(['A', 'B'])))
+        self.assertEquals(sorted(r[:2] for r in self.platform.running),
+            [('add', 'eth0:b'), ('del', 'eth0:c')])
+        self.platform.complete()
+        self.platform.complete()
+        self.assertEquals(self.successResultOf(d), 2)
+        self.assertEquals(sorted(self.platform._assigned_resources),
+            ['A', 'B'])
+
+    def test_resources_with_queued_actions_are_skipped(self):
+        self.platform.assign_resource('B', True, 'eth0:b')
+        self.platform.reconcile(lambda: (self.resources, set(['A', 'B'])))
+        self.assertEquals([r[:2] for r in self.platform.running],
+            [('add', 'eth0:b'), ('add', 'eth0:a')])
+
+    def test_assignments_are_read_after_listing(self):
+        self.platform.listing = defer.Deferred()
+        assigned = set()
+        d = self.platform.reconcile(lambda: (self.resources, assigned))
+        # A is assigned to us and installed while the listing runs.
+        assigned.add('A')
+        self.platform.assign_resource('A', True, 'eth0:a')
+        self.platform.complete()
+        self.platform.listing.callback(set(['eth0:a']))
+        self.assertEquals(self.platform.running, [])
+        self.assertEquals(self.successResultOf(d), 0)
+
+
+class ParseAddressesTestCase(unittest.TestCase):
+    """Test cases for C{parse_addresses}."""
+
+    def test_parse_addresses(self):
+        output = (
+            '1: lo    inet 127.0.0.1/8 scope host lo\\       '
+            'valid_lft forever preferred_lft forever\n'
+            '2: eth0    inet 10.0.0.5/32 scope global eth0\\       '
+            'valid_lft forever preferred_lft forever\n')
+        self.assertEquals(parse_addresses(output),
+            [('lo', '127.0.0.1', 8), ('eth0', '10.0.0.5', 32)])
+
+
+class CanonicalResourceTestCase(unittest.TestCase):
+    """Test cases for C{canonical_resource}."""
+
+    def test_ipv6_address_is_compressed_and_lower_case(self):
+        self.assertEquals(canonical_resource('eth0:2001:DB8:0:0:0:0:0:10'),
+            'eth0:2001:db8::10')
+
+    def test_ipv4_address_is_kept(self):
+        self.assertEquals(canonical_resource('eth0:10.0.0.1'),
+            'eth0:10.0.0.1')
+
+    def test_invalid_resources(self):
+        self.assertRaises(ValueError, canonical_resource, 'eth0:10.0.0.x')
+        self.assertRaises(ValueError, canonical_resource, 'eth0:2001::db8::1')
+        self.assertRaises(ValueError, canonical_resource, 'eth0')
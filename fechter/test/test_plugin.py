@@ -0,0 +1,35 @@
+# Copyright 2011 Johan Rydberg
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from twisted.python import usage
+from twisted.trial import unittest
+
+from twisted.plugins.fechter_plugin import Options
+
+
+class OptionsTestCase(unittest.TestCase):
+    """Test cases for the options of the twistd plugin."""
+
+    def test_weight(self):
+        options = Options()
+        options.parseOptions(['--weight', '2.5'])
+        self.assertEquals(options['weight'], 2.5)
+
+    def test_weight_must_be_positive(self):
+        self.assertRaises(usage.UsageError, Options().parseOptions,
+            ['--weight', '0'])
+        self.assertRaises(usage.UsageError, Options().parseOptions,
+            ['--weight', '-1'])
+        self.assertRaises(usage.UsageError, Options().parseOptions,
+            ['--weight', 'heavy'])
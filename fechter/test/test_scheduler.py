@@ -0,0 +1,64 @@
+# Copyright 2011 Johan Rydberg
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from twisted.internet import task
+from twisted.trial import unittest
+
+from fechter.scheduler import CoalescingScheduler
+
+
+class CoalescingSchedulerTestCase(unittest.TestCase):
+    """Test cases for C{CoalescingScheduler}."""
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.calls = []
+        self.scheduler = CoalescingScheduler(self.clock,
+            lambda: self.calls.append(self.clock.seconds()),
+            min_interval=0.2, max_delay=1.0)
+
+    def test_burst_is_collapsed_into_one_call(self):
+        for i in range(500):
+            self.scheduler.trigger()
+        self.clock.advance(0.2)
+        self.assertEquals(self.calls, [0.2])
+        self.assertEquals(self.scheduler.stats(), {'triggers': 500,
+            'runs': 1, 'absorbed': 499})
+
+    def test_call_is_not_delayed_more_than_max_delay(self):
+        for i in range(12):
+            self.scheduler.trigger()
+            self.clock.advance(0.125)
+        self.assertEquals(self.calls, [1.0])
+        self.assertTrue(self.scheduler.pending())
+
+    def test_flush_absorbs_pending_call(self):
+        self.scheduler.trigger()
+        self.clock.advance(0.1)
+        self.scheduler.flush()
+        self.assertEquals(self.calls, [0.1])
+        self.assertFalse(self.scheduler.pending())
+        self.clock.advance(1)
+        self.assertEquals(self.calls, [0.1])
+        self.assertEquals(self.scheduler.stats(), {'triggers': 2,
+            'runs': 1, 'absorbed': 1})
+
+    def test_calls_are_at_least_min_interval_apart(self):
+        self.scheduler.trigger()
+        self.clock.advance(0.2)
+        self.scheduler.trigger()
+        self.clock.advance(0.1)
+        self.assertEquals(len(self.calls), 1)
+        self.clock.advance(0.1)
+        self.assertEquals(len(self.calls), 2)
@@ -0,0 +1,120 @@
+# Copyright 2011 Johan Rydberg
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import random
+
+from twisted.internet import task
+from twisted.trial import unittest
+
+from fechter.simulator import SimulatedCluster, SimulatedNetwork
+
+
+class _Gossiper(object):
+
+    def __init__(self):
+        self.received = []
+
+    def datagramReceived(self, data, address):
+        self.received.append((data, address))
+
+
+class SimulatedNetworkTestCase(unittest.TestCase):
+    """Test cases for C{SimulatedNetwork}."""
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.network = SimulatedNetwork(self.clock)
+        self.gossipers = {}
+        for name in ['10.0.0.1:4573', '10.0.0.2:4573', '10.0.0.3:4573']:
+            self.gossipers[name] = _Gossiper()
+            self.network.connect(name, self.gossipers[name])
+
+    def _send(self, source, destination, count=1):
+        host, port = destination.split(':')
+        for i in range(count):
+            self.network.send(source, 'data', (host, int(port)))
+        self.clock.advance(1)
+        return len(self.gossipers[destination].received)
+
+    def test_delivers_after_latency(self):
+        self.network.send('10.0.0.1:4573', 'data', ('10.0.0.2', 4573))
+        self.assertEquals(self.gossipers['10.0.0.2:4573'].received, [])
+        self.clock.advance(self.network.latency)
+        self.assertEquals(self.gossipers['10.0.0.2:4573'].received,
+            [('data', ('10.0.0.1', 4573))])
+        self.assertEquals(self.network.bytes_sent, 4)
+
+    def test_nodes_that_are_down_are_unreachable(self):
+        self.network.down.add('10.0.0.2:4573')
+        self.assertEquals(self._send('10.0.0.1:4573', '10.0.0.2:4573'), 0)
+        self.assertEquals(self.network.packets_dropped, 1)
+
+    def test_partition(self):
+        self.network.partition(['10.0.0.1:4573'],
+            ['10.0.0.2:4573', '10.0.0.3:4573'])
+        self.assertEquals(self._send('10.0.0.1:4573', '10.0.0.2:4573'), 0)
+        self.assertEquals(self._send('10.0.0.3:4573', '10.0.0.2:4573'), 1)
+        self.network.heal()
+        self.assertEquals(self._send('10.0.0.1:4573', '10.0.0.2:4573'), 2)
+
+    def test_loss(self):
+        self.network.loss = 0.25
+        received = self._send('10.0.0.1:4573', '10.0.0.2:4573', 1000)
+        self.assertTrue(700 < received < 800)
+
+
+class SimulatedClusterTestCase(unittest.TestCase):
+    """Test cases for C{SimulatedCluster}."""
+
+    def setUp(self):
+        self.addCleanup(random.setstate, random.getstate())
+
+    def _kill_follower(self, **options):
+        cluster = SimulatedCluster(**options)
+        cluster.start()
+        self.assertTrue(cluster.converged())
+        leader = cluster.leader()
+        cluster.kill([protocol for protocol in cluster.protocols
+                      if protocol is not leader][0])
+        return cluster.measure()
+
+    def test_runs_are_repeatable(self):
+        self.assertEquals(self._kill_follower(seed=1),
+            self._kill_follower(seed=1))
+
+    def test_measures_moves_and_gossip(self):
+        result = self._kill_follower(incremental=True)
+        # The ten resources of the dead node move.
+        self.assertEquals(result['moves'], 10)
+        self.assertEquals(result['releases'], 0)
+        self.assertTrue(result['bytes'] > 0)
+        self.assertEquals(result['available'], result['time'])
+
+    def test_packed_assignments(self):
+        per_key = self._kill_follower(incremental=True)
+        packed = self._kill_follower(incremental=True,
+            packed_assignments=True)
+        self.assertEquals(packed['moves'], per_key['moves'])
+        self.assertTrue(packed['bytes'] < per_key['bytes'])
+
+    def test_converges_after_partition_heals(self):
+        cluster = SimulatedCluster(size=5)
+        cluster.start()
+        names = sorted(cluster.network.nodes)
+        cluster.network.partition(names[:3], names[3:])
+        majority = cluster.protocols[:3]
+        self.assertNotEquals(cluster.measure(majority)['time'], None)
+        cluster.network.heal()
+        self.assertNotEquals(cluster.measure()['time'], None)
+        self.assertTrue(cluster.converged())
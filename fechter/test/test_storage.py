@@ -0,0 +1,72 @@
+# Copyright 2011 Johan Rydberg
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from twisted.internet import task
+from twisted.trial import unittest
+
+from fechter.storage import LogStorage
+
+
+class LogStorageTestCase(unittest.TestCase):
+    """Test cases for C{LogStorage}."""
+
+    def setUp(self):
+        self.path = self.mktemp()
+        self.clock = task.Clock()
+
+    def _open(self, **kwargs):
+        return LogStorage(self.path, clock=self.clock, **kwargs)
+
+    def test_values_survive_reopen(self):
+        storage = self._open()
+        storage['a'] = [1, 'x']
+        storage['b'] = [2, None]
+        storage['a'] = [3, 'y']
+        del storage['b']
+        storage.close()
+        storage = self._open()
+        self.assertEquals(dict((key, storage[key]) for key in storage),
+            {'a': [3, 'y']})
+
+    def test_fsyncs_are_batched(self):
+        storage = self._open(fsync_interval=1)
+        for i in range(10):
+            storage['a'] = [i, 'x']
+            storage.sync()
+        self.assertEquals(storage.fsyncs, 0)
+        self.clock.advance(1)
+        self.assertEquals(storage.fsyncs, 1)
+        storage.close()
+
+    def test_log_is_compacted(self):
+        storage = self._open(compact_ratio=2, compact_min=10)
+        for i in range(11):
+            storage['a'] = [i, 'x']
+            storage.sync()
+        self.assertEquals(storage.compactions, 1)
+        storage.close()
+        self.assertEquals(len(open(self.path).readlines()), 1)
+        self.assertEquals(self._open()['a'], [10, 'x'])
+
+    def test_broken_last_record_is_ignored(self):
+        storage = self._open()
+        storage['a'] = [1, 'x']
+        storage.close()
+        with open(self.path, 'ab') as fp:
+            fp.write('["b", [2')
+        storage = self._open()
+        self.assertEquals(list(storage), ['a'])
+        storage['c'] = [3, 'z']
+        storage.close()
+        self.assertEquals(sorted(self._open()), ['a', 'c'])
@@ -20,9 +20,8 @@ from twisted.python import usage
 from twisted.plugin import IPlugin
 from twisted.application.service import IServiceMaker
 from twisted.internet import reactor
-import shelve
 
-from fechter import service
+from fechter import service, assign, storage
 
 
 
@@ -35,12 +34,67 @@ distribute IP addresses over a cluster.
     optParameters = (
         ("port", "p", 4573, "The port number to listen on."),
         ("listen-address", "a", None, "The listen address."),
-        ("gateway", "g", None, "Gateway to check connecticity with"),
+        ("gateway", "g", None,
+         "Gateways to check connecticity with, separated by commas"),
         ("data-file", "d", "fechter.data", "File to store data in."),
+        ("storage", None, "shelve", "Storage backend: shelve or log"),
         ("attach", "s", None, "Address to running Fechter instance."),
-        ("dead-at", "D", "8", "Treat peers when PHI larger than this")
+        ("dead-at", "D", "8",
+         "Treat peers as dead when PHI larger than this"),
+        ("gossip-interval", None, "1",
+         "Seconds between heartbeats and gossip rounds"),
+        ("vote-delay", None, "2",
+         "Seconds to wait after a membership change before voting"),
+        ("strategy", None, "least-loaded",
+         "Placement strategy: least-loaded or rendezvous"),
+        ("rank", None, "0",
+         "Peers with lower rank come first when placing resources"),
+        ("weight", None, "1",
+         "Relative share of resources this node should receive"),
+        ("max-imbalance", None, "1",
+         "Allowed difference in number of resources between nodes"),
+        ("rebalance-interval", None, "0.2",
+         "Seconds of quiet to wait for before rebalancing"),
+        ("rebalance-max-delay", None, "1.0",
+         "Maximum seconds to hold back a rebalance"),
+        ("gc-interval", None, "60",
+         "Seconds between collections of deleted keys"),
+        ("tombstone-max-age", None, "3600",
+         "Drop deleted keys after this many seconds"),
+        ("concurrency", None, "64",
+         "Maximum number of address changes in flight"),
+        ("arp-schedule", None, "0,1,2,4",
+         "Seconds after takeover to send gratuitous ARPs at"),
+        ("probe-interval", None, "0.2",
+         "Seconds between pings to the gateways"),
+        ("max-loss", None, "0.5",
+         "Fraction of recent pings a gateway may lose"),
+        ("quorum", None, None,
+         "Number of gateways that must answer (default: a majority)"),
+        ("reconcile-interval", None, "60",
+         "Seconds between checks of the installed addresses"),
         )
 
+    optFlags = (
+        ("incremental", "i", "Keep existing assignments when rebalancing"),
+        ("no-netlink", None, "Install addresses using /sbin/ip"),
+        ("adaptive-detection", None,
+         "Adapt failure detection to the jitter of each peer"),
+        ("fast-takeover", None,
+         "Take over addresses of dead nodes without waiting for the leader"),
+        ("packed-assignments", None,
+         "Gossip all assignments as one key"),
+        )
+
+    def postOptions(self):
+        try:
+            weight = float(self['weight'])
+        except ValueError:
+            raise usage.UsageError("%s: invalid weight" % (self['weight'],))
+        if not weight > 0:
+            raise usage.UsageError("weight must be positive")
+        self['weight'] = weight
+
 
 class MyServiceMaker(object):
     implements(IServiceMaker, IPlugin)
@@ -60,16 +114,61 @@ class MyServiceMaker(object):
                 str(err)))
         if not options['gateway']:
             raise usage.UsageError("gateway must be specified")
+        gateways = []
+        for gateway in options['gateway'].split(','):
+            try:
+                gateways.append(socket.gethostbyname(gateway))
+            except socket.error, err:
+                raise usage.UsageError("%s: %s" % (gateway, str(err)))
+        quorum = options['quorum']
+        if quorum is not None:
+            quorum = int(quorum)
+            if not 1 <= quorum <= len(gateways):
+                raise usage.UsageError("quorum must be between 1 and %d" % (
+                        len(gateways),))
+
+        if options['strategy'] == 'least-loaded':
+            strategy = assign.LeastLoadedStrategy(
+                max_imbalance=int(options['max-imbalance']))
+        elif options['strategy'] == 'rendezvous':
+            strategy = assign.RendezvousStrategy()
+        else:
+            raise usage.UsageError("%s: unknown strategy" % (
+                    options['strategy'],))
+
         try:
-            gateway = socket.gethostbyname(options['gateway'])
-        except socket.error, err:
-            raise usage.UsageError("%s: %s" % (options['gateway'],
-                str(err)))
+            arp_schedule = [float(delay) for delay in
+                            options['arp-schedule'].split(',')]
+        except ValueError:
+            raise usage.UsageError("%s: invalid ARP schedule" % (
+                    options['arp-schedule'],))
+
+        try:
+            data = storage.open_storage(options['storage'],
+                options['data-file'], reactor)
+        except ValueError, err:
+            raise usage.UsageError(str(err))
 
         fechter = service.Fechter(
-            reactor, listen_addr, int(options['port']), gateway,
-            shelve.open(options['data-file'], writeback=True),
-            phi=int(options['dead-at']))
+            reactor, listen_addr, int(options['port']), gateways, data,
+            phi=float(options['dead-at']),
+            adaptive_detection=options['adaptive-detection'],
+            gossip_interval=float(options['gossip-interval']),
+            vote_delay=float(options['vote-delay']),
+            fast_takeover=options['fast-takeover'],
+            packed_assignments=options['packed-assignments'],
+            rank=int(options['rank']), weight=options['weight'],
+            strategy=strategy, incremental=options['incremental'],
+            rebalance_interval=float(options['rebalance-interval']),
+            rebalance_max_delay=float(options['rebalance-max-delay']),
+            gc_interval=float(options['gc-interval']),
+            tombstone_max_age=float(options['tombstone-max-age']),
+            use_netlink=not options['no-netlink'],
+            concurrency=int(options['concurrency']),
+            arp_schedule=arp_schedule,
+            reconcile_interval=float(options['reconcile-interval']),
+            probe_interval=float(options['probe-interval']),
+            max_loss=float(options['max-loss']), quorum=quorum)
         if options['attach']:
             attach, port = options['attach'], int(options['port'])
             if ':' in attach: